@@ -0,0 +1,147 @@
+import sqlite3
+import logging
+from collections import namedtuple
+
+from directory import add_recipient
+import pii
+import fx
+import audit
+
+logger = logging.getLogger(__name__)
+
+# Cached per-user account map.
+# Account metadata (number, type, currency) rarely changes, so handlers resolve accounts from
+# memory; balances are always read from the accounts table.
+ACCOUNT_TYPES = ('savings', 'current')
+MAX_ACCOUNTS_PER_USER = 5
+
+Account = namedtuple('Account', ['id', 'number', 'type', 'currency'])
+
+_accounts = {}  # user id -> [Account], oldest first
+_active = {}    # user id -> active account id
+
+
+def _load_user(cursor, user_id):
+    cursor.execute(
+        'SELECT id, accountNumber, accountType, currency FROM accounts WHERE userId = ? ORDER BY id',
+        (user_id,)
+    )
+    accounts = [Account(*row) for row in cursor.fetchall()]
+    cursor.execute('SELECT activeAccountId FROM users WHERE id = ?', (user_id,))
+    row = cursor.fetchone()
+    _accounts[user_id] = accounts
+    active_id = row[0] if row else None
+    if accounts and active_id not in [account.id for account in accounts]:
+        active_id = accounts[0].id
+    _active[user_id] = active_id
+    return accounts
+
+
+def warm_accounts(db_path='banking_bot.db'):
+    """Load every user's accounts into memory."""
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT userId, id, accountNumber, accountType, currency FROM accounts ORDER BY id')
+        rows = cursor.fetchall()
+        cursor.execute('SELECT id, activeAccountId FROM users')
+        active = dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        logger.error('Failed to warm account map: %s', e)
+        return 0
+    finally:
+        connection.close()
+
+    _accounts.clear()
+    _active.clear()
+    for user_id, *account in rows:
+        _accounts.setdefault(user_id, []).append(Account(*account))
+    for user_id, accounts in _accounts.items():
+        active_id = active.get(user_id)
+        _active[user_id] = active_id if active_id in [a.id for a in accounts] else accounts[0].id
+    return len(rows)
+
+
+def get_accounts(user_id, db_path='banking_bot.db'):
+    accounts = _accounts.get(user_id)
+    if accounts is None:
+        connection = sqlite3.connect(db_path)
+        try:
+            accounts = _load_user(connection.cursor(), user_id)
+        finally:
+            connection.close()
+    return accounts
+
+
+def get_account(user_id, account_id, db_path='banking_bot.db'):
+    for account in get_accounts(user_id, db_path):
+        if account.id == account_id:
+            return account
+    return None
+
+
+def get_active_account(user_id, db_path='banking_bot.db'):
+    """The account the user's operations apply to, or None for unregistered users."""
+    accounts = get_accounts(user_id, db_path)
+    if not accounts:
+        return None
+    return get_account(user_id, _active.get(user_id), db_path) or accounts[0]
+
+
+def find_account_by_number(user_id, account_number, db_path='banking_bot.db'):
+    for account in get_accounts(user_id, db_path):
+        if account.number == account_number:
+            return account
+    return None
+
+
+def set_active_account(user_id, account_id, db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute('UPDATE users SET activeAccountId = ? WHERE id = ?', (account_id, user_id))
+        connection.commit()
+    finally:
+        connection.close()
+    _active[user_id] = account_id
+
+
+def register_account(user_id, account_id, account_number, account_type, currency):
+    """Add an account created elsewhere (e.g. at registration) to the map."""
+    _accounts.setdefault(user_id, []).append(Account(account_id, account_number, account_type, currency))
+    _active.setdefault(user_id, account_id)
+
+
+def open_account(user_id, account_type, currency, db_path='banking_bot.db'):
+    """Open another account for `user_id`. Returns the new Account."""
+    if account_type not in ACCOUNT_TYPES:
+        raise ValueError(f'Unknown account type {account_type}.')
+    if currency not in fx.currencies():
+        raise ValueError(f'Unsupported currency {currency}.')
+    existing = get_accounts(user_id, db_path)
+    if len(existing) >= MAX_ACCOUNTS_PER_USER:
+        raise ValueError(f'You can hold at most {MAX_ACCOUNTS_PER_USER} accounts.')
+
+    # ACC<telegram id> is the first account; later ones get a '-<n>' suffix
+    account_number = f'ACC{user_id}-{len(existing) + 1}'
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        audit.set_context(cursor, f'user:{user_id}', 'open account')
+        cursor.execute(
+            'INSERT INTO accounts (userId, accountNumber, accountType, balance, currency) VALUES (?, ?, ?, 0, ?)',
+            (user_id, account_number, account_type, currency)
+        )
+        account_id = cursor.lastrowid
+        audit.commit(connection)
+    finally:
+        connection.close()
+
+    register_account(user_id, account_id, account_number, account_type, currency)
+    add_recipient(user_id, pii.get_profile(user_id, db_path).name, None, account_id, account_number)
+    return get_account(user_id, account_id, db_path)
+
+
+def get_balance(cursor, account_id):
+    cursor.execute('SELECT balance FROM accounts WHERE id = ?', (account_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,134 @@
+import sqlite3
+import logging
+import asyncio
+import datetime
+
+import scoring
+
+logger = logging.getLogger(__name__)
+
+# Daily interest and late-penalty accrual for active loans.
+# Each run accrues every loan from its lastAccrualDate up to `as_of`, one id range at a time,
+# with two set-based statements per batch: the ledger insert and the loan state update.
+DEFAULT_INTEREST_RATE = 0.23    # annual, same as the rate offered in the loan flow
+PENALTY_RATE_DAILY = 0.001      # 0.1% of the outstanding balance per overdue day
+ACCRUAL_BATCH_SIZE = 20000
+CHECK_INTERVAL_SECONDS = 3600
+
+_INSERT_ACCRUALS = '''
+    INSERT OR IGNORE INTO loan_accruals (loanId, accrualDate, days, interest, penalty)
+    SELECT id, :as_of, days,
+           ROUND(remainingBalance * interestRate * days / 365.0, 2),
+           ROUND(remainingBalance * :penalty_rate * MIN(days, MAX(overdue, 0)), 2)
+    FROM (
+        SELECT id, remainingBalance, interestRate,
+               CAST(julianday(:as_of) - julianday(lastAccrualDate) AS INTEGER) AS days,
+               CAST(julianday(:as_of) - julianday(nextDueDate) AS INTEGER) AS overdue
+        FROM loans
+        WHERE id > :low AND id <= :high AND remainingBalance > 0 AND lastAccrualDate < :as_of
+    )
+'''
+
+_UPDATE_LOANS = '''
+    UPDATE loans SET
+        remainingBalance = remainingBalance + a.interest + a.penalty,
+        accruedInterest = accruedInterest + a.interest,
+        accruedPenalty = accruedPenalty + a.penalty,
+        overdueDays = MAX(CAST(julianday(:as_of) - julianday(loans.nextDueDate) AS INTEGER), 0),
+        worstOverdueDays = MAX(worstOverdueDays, CAST(julianday(:as_of) - julianday(loans.nextDueDate) AS INTEGER)),
+        lastAccrualDate = :as_of
+    FROM loan_accruals a
+    WHERE a.loanId = loans.id AND a.accrualDate = :as_of
+      AND loans.id > :low AND loans.id <= :high AND loans.lastAccrualDate < :as_of
+'''
+
+
+def _today():
+    # Loan start and due dates are written with SQLite date('now'), which is UTC
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def run_accrual(as_of=None, batch_size=ACCRUAL_BATCH_SIZE, penalty_rate=PENALTY_RATE_DAILY,
+                db_path='banking_bot.db'):
+    """
+    Accrue interest and penalties on all active loans up to `as_of` (an ISO date, today in UTC by default).
+    Safe to re-run: loans already accrued for `as_of` are skipped. Returns the number of loans accrued.
+    """
+    as_of = as_of or _today()
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    accrued = 0
+    try:
+        cursor.execute('SELECT MAX(id) FROM loans')
+        max_id = cursor.fetchone()[0] or 0
+        params = {'as_of': as_of, 'penalty_rate': penalty_rate}
+        for low in range(0, max_id, batch_size):
+            params['low'] = low
+            params['high'] = low + batch_size
+            cursor.execute(_INSERT_ACCRUALS, params)
+            cursor.execute(_UPDATE_LOANS, params)
+            accrued += cursor.rowcount
+            connection.commit()
+    except sqlite3.Error as e:
+        connection.rollback()
+        logger.error('Loan accrual failed: %s', e)
+    finally:
+        connection.close()
+        if accrued:
+            # Overdue days feed the credit decisions
+            scoring.clear_loan_state()
+
+    logger.info('Accrued interest on %s loans as of %s.', accrued, as_of)
+    return accrued
+
+
+def accrue_loan_reference(loan, as_of, penalty_rate=PENALTY_RATE_DAILY):
+    """
+    Plain Python version of one accrual step, used to check the SQL engine.
+    `loan` is a dict with the loans columns; returns (updated loan, interest, penalty).
+    """
+    as_of_date = datetime.date.fromisoformat(as_of)
+    last = datetime.date.fromisoformat(loan['lastAccrualDate'])
+    if loan['remainingBalance'] <= 0 or last >= as_of_date:
+        return loan, 0.0, 0.0
+
+    days = (as_of_date - last).days
+    overdue = (as_of_date - datetime.date.fromisoformat(loan['nextDueDate'])).days
+    balance = loan['remainingBalance']
+    interest = round(balance * loan['interestRate'] * days / 365.0, 2)
+    penalty = round(balance * penalty_rate * min(days, max(overdue, 0)), 2)
+
+    updated = dict(loan)
+    updated['remainingBalance'] = balance + interest + penalty
+    updated['accruedInterest'] = loan['accruedInterest'] + interest
+    updated['accruedPenalty'] = loan['accruedPenalty'] + penalty
+    updated['overdueDays'] = max(overdue, 0)
+    updated['worstOverdueDays'] = max(loan['worstOverdueDays'], overdue)
+    updated['lastAccrualDate'] = as_of
+    return updated, interest, penalty
+
+
+def reschedule(balance, remaining_months, monthly_payment=None):
+    """
+    (monthly payment, remaining months) once a payment leaves `balance` outstanding. Without
+    `monthly_payment` the balance is spread evenly over the remaining months. Interest or
+    penalty accrued after the last installment is due as one more installment a month later.
+    """
+    if balance <= 0:
+        return 0, 0
+    if remaining_months <= 0:
+        return balance, 1
+    if monthly_payment is None:
+        return balance / remaining_months, remaining_months
+    return monthly_payment, remaining_months
+
+
+# Background task: accrue once per UTC calendar day
+async def run_accrual_scheduler(interval_seconds=CHECK_INTERVAL_SECONDS):
+    last_run = None
+    while True:
+        today = _today()
+        if today != last_run:
+            await asyncio.to_thread(run_accrual, today)
+            last_run = today
+        await asyncio.sleep(interval_seconds)
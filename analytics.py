@@ -0,0 +1,234 @@
+import sqlite3
+import logging
+import asyncio
+import json
+import os
+import datetime
+
+import numpy as np
+
+from archive import open_history_connection
+
+logger = logging.getLogger(__name__)
+
+# Columnar copy of the ledger for aggregate reporting. Every column is a raw little-endian
+# array file that is only ever appended to and read back with np.memmap; meta.json holds
+# the row counts, the transaction type codes and the high-water-mark transaction id.
+EXPORT_DIR = 'ledger_columns'
+
+TRANSACTION_COLUMNS = {
+    'id': '<i8',
+    'accountId': '<i8',
+    'day': '<i4',      # days since 1970-01-01
+    'amount': '<f8',
+    'type': '<i2',     # code from meta['transactionTypes']
+}
+
+LOAN_COLUMNS = {
+    'snapshotDay': '<i4',
+    'loanId': '<i8',
+    'userId': '<i8',
+    'durationMonths': '<i2',
+    'loanAmount': '<f8',
+    'remainingBalance': '<f8',
+}
+
+EXPORT_BATCH_SIZE = 50000
+EXPORT_INTERVAL_SECONDS = 3600
+
+# SQLite expression turning a TIMESTAMP into days since the Unix epoch
+_DAY_EXPR = "CAST(julianday(transactionDate) - 2440587.5 AS INTEGER)"
+
+
+def _meta_path(export_dir):
+    return os.path.join(export_dir, 'meta.json')
+
+
+def load_meta(export_dir=EXPORT_DIR):
+    path = _meta_path(export_dir)
+    if not os.path.exists(path):
+        return {
+            'lastTransactionId': 0,
+            'transactionRows': 0,
+            'transactionTypes': {},
+            'loanRows': 0,
+            'lastLoanSnapshotDay': None,
+        }
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_meta(meta, export_dir):
+    # Column files are flushed before the meta file is replaced, so a crash in between
+    # only leaves unreferenced bytes at the end of the columns
+    tmp_path = _meta_path(export_dir) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, _meta_path(export_dir))
+
+
+def _append_columns(export_dir, table, columns, arrays, committed_rows):
+    for name, dtype in columns.items():
+        path = os.path.join(export_dir, f'{table}.{name}.bin')
+        with open(path, 'ab') as f:
+            # Drop a torn tail from an interrupted export before appending
+            f.truncate(committed_rows * np.dtype(dtype).itemsize)
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def load_columns(table, export_dir=EXPORT_DIR, meta=None):
+    """Memory-map every column of `table` ('transactions' or 'loans')."""
+    meta = meta or load_meta(export_dir)
+    columns = TRANSACTION_COLUMNS if table == 'transactions' else LOAN_COLUMNS
+    rows = meta['transactionRows'] if table == 'transactions' else meta['loanRows']
+    result = {}
+    for name, dtype in columns.items():
+        path = os.path.join(export_dir, f'{table}.{name}.bin')
+        if rows == 0:
+            result[name] = np.empty(0, dtype=dtype)
+        else:
+            result[name] = np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+    return result
+
+
+def export_transactions(db_path='banking_bot.db', export_dir=EXPORT_DIR, batch_size=EXPORT_BATCH_SIZE):
+    """Append every transaction above the high-water mark. Returns the number of rows exported."""
+    os.makedirs(export_dir, exist_ok=True)
+    meta = load_meta(export_dir)
+    type_codes = meta['transactionTypes']
+    exported = 0
+
+    # Read through the unified view so rows that were already archived are not missed
+    connection = open_history_connection(db_path)
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(
+                f'''
+                SELECT id, accountId, {_DAY_EXPR}, amount, transactionType
+                FROM all_transactions
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+                ''',
+                (meta['lastTransactionId'], batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            ids, account_ids, days, amounts, types = zip(*rows)
+            for transaction_type in set(types):
+                if transaction_type not in type_codes:
+                    type_codes[transaction_type] = len(type_codes)
+            arrays = {
+                'id': ids,
+                'accountId': account_ids,
+                'day': [day if day is not None else -1 for day in days],
+                'amount': amounts,
+                'type': [type_codes[t] for t in types],
+            }
+            _append_columns(export_dir, 'transactions', TRANSACTION_COLUMNS, arrays, meta['transactionRows'])
+
+            meta['transactionRows'] += len(rows)
+            meta['lastTransactionId'] = ids[-1]
+            _save_meta(meta, export_dir)
+            exported += len(rows)
+    except sqlite3.Error as e:
+        logger.error('Transaction export failed: %s', e)
+    finally:
+        connection.close()
+    return exported
+
+
+def export_loan_snapshot(db_path='banking_bot.db', export_dir=EXPORT_DIR):
+    """Append today's (UTC) state of every loan, at most once per day. Returns the number of rows exported."""
+    os.makedirs(export_dir, exist_ok=True)
+    meta = load_meta(export_dir)
+    # UTC like the transaction days, which come from CURRENT_TIMESTAMP
+    today = (datetime.datetime.now(datetime.timezone.utc).date() - datetime.date(1970, 1, 1)).days
+    if meta['lastLoanSnapshotDay'] == today:
+        return 0
+
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT id, userId, durationMonths, loanAmount, remainingBalance FROM loans ORDER BY id')
+        rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error('Loan snapshot export failed: %s', e)
+        return 0
+    finally:
+        connection.close()
+
+    if rows:
+        loan_ids, user_ids, durations, amounts, balances = zip(*rows)
+        arrays = {
+            'snapshotDay': np.full(len(rows), today),
+            'loanId': loan_ids,
+            'userId': user_ids,
+            'durationMonths': durations,
+            'loanAmount': amounts,
+            'remainingBalance': balances,
+        }
+        _append_columns(export_dir, 'loans', LOAN_COLUMNS, arrays, meta['loanRows'])
+    meta['loanRows'] += len(rows)
+    meta['lastLoanSnapshotDay'] = today
+    _save_meta(meta, export_dir)
+    return len(rows)
+
+
+def export_ledger(db_path='banking_bot.db', export_dir=EXPORT_DIR):
+    return export_transactions(db_path, export_dir), export_loan_snapshot(db_path, export_dir)
+
+
+# Background task: keep the columnar copy up to date with the ledger
+async def run_export_scheduler(interval_seconds=EXPORT_INTERVAL_SECONDS):
+    while True:
+        try:
+            transactions, loans = await asyncio.to_thread(export_ledger)
+            if transactions or loans:
+                logger.info('Exported %s transactions and %s loan rows to %s.', transactions, loans, EXPORT_DIR)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.error('Ledger export failed: %s', e)
+        await asyncio.sleep(interval_seconds)
+
+
+# Vectorized query layer
+
+def group_sum(keys, values):
+    """Return (unique keys, sum of values per key, count per key)."""
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=values, minlength=len(unique_keys))
+    counts = np.bincount(inverse, minlength=len(unique_keys))
+    return unique_keys, sums, counts
+
+
+def day_to_date(day):
+    return datetime.date(1970, 1, 1) + datetime.timedelta(days=int(day))
+
+
+def daily_totals(transaction_type, export_dir=EXPORT_DIR):
+    """[(date, count, total absolute amount)] for one transaction type, e.g. 'Donation'."""
+    meta = load_meta(export_dir)
+    code = meta['transactionTypes'].get(transaction_type)
+    if code is None:
+        return []
+    columns = load_columns('transactions', export_dir, meta)
+    mask = columns['type'] == code
+    days, sums, counts = group_sum(columns['day'][mask], np.abs(columns['amount'][mask]))
+    return [(day_to_date(day), int(count), float(total)) for day, total, count in zip(days, sums, counts)]
+
+
+def loan_book_by_duration(export_dir=EXPORT_DIR):
+    """[(duration, active loans, outstanding balance)] from the latest loan snapshot."""
+    meta = load_meta(export_dir)
+    if not meta['loanRows']:
+        return []
+    columns = load_columns('loans', export_dir, meta)
+    latest = columns['snapshotDay'] == meta['lastLoanSnapshotDay']
+    active = latest & (columns['remainingBalance'] > 0)
+    durations, sums, counts = group_sum(columns['durationMonths'][active], columns['remainingBalance'][active])
+    return [(int(d), int(count), float(total)) for d, total, count in zip(durations, sums, counts)]
@@ -0,0 +1,269 @@
+import sqlite3
+import logging
+import asyncio
+import time
+import os
+import datetime
+
+logger = logging.getLogger(__name__)
+
+# Closed periods of the transactions table are moved into one archive database per period.
+# A period is a calendar year by default; SQLite can only ATTACH a handful of databases at
+# once, so monthly periods would quickly exhaust the limit for the unified history view.
+PERIOD_FORMAT = '%Y'
+ARCHIVE_AFTER_MONTHS = 6
+BATCH_SIZE = 500
+BATCH_PAUSE_SECONDS = 0.05
+MAX_ATTACHED_ARCHIVES = 9  # SQLite default limit is 10 attached databases
+
+
+def archive_db_path(period, db_path='banking_bot.db'):
+    base, _ = os.path.splitext(db_path)
+    return f'{base}_archive_{period}.db'
+
+
+def archive_cutoff(months=ARCHIVE_AFTER_MONTHS):
+    """UTC start of the month `months` months back: transactions before it may have been archived."""
+    today = datetime.datetime.now(datetime.timezone.utc)
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    return f'{year:04d}-{month + 1:02d}-01 00:00:00'
+
+
+def ensure_archive_schema(cursor, alias):
+    """Create or upgrade the transactions table of the archive attached as `alias`."""
+    # Same layout as the live table but without the balance trigger
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {alias}.transactions (
+            id INTEGER PRIMARY KEY,
+            accountId INTEGER NOT NULL,
+            transactionDate TIMESTAMP,
+            amount REAL NOT NULL,
+            transactionType TEXT NOT NULL,
+            counterpartyId INTEGER
+        )
+    ''')
+    cursor.execute(f'PRAGMA {alias}.table_info(transactions)')
+    if 'counterpartyId' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {alias}.transactions ADD COLUMN counterpartyId INTEGER')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {alias}.idx_archive_account ON transactions(accountId, transactionDate)')
+
+
+def _attach_archive(cursor, period, db_path):
+    alias = f'archive_{period}'
+    cursor.execute('ATTACH DATABASE ? AS ' + alias, (archive_db_path(period, db_path),))
+    ensure_archive_schema(cursor, alias)
+    return alias
+
+
+def upgrade_archives(connection):
+    """Bring every existing archive up to the current layout (outside a transaction)."""
+    cursor = connection.cursor()
+    cursor.execute('SELECT period, path FROM transaction_archives')
+    for period, path in cursor.fetchall():
+        if not os.path.exists(path):
+            logger.error('Archive for period %s is missing: %s', period, path)
+            continue
+        alias = f'archive_{period}'
+        cursor.execute('ATTACH DATABASE ? AS ' + alias, (path,))
+        try:
+            ensure_archive_schema(cursor, alias)
+        finally:
+            cursor.execute(f'DETACH DATABASE {alias}')
+
+
+def _move_batch(connection, cutoff, batch_size, db_path):
+    """Move one batch of closed transactions. Returns the number of rows moved."""
+    cursor = connection.cursor()
+    cursor.execute(
+        f'''
+        SELECT id, accountId, transactionDate, amount, transactionType, counterpartyId,
+               strftime('{PERIOD_FORMAT}', transactionDate)
+        FROM transactions
+        WHERE transactionDate < ?
+        ORDER BY id
+        LIMIT ?
+        ''',
+        (cutoff, batch_size)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+
+    by_period = {}
+    for row in rows:
+        by_period.setdefault(row[6], []).append(row[:6])
+
+    # ATTACH is not allowed inside a transaction, so attach first and keep the writes short.
+    # A commit spanning the main database and an archive is not atomic in WAL mode, so the rows
+    # are copied and committed into the archives first and only deleted from the live table,
+    # in a second transaction, once they are found there. A crash in between leaves the rows
+    # in both places; the retry copies nothing new (INSERT OR IGNORE) and finishes the delete.
+    aliases = {period: _attach_archive(cursor, period, db_path) for period in by_period}
+    try:
+        cursor.execute('BEGIN')
+        for period, period_rows in by_period.items():
+            cursor.executemany(
+                f'INSERT OR IGNORE INTO {aliases[period]}.transactions '
+                '(id, accountId, transactionDate, amount, transactionType, counterpartyId) VALUES (?, ?, ?, ?, ?, ?)',
+                period_rows
+            )
+        connection.commit()
+
+        for period, period_rows in by_period.items():
+            ids = [row[0] for row in period_rows]
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {aliases[period]}.transactions WHERE id IN ({",".join("?" * len(ids))})',
+                ids
+            )
+            if cursor.fetchone()[0] != len(ids):
+                raise sqlite3.DatabaseError(f'Archive for period {period} is missing copied transactions')
+
+        cursor.execute('BEGIN IMMEDIATE')
+        for period, period_rows in by_period.items():
+            # Leave a per-account snapshot behind so balances stay explainable from the live db
+            totals = {}
+            for _, account_id, _, amount, _, _ in period_rows:
+                total, count = totals.get(account_id, (0.0, 0))
+                totals[account_id] = (total + amount, count + 1)
+            cursor.executemany(
+                '''
+                INSERT INTO balance_snapshots (accountId, period, amount, transactionCount)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (accountId, period) DO UPDATE SET
+                    amount = amount + excluded.amount,
+                    transactionCount = transactionCount + excluded.transactionCount
+                ''',
+                [(account_id, period, total, count) for account_id, (total, count) in totals.items()]
+            )
+            cursor.execute(
+                'INSERT OR IGNORE INTO transaction_archives (period, path) VALUES (?, ?)',
+                (period, archive_db_path(period, db_path))
+            )
+
+        cursor.executemany('DELETE FROM transactions WHERE id = ?', [(row[0],) for row in rows])
+        connection.commit()
+    except sqlite3.Error:
+        if connection.in_transaction:
+            connection.rollback()
+        raise
+    finally:
+        for alias in aliases.values():
+            cursor.execute(f'DETACH DATABASE {alias}')
+    return len(rows)
+
+
+def archive_transactions(months=ARCHIVE_AFTER_MONTHS, batch_size=BATCH_SIZE, max_batches=None,
+                         pause=BATCH_PAUSE_SECONDS, db_path='banking_bot.db'):
+    """
+    Move transactions older than `months` full months into the archive databases,
+    one short write transaction per batch. Returns the number of rows moved.
+    """
+    # Autocommit mode so ATTACH/DETACH and our explicit BEGIN are not wrapped by the driver
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    cursor = connection.cursor()
+    moved = 0
+    batches = 0
+    cutoff = None
+    try:
+        cutoff = archive_cutoff(months)
+        while max_batches is None or batches < max_batches:
+            count = _move_batch(connection, cutoff, batch_size, db_path)
+            if not count:
+                break
+            moved += count
+            batches += 1
+            if pause:
+                # Give the bot's writers a chance to grab the lock between batches
+                time.sleep(pause)
+    except sqlite3.Error as e:
+        logger.error('Transaction archival failed: %s', e)
+    finally:
+        connection.close()
+
+    if moved:
+        logger.info('Archived %s transactions older than %s.', moved, cutoff)
+    return moved
+
+
+# Open a read connection with a unified `all_transactions` view over the live and archived rows
+def open_history_connection(db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    cursor.execute('SELECT period, path FROM transaction_archives ORDER BY period DESC')
+    archives = cursor.fetchall()
+    if len(archives) > MAX_ATTACHED_ARCHIVES:
+        logger.warning('Only the latest %s of %s archives are included in history.', MAX_ATTACHED_ARCHIVES, len(archives))
+        archives = archives[:MAX_ATTACHED_ARCHIVES]
+
+    columns = 'id, accountId, transactionDate, amount, transactionType, counterpartyId'
+    selects = [f'SELECT {columns} FROM main.transactions']
+    for period, path in archives:
+        if not os.path.exists(path):
+            logger.error('Archive for period %s is missing: %s', period, path)
+            continue
+        alias = f'archive_{period}'
+        cursor.execute('ATTACH DATABASE ? AS ' + alias, (path,))
+        # Rows still in the live table are mid-move (see _move_batch) and counted there
+        selects.append(
+            f'SELECT {columns} FROM {alias}.transactions AS archived '
+            'WHERE NOT EXISTS (SELECT 1 FROM main.transactions WHERE id = archived.id)'
+        )
+
+    cursor.execute('DROP VIEW IF EXISTS temp.all_transactions')
+    cursor.execute('CREATE TEMP VIEW all_transactions AS ' + ' UNION ALL '.join(selects))
+    return connection
+
+
+def get_transaction_history(account_id, limit=50, db_path='banking_bot.db'):
+    """Latest transactions of an account across the live table and all archives."""
+    connection = open_history_connection(db_path)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            '''
+            SELECT transactionDate, amount, transactionType
+            FROM all_transactions
+            WHERE accountId = ?
+            ORDER BY transactionDate DESC, id DESC
+            LIMIT ?
+            ''',
+            (account_id, limit)
+        )
+        return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+def get_statement_totals(account_id, db_path='banking_bot.db'):
+    """
+    Per-period (amount, count) totals for an account. Archived periods come from the
+    snapshots, so no archive has to be attached.
+    """
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            f'''
+            SELECT period, SUM(amount), SUM(transactionCount) FROM (
+                SELECT period, amount, transactionCount FROM balance_snapshots WHERE accountId = ?
+                UNION ALL
+                SELECT strftime('{PERIOD_FORMAT}', transactionDate), amount, 1 FROM transactions WHERE accountId = ?
+            )
+            GROUP BY period
+            ORDER BY period
+            ''',
+            (account_id, account_id)
+        )
+        return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+# Background task: archive a few batches at a time so the live bot never waits on a long lock
+async def run_archival_scheduler(interval_seconds=3600, batches_per_run=20):
+    while True:
+        try:
+            await asyncio.to_thread(archive_transactions, max_batches=batches_per_run)
+        except Exception as e:
+            logger.error('Archival run failed: %s', e)
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,234 @@
+import sqlite3
+import logging
+import asyncio
+import hashlib
+
+logger = logging.getLogger(__name__)
+
+# Tamper-evident audit trail of account balances.
+# Every balance change is captured where it happens, so nothing that writes balances
+# (handlers, update_account_balance, admin SQL) can skip it:
+#  - ledger entries are their own record: handlers write the actor and reason into the
+#    transactions row, and the balance trigger stamps the row's id on the account;
+#  - any other balance write (a new account, a raw UPDATE) is copied into audit_pending by
+#    triggers on accounts. Code that knows who is acting writes a context marker first
+#    (set_context) and ends the transaction with commit(), which clears it again.
+# Keeping the ledger path free of extra rows keeps auditing off the write latency. The sealer
+# merges both streams in the order the changes were made, replays the balances, and appends
+# the entries to audit_log in batches, linking each one to the previous entry with a SHA-256
+# hash. After each batch it logs the head of the chain; a head recorded outside the database
+# lets verify_chain catch a truncated or fully re-hashed log.
+GENESIS_HASH = '0' * 64
+SEAL_BATCH_SIZE = 5000
+SEAL_INTERVAL_SECONDS = 5
+
+
+def set_context(cursor, actor, reason):
+    """
+    Attribute the balance writes outside the ledger that follow to `actor`/`reason`, and end
+    the transaction with commit(). Ledger entries carry their own actor and reason columns.
+    SQLite lets one writer in at a time, so no other connection's changes can follow the marker.
+    """
+    cursor.execute('INSERT INTO audit_pending (actor, reason) VALUES (?, ?)', (actor, reason))
+
+
+def clear_context(cursor):
+    """Attribute the balance changes that follow to plain SQL again."""
+    cursor.execute('INSERT INTO audit_pending (actor, reason) VALUES (NULL, NULL)')
+
+
+def commit(connection):
+    """Clear the audit context and commit, so later direct SQL is not attributed to this actor."""
+    clear_context(connection.cursor())
+    connection.commit()
+
+
+def rebase(cursor):
+    """Take the current balances and ledger as the starting point of the audited history."""
+    cursor.execute('INSERT OR REPLACE INTO audit_state (id, lastTransactionId) SELECT 1, COALESCE(MAX(id), 0) FROM transactions')
+    cursor.execute('INSERT OR REPLACE INTO audit_balances (accountId, balance) SELECT id, balance FROM accounts')
+
+
+def entry_hash(previous_hash, entry_id, account_id, actor, reason, balance_before, balance_after, changed_at):
+    payload = '|'.join((
+        previous_hash, str(entry_id), str(account_id), actor or '', reason or '',
+        repr(balance_before), repr(balance_after), changed_at
+    ))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _changes(cursor, batch_size):
+    """
+    The next ledger entries and pending rows, merged in the order they were made, as
+    (ledger row or None, pending row or None). A pending row made after ledger entry N
+    sorts between N and N + 1; each stream stops where the other one's batch ends.
+    """
+    cursor.execute('SELECT lastTransactionId FROM audit_state')
+    sealed_up_to = cursor.fetchone()[0]
+    cursor.execute(
+        'SELECT id, accountId, actor, reason, transactionType, amount, transactionDate '
+        'FROM transactions WHERE id > ? ORDER BY id LIMIT ?',
+        (sealed_up_to, batch_size)
+    )
+    ledger = cursor.fetchall()
+    cursor.execute(
+        'SELECT id, accountId, actor, reason, balanceBefore, balanceAfter, changedAt, afterTransactionId '
+        'FROM audit_pending ORDER BY id LIMIT ?',
+        (batch_size,)
+    )
+    pending = cursor.fetchall()
+
+    cutoff = float('inf')
+    if len(ledger) == batch_size:
+        cutoff = ledger[-1][0]
+    if len(pending) == batch_size:
+        cutoff = min(cutoff, pending[-1][7] or 0)
+    merged = [((row[0], 0, 0), row, None) for row in ledger if row[0] <= cutoff]
+    merged += [((row[7] or 0, 1, row[0]), None, row) for row in pending if (row[7] or 0) <= cutoff]
+    merged.sort(key=lambda change: change[0])
+    return [(row, pending_row) for _, row, pending_row in merged]
+
+
+def seal_pending(batch_size=SEAL_BATCH_SIZE, db_path='banking_bot.db'):
+    """
+    Append up to `batch_size` ledger entries and pending rows to the hash-chained log.
+    Returns the number of changes consumed.
+    """
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        changes = _changes(cursor, batch_size)
+        if not changes:
+            cursor.execute('ROLLBACK')
+            return 0
+
+        cursor.execute('SELECT id, hash FROM audit_log ORDER BY id DESC LIMIT 1')
+        last = cursor.fetchone()
+        entry_id, previous_hash = last if last else (0, GENESIS_HASH)
+        balances = {}
+        entries = []
+        last_transaction_id = last_pending_id = None
+        unknown = 0
+        for row, pending_row in changes:
+            if row is not None:
+                transaction_id, account_id, actor, reason, transaction_type, amount, changed_at = row
+                last_transaction_id = transaction_id
+                if account_id not in balances:
+                    cursor.execute('SELECT balance FROM audit_balances WHERE accountId = ?', (account_id,))
+                    known = cursor.fetchone()
+                    balances[account_id] = known[0] if known else None
+                balance_before = balances[account_id]
+                if balance_before is None:
+                    unknown += 1  # no such account: the balance trigger changed nothing
+                    continue
+                if not amount:
+                    continue
+                # The same float addition as the balance trigger, in the same order
+                balance_after = balance_before + amount
+                actor, reason = actor or 'sql', reason or transaction_type
+            else:
+                last_pending_id, account_id, actor, reason, balance_before, balance_after, changed_at, _ = pending_row
+                if account_id is None:
+                    continue  # context marker
+            balances[account_id] = balance_after
+            entry_id += 1
+            previous_hash = entry_hash(
+                previous_hash, entry_id, account_id, actor, reason, balance_before, balance_after, changed_at
+            )
+            entries.append(
+                (entry_id, account_id, actor, reason, balance_before, balance_after, changed_at, previous_hash)
+            )
+
+        cursor.executemany(
+            'INSERT INTO audit_log (id, accountId, actor, reason, balanceBefore, balanceAfter, changedAt, hash) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            entries
+        )
+        cursor.executemany(
+            'INSERT OR REPLACE INTO audit_balances (accountId, balance) VALUES (?, ?)',
+            [(account_id, balance) for account_id, balance in balances.items() if balance is not None]
+        )
+        if last_transaction_id is not None:
+            cursor.execute('UPDATE audit_state SET lastTransactionId = ?', (last_transaction_id,))
+        if last_pending_id is not None:
+            cursor.execute('DELETE FROM audit_pending WHERE id <= ?', (last_pending_id,))
+        cursor.execute('COMMIT')
+        if unknown:
+            logger.warning('Skipped %s ledger entries for unknown accounts while sealing.', unknown)
+        if entries:
+            logger.info('Audit chain sealed up to entry %s, head %s', entry_id, previous_hash)
+    except sqlite3.Error as e:
+        if connection.in_transaction:
+            cursor.execute('ROLLBACK')
+        logger.error('Sealing audit entries failed: %s', e)
+        return 0
+    finally:
+        connection.close()
+    return len(changes)
+
+
+def seal_all(batch_size=SEAL_BATCH_SIZE, db_path='banking_bot.db'):
+    consumed = 0
+    while True:
+        count = seal_pending(batch_size, db_path)
+        consumed += count
+        if count < batch_size:
+            return consumed
+
+
+def chain_head(db_path='banking_bot.db'):
+    """(id, hash) of the newest sealed entry, or None while the log is empty."""
+    connection = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        return connection.execute('SELECT id, hash FROM audit_log ORDER BY id DESC LIMIT 1').fetchone()
+    finally:
+        connection.close()
+
+
+def verify_chain(db_path='banking_bot.db', fetch_size=10000, expected_head=None):
+    """
+    Recompute the hash chain in one streaming pass.
+    `expected_head` is an (id, hash) recorded earlier, e.g. from the sealer's log: the log must
+    still reach that entry with that hash, which a truncated or re-hashed log cannot.
+    Returns (entries checked, id of the first broken entry or None).
+    """
+    connection = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    cursor = connection.cursor()
+    checked = 0
+    expected_id = 1
+    previous_hash = GENESIS_HASH
+    try:
+        cursor.execute(
+            'SELECT id, accountId, actor, reason, balanceBefore, balanceAfter, changedAt, hash '
+            'FROM audit_log ORDER BY id'
+        )
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for entry_id, account_id, actor, reason, balance_before, balance_after, changed_at, stored_hash in rows:
+                # A missing id means an entry was deleted; a hash mismatch means one was edited
+                if entry_id != expected_id:
+                    return checked, expected_id
+                previous_hash = entry_hash(
+                    previous_hash, entry_id, account_id, actor, reason, balance_before, balance_after, changed_at
+                )
+                if previous_hash != stored_hash:
+                    return checked, entry_id
+                if expected_head and entry_id == expected_head[0] and stored_hash != expected_head[1]:
+                    return checked, entry_id
+                checked += 1
+                expected_id += 1
+    finally:
+        connection.close()
+    if expected_head and checked < expected_head[0]:
+        return checked, expected_id
+    return checked, None
+
+
+# Background task: seal pending audit entries
+async def run_audit_sealer(interval_seconds=SEAL_INTERVAL_SECONDS):
+    while True:
+        await asyncio.to_thread(seal_all)
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,210 @@
+import sqlite3
+import logging
+import asyncio
+import datetime
+from collections import namedtuple
+
+import archive
+
+logger = logging.getLogger(__name__)
+
+# Point-in-time account balances.
+# At every interval boundary (daily, UTC) the scheduler stores a checkpoint of the balance of
+# each account that had transactions since the previous run. The balance at any moment is the
+# nearest checkpoint, or the live balance, plus or minus the transactions in between, read
+# through the (accountId, transactionDate) index. An account gets a new checkpoint in every
+# interval it is active, so a query replays at most about one interval of its transactions
+# however long its history is. Checkpoints are anchored on the live balance, which the
+# transactions trigger keeps equal to the ledger.
+CHECKPOINT_INTERVAL_SECONDS = 24 * 3600
+SETTLE_SECONDS = 60            # a boundary is checkpointed once nothing can still be stamped before it
+CHECK_INTERVAL_SECONDS = 3600
+ACCOUNTS_PER_TRANSACTION = 500
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'  # transactionDate is CURRENT_TIMESTAMP, i.e. UTC
+EPOCH = datetime.datetime(1970, 1, 1)
+
+Statement = namedtuple('Statement', ['opening', 'closing', 'transactions'])
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def to_timestamp(moment):
+    """A datetime (naive ones are UTC) as stored in transactionDate; strings are passed through."""
+    if isinstance(moment, datetime.datetime):
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return moment.strftime(TIMESTAMP_FORMAT)
+    return moment
+
+
+def latest_boundary(now=None, interval_seconds=CHECKPOINT_INTERVAL_SECONDS):
+    """The newest interval boundary that is at least SETTLE_SECONDS old."""
+    settled = (now or _utcnow()) - datetime.timedelta(seconds=SETTLE_SECONDS)
+    seconds = int((settled - EPOCH).total_seconds())
+    return to_timestamp(EPOCH + datetime.timedelta(seconds=seconds - seconds % interval_seconds))
+
+
+def write_checkpoints(at=None, db_path='banking_bot.db'):
+    """
+    Checkpoint, as of `at` (default: the latest settled boundary), every account with
+    transactions since the previous run. Returns the number of checkpoints written.
+    """
+    at = to_timestamp(at) if at else latest_boundary()
+    # Autocommit mode so each chunk below is its own short write transaction
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT checkpointAt, lastTransactionId FROM balance_checkpoint_runs ORDER BY checkpointAt DESC LIMIT 1')
+        last_run = cursor.fetchone()
+        if last_run and last_run[0] >= at:
+            return 0
+        after_id = last_run[1] if last_run else 0
+
+        # Cover the longest run of new ids stamped up to `at`; the rest waits for the next boundary
+        cursor.execute('SELECT MIN(id) FROM transactions WHERE id > ? AND transactionDate > ?', (after_id, at))
+        first_later = cursor.fetchone()[0]
+        if first_later is None:
+            cursor.execute('SELECT MAX(id) FROM transactions')
+            up_to_id = max(cursor.fetchone()[0] or 0, after_id)
+        else:
+            up_to_id = first_later - 1
+        cursor.execute('SELECT DISTINCT accountId FROM transactions WHERE id > ? AND id <= ?', (after_id, up_to_id))
+        account_ids = [row[0] for row in cursor.fetchall()]
+
+        for start in range(0, len(account_ids), ACCOUNTS_PER_TRANSACTION):
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.executemany(
+                '''
+                INSERT OR REPLACE INTO balance_checkpoints (accountId, checkpointAt, balance)
+                SELECT id, ?, balance - COALESCE(
+                    (SELECT SUM(amount) FROM transactions WHERE accountId = accounts.id AND transactionDate > ?), 0
+                )
+                FROM accounts WHERE id = ?
+                ''',
+                [(at, at, account_id) for account_id in account_ids[start:start + ACCOUNTS_PER_TRANSACTION]]
+            )
+            cursor.execute('COMMIT')
+        cursor.execute(
+            'INSERT OR REPLACE INTO balance_checkpoint_runs (checkpointAt, lastTransactionId) VALUES (?, ?)',
+            (at, up_to_id)
+        )
+    except sqlite3.Error:
+        if connection.in_transaction:
+            cursor.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+    return len(account_ids)
+
+
+def _open(since, db_path):
+    """A connection and the table holding every transaction after `since` (archives attached when needed)."""
+    if since < archive.archive_cutoff():
+        return archive.open_history_connection(db_path), 'all_transactions'
+    return sqlite3.connect(db_path), 'transactions'
+
+
+def _nearest_checkpoint(cursor, account_id, at):
+    """(checkpointAt, balance) of the checkpoint closest to `at` on either side, or None."""
+    cursor.execute(
+        '''
+        SELECT checkpointAt, balance FROM balance_checkpoints
+        WHERE accountId = ? AND checkpointAt <= ? ORDER BY checkpointAt DESC LIMIT 1
+        ''',
+        (account_id, at)
+    )
+    before = cursor.fetchone()
+    cursor.execute(
+        '''
+        SELECT checkpointAt, balance FROM balance_checkpoints
+        WHERE accountId = ? AND checkpointAt > ? ORDER BY checkpointAt LIMIT 1
+        ''',
+        (account_id, at)
+    )
+    after = cursor.fetchone()
+    if before is None or after is None:
+        return before or after
+    moment = datetime.datetime.fromisoformat(at)
+    if moment - datetime.datetime.fromisoformat(before[0]) <= datetime.datetime.fromisoformat(after[0]) - moment:
+        return before
+    return after
+
+
+def balance_at(account_id, moment, db_path='banking_bot.db'):
+    """Balance of the account after every transaction up to `moment`, or None for an unknown account."""
+    at = to_timestamp(moment)
+    connection = sqlite3.connect(db_path)
+    try:
+        cursor = connection.cursor()
+        checkpoint = _nearest_checkpoint(cursor, account_id, at)
+        if checkpoint is None:
+            cursor.execute('SELECT 1 FROM accounts WHERE id = ?', (account_id,))
+            if cursor.fetchone() is None:
+                return None
+
+        table = 'transactions'
+        since = min(at, checkpoint[0]) if checkpoint else at
+        if since < archive.archive_cutoff():
+            connection.close()
+            connection, table = _open(since, db_path)
+            cursor = connection.cursor()
+
+        # Without a checkpoint, replay backward from the live balance
+        if checkpoint is None:
+            cursor.execute(
+                f'''
+                SELECT balance - COALESCE(
+                    (SELECT SUM(amount) FROM {table} WHERE accountId = accounts.id AND transactionDate > ?), 0
+                )
+                FROM accounts WHERE id = ?
+                ''',
+                (at, account_id)
+            )
+            return cursor.fetchone()[0]
+
+        # A checkpoint before `at` is replayed forward, one after it backward
+        checkpoint_at, balance = checkpoint
+        cursor.execute(
+            f'SELECT COALESCE(SUM(amount), 0) FROM {table} WHERE accountId = ? AND transactionDate > ? AND transactionDate <= ?',
+            (account_id, min(at, checkpoint_at), max(at, checkpoint_at))
+        )
+        delta = cursor.fetchone()[0]
+        return balance + delta if checkpoint_at <= at else balance - delta
+    finally:
+        connection.close()
+
+
+def statement(account_id, start, end, db_path='banking_bot.db'):
+    """Opening and closing balance around (start, end] and the (date, amount, type) rows in between."""
+    start, end = to_timestamp(start), to_timestamp(end)
+    connection, table = _open(start, db_path)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            f'''
+            SELECT transactionDate, amount, transactionType FROM {table}
+            WHERE accountId = ? AND transactionDate > ? AND transactionDate <= ?
+            ORDER BY transactionDate, id
+            ''',
+            (account_id, start, end)
+        )
+        rows = cursor.fetchall()
+    finally:
+        connection.close()
+    opening = balance_at(account_id, start, db_path)
+    closing = None if opening is None else opening + sum(row[1] for row in rows)
+    return Statement(opening, closing, rows)
+
+
+# Background task: checkpoint the accounts active since the last run at each interval boundary
+async def run_checkpoint_scheduler(interval_seconds=CHECK_INTERVAL_SECONDS):
+    while True:
+        try:
+            written = await asyncio.to_thread(write_checkpoints)
+            if written:
+                logger.info('Wrote %s balance checkpoints.', written)
+        except sqlite3.Error as e:
+            logger.error('Balance checkpoint run failed: %s', e)
+        await asyncio.sleep(interval_seconds)
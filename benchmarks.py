@@ -0,0 +1,868 @@
+import sqlite3
+import tempfile
+import random
+import time
+import datetime
+import sys
+import os
+import base64
+
+# A fixed key so the benchmark databases can be created without a .env
+os.environ.setdefault('PII_KEY', base64.b64encode(b'benchmark-only-pii-key-32-bytes!').decode())
+
+from database import initialize_database, create_balance_trigger
+from directory import phone_key
+import pii
+import audit
+
+# Micro-benchmarks for the performance-sensitive parts of the bot.
+# Run one with `python benchmarks.py <name>`, or all of them without arguments.
+
+
+def timed(func, repeat=3):
+    """Best wall time of `repeat` runs, in seconds, and the last result."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def make_ledger_db(path, users=1000, transactions=200000, days=365, seed=42):
+    """Create a database filled with synthetic users, accounts, transactions and loans."""
+    initialize_database(path)
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    # Synthetic history should not move balances through the trigger
+    cursor.execute('DROP TRIGGER IF EXISTS update_balance_after_transaction')
+    cursor.executemany(
+        'INSERT INTO users (id, name, email, phone, emailIndex, phoneIndex) VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (i, *pii.encrypt_user(i, f'User {i}', f'user{i}@example.com', f'7700{i:07d}'), phone_key(f'7700{i:07d}'))
+            for i in range(1, users + 1)
+        ]
+    )
+    cursor.executemany(
+        'INSERT INTO accounts (id, userId, accountNumber, accountType, balance) VALUES (?, ?, ?, ?, ?)',
+        [(i, i, f'ACC{i}', 'savings', rng.uniform(0, 100000)) for i in range(1, users + 1)]
+    )
+    types = [('Deposit', 1), ('Donation', -1), ('Transfer In', 1), ('Transfer Out', -1), ('Loan Payment', -1)]
+    rows = []
+    for _ in range(transactions):
+        transaction_type, sign = rng.choice(types)
+        rows.append((rng.randint(1, users), -rng.randint(0, days - 1), sign * round(rng.uniform(1, 5000), 2), transaction_type))
+    cursor.executemany(
+        'INSERT INTO transactions (accountId, transactionDate, amount, transactionType) '
+        "VALUES (?, datetime('now', ? || ' days'), ?, ?)",
+        rows
+    )
+    cursor.executemany(
+        'INSERT INTO loans (userId, loanAmount, durationMonths, monthlyPayment, remainingBalance, remainingMonths) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            (i, amount, months, amount / months, rng.choice([0, amount * rng.random()]), months)
+            for i in range(1, users + 1, 2)
+            for amount, months in [(rng.uniform(1000, 50000), rng.choice([3, 6, 12]))]
+        ]
+    )
+    create_balance_trigger(cursor)
+    # The synthetic history is where the audit trail starts
+    audit.rebase(cursor)
+    connection.commit()
+    connection.close()
+
+
+def bench_analytics(transactions=500000):
+    import analytics
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        export_dir = os.path.join(tmp, 'columns')
+        make_ledger_db(db_path, transactions=transactions)
+
+        export_time, exported = timed(lambda: analytics.export_ledger(db_path, export_dir), repeat=1)
+        print(f'export: {exported[0]} transactions, {exported[1]} loans in {export_time:.3f}s')
+
+        def sql_daily():
+            connection = sqlite3.connect(db_path)
+            rows = connection.execute(
+                "SELECT date(transactionDate), COUNT(*), SUM(ABS(amount)) FROM transactions "
+                "WHERE transactionType = 'Donation' GROUP BY 1"
+            ).fetchall()
+            connection.close()
+            return rows
+
+        def sql_loan_book():
+            connection = sqlite3.connect(db_path)
+            rows = connection.execute(
+                'SELECT durationMonths, COUNT(*), SUM(remainingBalance) FROM loans '
+                'WHERE remainingBalance > 0 GROUP BY durationMonths'
+            ).fetchall()
+            connection.close()
+            return rows
+
+        for label, sql, columnar in [
+            ('donations per day', sql_daily, lambda: analytics.daily_totals('Donation', export_dir)),
+            ('loan book by duration', sql_loan_book, lambda: analytics.loan_book_by_duration(export_dir)),
+        ]:
+            sql_time, sql_rows = timed(sql)
+            col_time, col_rows = timed(columnar)
+            assert len(sql_rows) == len(col_rows)
+            print(f'{label}: sql {sql_time * 1000:.1f} ms, columnar {col_time * 1000:.1f} ms '
+                  f'({sql_time / col_time:.1f}x)')
+
+
+def make_loans_db(path, loans, as_of, seed=7):
+    """Create a database holding only `loans` active loans in various accrual and overdue states."""
+    initialize_database(path)
+    rng = random.Random(seed)
+    base = datetime.date.fromisoformat(as_of)
+    rows = []
+    for _ in range(loans):
+        amount = round(rng.uniform(1000, 50000), 2)
+        months = rng.choice([3, 6, 12])
+        # Some loans are past their last installment and only carry accrued interest
+        remaining_months = months if rng.random() > 0.05 else 0
+        rows.append((
+            rng.randint(1, loans), amount, months, amount / months, amount, remaining_months,
+            rng.choice([0.18, 0.23, 0.3]),
+            (base - datetime.timedelta(days=rng.choice([0, 1, 1, 1, 3]))).isoformat(),
+            (base + datetime.timedelta(days=rng.randint(-20, 30))).isoformat(),
+        ))
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO loans (userId, loanAmount, durationMonths, monthlyPayment, remainingBalance, remainingMonths, '
+        'interestRate, lastAccrualDate, nextDueDate) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        rows
+    )
+    connection.commit()
+    connection.close()
+
+
+def bench_accrual(sizes=(50000, 100000, 200000, 400000)):
+    import accrual
+
+    # Correctness against accrue_loan_reference is covered by tests/test_accrual.py
+    as_of = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            db_path = os.path.join(tmp, f'loans_{size}.db')
+            make_loans_db(db_path, size, as_of)
+            elapsed, accrued = timed(lambda: accrual.run_accrual(as_of, db_path=db_path), repeat=1)
+            print(f'{size} loans: accrued {accrued} in {elapsed:.3f}s ({elapsed / size * 1e6:.2f} us/loan)')
+
+
+def bench_ui(replies=20000):
+    from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+    import ui
+
+    def build_per_reply():
+        # What the handlers did before: build the markup for every reply, then serialize it
+        for _ in range(replies):
+            markup = ReplyKeyboardMarkup(
+                keyboard=[[KeyboardButton(text=text) for text in row] for row in ui.MAIN_MENU_ROWS],
+                resize_keyboard=True
+            )
+            markup.model_dump_json(exclude_none=True)
+
+    def cached():
+        for _ in range(replies):
+            ui.MAIN_MENU.model_dump_json(exclude_none=True)
+
+    before, _ = timed(build_per_reply)
+    after, _ = timed(cached)
+    print(f'main menu markup: {before / replies * 1e6:.1f} us/reply before, '
+          f'{after / replies * 1e6:.1f} us/reply cached ({before / after:.1f}x)')
+
+
+def bench_scoring(users=5000, transactions=500000):
+    import scoring
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        make_ledger_db(db_path, users=users, transactions=transactions)
+
+        build_time, _ = timed(lambda: scoring.refresh_features(db_path), repeat=1)
+        print(f'feature build over {transactions} transactions: {build_time:.3f}s')
+
+        rescore_time, decisions = timed(lambda: scoring.rescore_all(db_path), repeat=1)
+        print(f'batch rescore of {len(decisions)} users: {rescore_time:.3f}s')
+
+        user_ids = list(decisions)
+        decide_time, _ = timed(lambda: [scoring.decide(user_id, db_path) for user_id in user_ids])
+        print(f'cached decision: {decide_time / len(user_ids) * 1e6:.2f} us/request')
+
+
+def bench_velocity(transfers=200000, users=10000):
+    import velocity
+
+    rng = random.Random(1)
+    now = time.time() - 86400
+    events = []
+    for _ in range(transfers):
+        now += rng.uniform(0, 0.8)
+        events.append((rng.randint(1, users), rng.randint(1, users), rng.uniform(1, 5000), now))
+
+    def run():
+        for counters in velocity._counters.values():
+            counters.clear()
+        blocked = 0
+        for sender_id, recipient_id, amount, timestamp in events:
+            if velocity.check_transfer(sender_id, recipient_id, amount, timestamp).action == 'block':
+                blocked += 1
+            else:
+                velocity.record_transfer(sender_id, recipient_id, amount, timestamp)
+        return blocked
+
+    elapsed, blocked = timed(run, repeat=1)
+    print(f'{transfers} transfers over 24h: {elapsed / transfers * 1e6:.2f} us per check + record, {blocked} blocked')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        initialize_database(db_path)
+        connection = sqlite3.connect(db_path)
+        connection.execute('DROP TRIGGER update_balance_after_transaction')
+        connection.executemany(
+            "INSERT INTO accounts (id, userId, accountNumber, accountType, balance) VALUES (?, ?, ?, 'savings', 0)",
+            [(user_id, user_id, f'ACC{user_id}') for user_id in range(1, users + 1)]
+        )
+        connection.executemany(
+            'INSERT INTO transactions (accountId, transactionDate, amount, transactionType, counterpartyId) '
+            "VALUES (?, datetime(?, 'unixepoch'), ?, 'Transfer Out', ?)",
+            [(s, int(t), -a, r) for s, r, a, t in events]
+        )
+        connection.commit()
+        connection.close()
+        rebuild_time, rebuilt = timed(lambda: velocity.rebuild(db_path), repeat=1)
+        print(f'rebuild from {rebuilt} transfers: {rebuild_time:.3f}s')
+
+
+def bench_payouts(users=20000, batch_sizes=(1000, 5000, 10000), orders=20000):
+    import directory
+    import accounts
+    import payouts
+    import velocity
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        make_ledger_db(db_path, users=users, transactions=1000)
+        connection = sqlite3.connect(db_path)
+        connection.execute('UPDATE accounts SET balance = 1e9 WHERE userId = 1')
+        connection.commit()
+        connection.close()
+        directory.warm_directory(db_path)
+        accounts.warm_accounts(db_path)
+
+        rng = random.Random(3)
+        # Under the default velocity limits a sender cannot pay more than a handful of people at once
+        items, _ = payouts.parse_payout_lines('\n'.join(f'ACC{user_id} 10' for user_id in range(2, 12)))
+        try:
+            payouts.execute_batch(1, items, db_path)
+            raise AssertionError('a batch over the velocity limits was executed')
+        except payouts.BatchError:
+            pass
+
+        # The throughput runs below use limits raised far above the batch sizes
+        saved_rules = velocity.RULES
+        velocity.RULES = tuple((scope, window, count * 10 ** 6, amount * 10 ** 6, action)
+                               for scope, window, count, amount, action in saved_rules)
+        try:
+            _bench_payout_runs(db_path, rng, users, batch_sizes, orders)
+        finally:
+            velocity.RULES = saved_rules
+
+
+def _bench_payout_runs(db_path, rng, users, batch_sizes, orders):
+    import payouts
+
+    for size in batch_sizes:
+        # Half of the recipients by account number, half by phone
+        lines = []
+        for _ in range(size):
+            user_id = rng.randint(2, users)
+            target = f'ACC{user_id}' if rng.random() < 0.5 else f'+7700{user_id:07d}'
+            lines.append(f'{target} {rng.uniform(1, 100):.2f}')
+        text = '\n'.join(lines)
+        parse_time, (items, errors) = timed(lambda: payouts.parse_payout_lines(text), repeat=1)
+        assert not errors
+        run_time, _ = timed(lambda: payouts.execute_batch(1, items, db_path), repeat=1)
+        print(f'batch of {size}: parse {parse_time * 1000:.1f} ms, execute {run_time * 1000:.1f} ms '
+              f'({size / run_time:.0f} payouts/s)')
+
+    today = datetime.date.today()
+    connection = sqlite3.connect(db_path)
+    connection.execute('UPDATE accounts SET balance = 1e6')
+    # Synthetic accounts share their owner's id; some orders are several intervals behind
+    pairs = [(rng.randint(1, users), rng.randint(1, users)) for _ in range(orders)]
+    connection.executemany(
+        'INSERT INTO standing_orders (userId, fromAccountId, recipientId, toAccountId, amount, intervalDays, nextRunDate) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(sender, sender, recipient, recipient, round(rng.uniform(1, 100), 2), 30,
+          (today - datetime.timedelta(days=rng.choice([0, 0, 0, 45, 95]))).isoformat())
+         for sender, recipient in pairs]
+    )
+    connection.commit()
+    connection.close()
+    run_time, (executed, skipped) = timed(lambda: payouts.run_all_due_orders(today.isoformat(), db_path), repeat=1)
+    print(f'{orders} due standing orders: {executed} executed, {skipped} skipped in {run_time:.3f}s '
+          f'({executed / run_time:.0f} orders/s)')
+    # Orders that fell behind are paid once, not once per missed interval
+    assert payouts.run_all_due_orders(today.isoformat(), db_path) == (0, 0)
+
+
+def bench_logging(records=50000):
+    import logging
+    import utils
+
+    logger = logging.getLogger('bench')
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+
+    def emit():
+        for i in range(records):
+            logger.info('Transfer of %s from %s to %s', i, 1, 2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            # What utils.py did before: format and write to the file in the calling thread
+            file_handler = logging.FileHandler(os.path.join(tmp, 'sync.log'))
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            root.handlers = [file_handler]
+            root.setLevel(logging.INFO)
+            before, _ = timed(emit, repeat=1)
+            file_handler.close()
+
+            # Caller-side cost only: the listener is paused while the records are queued, then drained
+            listener = utils.setup_logging(path=os.path.join(tmp, 'async.log'), console=False)
+            listener.stop()
+            after, _ = timed(emit, repeat=1)
+            drain_started = time.perf_counter()
+            listener.start()
+            listener.stop()
+            drained = time.perf_counter() - drain_started
+            for handler in listener.handlers:
+                handler.close()
+        finally:
+            root.handlers = saved_handlers
+            root.setLevel(saved_level)
+
+        print(f'{records} records: {before / records * 1e6:.2f} us/call synchronous, '
+              f'{after / records * 1e6:.2f} us/call queued ({drained:.3f}s for the listener to write them)')
+
+
+def bench_audit(accounts=1000, rounds=30, operations=100, entries=1000000):
+    import statistics
+
+    def transfers(connection, audited):
+        # One transfer per transaction, as process_transfer_amount does it: the ledger rows only,
+        # the transactions trigger moves both balances
+        rng = random.Random()
+        cursor = connection.cursor()
+        started = time.perf_counter()
+        for _ in range(operations):
+            sender, recipient = rng.sample(range(1, accounts + 1), 2)
+            if audited:
+                cursor.executemany(
+                    'INSERT INTO transactions (accountId, amount, transactionType, counterpartyId, actor, reason) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(sender, -1, 'Transfer Out', recipient, f'user:{sender}', 'transfer'),
+                     (recipient, 1, 'Transfer In', sender, f'user:{sender}', 'transfer')]
+                )
+            else:
+                cursor.executemany(
+                    'INSERT INTO transactions (accountId, amount, transactionType, counterpartyId) VALUES (?, ?, ?, ?)',
+                    [(sender, -1, 'Transfer Out', recipient), (recipient, 1, 'Transfer In', sender)]
+                )
+            connection.commit()
+        return (time.perf_counter() - started) / operations
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_path = os.path.join(tmp, 'plain.db')
+        audited_path = os.path.join(tmp, 'audited.db')
+        for path in (plain_path, audited_path):
+            make_ledger_db(path, users=accounts, transactions=50000)
+            connection = sqlite3.connect(path)
+            connection.execute('UPDATE accounts SET balance = 1e9')
+            connection.execute('DELETE FROM audit_pending')
+            audit.rebase(connection.cursor())
+            connection.commit()
+            connection.close()
+        # The plain database has the schema from before auditing: no audit triggers, no id stamping
+        plain = sqlite3.connect(plain_path)
+        plain.execute('DROP TRIGGER audit_balance_update')
+        plain.execute('DROP TRIGGER audit_balance_insert')
+        plain.execute('DROP TRIGGER update_balance_after_transaction')
+        plain.execute(
+            'CREATE TRIGGER update_balance_after_transaction AFTER INSERT ON transactions '
+            'BEGIN UPDATE accounts SET balance = balance + NEW.amount WHERE id = NEW.accountId; END'
+        )
+        plain.commit()
+        audited = sqlite3.connect(audited_path)
+
+        # Commit latency is noisy on shared disks: interleave short rounds and compare medians
+        plain_times, audited_times = [], []
+        for _ in range(rounds):
+            plain_times.append(transfers(plain, audited=False))
+            audited_times.append(transfers(audited, audited=True))
+        plain.close()
+        audited.close()
+        before, after = statistics.median(plain_times), statistics.median(audited_times)
+        print(f'transfer commit: {before * 1e3:.3f} ms plain, {after * 1e3:.3f} ms audited '
+              f'({(after / before - 1) * 100:+.1f}%)')
+
+        # Seal a long ledger; replaying it must end on the balances the trigger left in accounts
+        connection = sqlite3.connect(audited_path)
+        rng = random.Random(3)
+        connection.executemany(
+            "INSERT INTO transactions (accountId, amount, transactionType, actor, reason) "
+            "VALUES (?, ?, 'Deposit', 'bench', 'deposit')",
+            ((rng.randint(1, accounts), float(rng.randint(1, 100))) for _ in range(entries))
+        )
+        connection.commit()
+        seal_time, _ = timed(lambda: audit.seal_all(db_path=audited_path), repeat=1)
+        mismatched = connection.execute(
+            'SELECT COUNT(*) FROM accounts a JOIN audit_balances b ON b.accountId = a.id '
+            'WHERE a.balance IS NOT b.balance'
+        ).fetchone()[0]
+        connection.close()
+        head = audit.chain_head(audited_path)
+        sealed = head[0]
+        verify_time, (checked, broken) = timed(lambda: audit.verify_chain(audited_path, expected_head=head), repeat=1)
+        assert broken is None and checked == sealed and mismatched == 0
+
+        # A log cut short of the recorded head fails verification, even though its links are intact
+        connection = sqlite3.connect(audited_path)
+        connection.execute('DROP TRIGGER audit_log_no_delete')
+        connection.execute('DELETE FROM audit_log WHERE id > ?', (sealed - 10,))
+        connection.commit()
+        connection.close()
+        assert audit.verify_chain(audited_path) == (sealed - 10, None)
+        assert audit.verify_chain(audited_path, expected_head=head) == (sealed - 10, sealed - 9)
+        print(f'sealed {sealed} entries in {seal_time:.2f}s ({sealed / seal_time:.0f}/s), '
+              f'verified in {verify_time:.2f}s ({checked / verify_time:.0f}/s)')
+
+
+def bench_outbox(steps=20000, batch_size=200):
+    import asyncio
+    import outbox
+
+    delivered = []
+
+    async def record(payload):
+        delivered.append(payload['n'])
+
+    outbox.register('bench', record)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        initialize_database(db_path)
+        # A backlog as left behind by a restart
+        connection = sqlite3.connect(db_path)
+        cursor = connection.cursor()
+        for n in range(steps):
+            outbox.enqueue(cursor, 'bench', {'n': n})
+        connection.execute("UPDATE outbox SET nextAttemptAt = datetime('now', '-1 second')")
+        connection.commit()
+        connection.close()
+
+        async def drain():
+            while (await outbox.process_pending(batch_size, db_path))[0]:
+                pass
+
+        elapsed, _ = timed(lambda: asyncio.run(drain()), repeat=1)
+        assert sorted(delivered) == list(range(steps))
+        print(f'{steps} pending steps drained in batches of {batch_size}: {elapsed:.2f}s ({steps / elapsed:.0f}/s)')
+
+
+def bench_events(count=100000, consumers=3, queue_size=1000):
+    import asyncio
+    import events
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        make_ledger_db(db_path, users=100, transactions=1000)
+
+        # What each consumer would otherwise do: read the balance back from SQLite
+        def requery():
+            connection = sqlite3.connect(db_path)
+            for n in range(count // 100):
+                connection.execute('SELECT balance FROM accounts WHERE id = ?', (n % 100 + 1,)).fetchone()
+            connection.close()
+
+        query_time, _ = timed(requery)
+        per_query_us = query_time / (count // 100) * 1e6
+
+    seen = [0] * consumers
+
+    def make_consumer(index):
+        async def consume(event):
+            seen[index] += 1
+        return consume
+
+    for index in range(consumers):
+        events.subscribe(events.BalanceChanged, make_consumer(index), maxsize=queue_size)
+
+    async def publish_all():
+        for n in range(count):
+            await events.publish(events.BalanceChanged(n % 100, n % 100, 1.0, 'KZT', 'bench'))
+        await events.drain()
+
+    elapsed, _ = timed(lambda: asyncio.run(publish_all()), repeat=1)
+    assert seen == [count] * consumers
+    per_event_us = elapsed / count * 1e6
+    print(f'{count} events to {consumers} consumers (queues of {queue_size}): {per_event_us:.1f} us/event '
+          f'incl. delivery; re-reading the balance costs {per_query_us:.1f} us per consumer')
+
+
+def start_mock_bot_api(blocked_every=50, flood_every=5000):
+    """
+    Local stand-in for the Bot API: sendMessage succeeds, except that every `blocked_every`-th
+    chat has blocked the bot and every `flood_every`-th request gets a 1 s flood wait.
+    Returns (runner, base url, list of chat ids messaged).
+    """
+    import asyncio
+    from aiohttp import web
+
+    delivered = []
+    requests = [0]
+
+    async def handle(request):
+        form = await request.post()
+        chat_id = int(form['chat_id'])
+        requests[0] += 1
+        if chat_id % blocked_every == 0:
+            return web.json_response(
+                {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}, status=403
+            )
+        if requests[0] % flood_every == 0:
+            return web.json_response({
+                'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1}
+            }, status=429)
+        delivered.append(chat_id)
+        return web.json_response({'ok': True, 'result': {
+            'message_id': len(delivered), 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': form['text']
+        }})
+
+    async def start():
+        app = web.Application()
+        app.router.add_post('/bot{token}/sendMessage', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        return runner, f'http://127.0.0.1:{port}', delivered
+
+    return start()
+
+
+def bench_broadcast(user_counts=(2000, 10000), rate=2000, concurrency=100):
+    import asyncio
+    import tracemalloc
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import broadcast
+
+    async def run(db_path, users):
+        runner, base_url, delivered = await start_mock_bot_api()
+        bot = Bot('123456:mock', session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+        try:
+            # Pause after the first chunks, then resume where it stopped
+            broadcast_id = broadcast.create_broadcast('Service announcement', 0, db_path)
+            broadcast._set_status(broadcast_id, 'running', db_path)
+            task = asyncio.create_task(broadcast.run_broadcast(bot, broadcast_id, rate, concurrency, db_path=db_path))
+            await asyncio.sleep(0.5)
+            broadcast.pause(broadcast_id, db_path)
+            paused = await task
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            broadcast._set_status(broadcast_id, 'running', db_path)
+            done = await broadcast.run_broadcast(bot, broadcast_id, rate, concurrency, db_path=db_path)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        finally:
+            await bot.session.close()
+            await runner.cleanup()
+        assert len(delivered) == len(set(delivered)) == done.sent
+        return paused, done, elapsed, peak
+
+    for users in user_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            initialize_database(db_path)
+            connection = sqlite3.connect(db_path)
+            connection.executemany(
+                'INSERT INTO users (id, name, email, phone) VALUES (?, ?, ?, ?)',
+                [(n, f'user{n}', f'user{n}@example.com', f'7700{n:07d}') for n in range(1, users + 1)]
+            )
+            connection.commit()
+            connection.close()
+
+            paused, done, elapsed, peak = asyncio.run(run(db_path, users))
+            blocked_users = sqlite3.connect(db_path).execute('SELECT COUNT(*) FROM users WHERE blockedBot = 1').fetchone()[0]
+            print(f'{users} users: paused after {paused.sent + paused.blocked}, resumed and finished in {elapsed:.1f}s '
+                  f'({done.sent} sent, {done.blocked} blocked, {done.failed} failed, {blocked_users} marked), '
+                  f'peak memory {peak / 1024:.0f} KiB')
+
+
+def bench_maintenance(transactions=300000, bursts=60, burst_size=25, gap_seconds=0.1):
+    import threading
+    import statistics
+    import maintenance
+
+    def write_bursts(db_path):
+        """Bursts of handler-sized write transactions separated by quiet gaps; latencies in ms."""
+        latencies = []
+        for burst in range(bursts):
+            for n in range(burst_size):
+                maintenance._in_flight += 1
+                started = time.perf_counter()
+                connection = sqlite3.connect(db_path)
+                connection.execute('UPDATE accounts SET balance = balance + 1 WHERE id = ?', ((burst * n) % 1000 + 1,))
+                connection.commit()
+                connection.close()
+                latencies.append((time.perf_counter() - started) * 1000)
+                maintenance._in_flight -= 1
+                maintenance._last_update = time.monotonic()
+            time.sleep(gap_seconds)
+        return latencies
+
+    def report(label, latencies):
+        latencies = sorted(latencies)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f'  {label}: median {statistics.median(latencies):.2f} ms, p99 {p99:.2f} ms, max {latencies[-1]:.1f} ms')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        make_ledger_db(db_path, transactions=transactions)
+        connection = sqlite3.connect(db_path)
+        connection.execute('DELETE FROM transactions WHERE id % 4 != 0')
+        connection.commit()
+        connection.close()
+        before = maintenance.stats(db_path)
+        print(f'after churn: {before["file_bytes"] / 2**20:.1f} MiB with {before["free_bytes"] / 2**20:.1f} MiB free')
+        report('writes without maintenance', write_bursts(db_path))
+
+        # The scheduler's loop, checking for quiet far more often than it does in the bot
+        stop = threading.Event()
+        passes = [0]
+
+        def maintain():
+            optimize = True
+            while not stop.is_set():
+                if maintenance.is_quiet(gap_seconds / 2):
+                    maintenance.run_maintenance(run_optimize=optimize, db_path=db_path)
+                    optimize = False
+                    passes[0] += 1
+                time.sleep(0.01)
+
+        worker = threading.Thread(target=maintain)
+        worker.start()
+        latencies = write_bursts(db_path)
+        stop.set()
+        worker.join()
+        after = maintenance.stats(db_path)
+        report('writes with maintenance in the gaps', latencies)
+        print(f'  {passes[0]} passes reclaimed {(before["free_bytes"] - after["free_bytes"]) / 2**20:.1f} MiB; '
+              f'now {after["file_bytes"] / 2**20:.1f} MiB with {after["free_bytes"] / 2**20:.1f} MiB free')
+
+
+def bench_pii(users=100000, lookups=5000):
+    import directory
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        initialize_database(db_path)
+        connection = sqlite3.connect(db_path)
+        phones = [f'7700{i:07d}' for i in range(1, users + 1)]
+        # The plaintext phone column and index from before encryption, as the baseline below
+        connection.execute('ALTER TABLE users ADD COLUMN normalizedPhone TEXT')
+        connection.execute('CREATE UNIQUE INDEX idx_users_normalized_phone ON users(normalizedPhone)')
+        connection.executemany(
+            'INSERT INTO users (id, name, email, phone, emailIndex, phoneIndex, normalizedPhone) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [
+                (i, *pii.encrypt_user(i, f'User {i}', f'user{i}@example.com', phone), phone_key(phone), phone)
+                for i, phone in enumerate(phones, start=1)
+            ]
+        )
+        connection.executemany(
+            "INSERT INTO accounts (id, userId, accountNumber, accountType, balance) VALUES (?, ?, ?, 'savings', 0)",
+            [(i, i, f'ACC{i}') for i in range(1, users + 1)]
+        )
+        connection.commit()
+        sample = [rng.choice(phones) for _ in range(lookups)]
+
+        # Recipient lookup on a directory miss: plaintext column (old) vs blind index (new)
+        def lookup_plain():
+            for phone in sample:
+                connection.execute(
+                    'SELECT u.id, u.name, a.id FROM users u JOIN accounts a ON a.userId = u.id '
+                    'WHERE u.normalizedPhone = ? ORDER BY a.id LIMIT 1',
+                    (directory.normalize_phone_number(phone),)
+                ).fetchone()
+
+        def lookup_blind():
+            for phone in sample:
+                row = connection.execute(
+                    'SELECT u.id, u.name, a.id FROM users u JOIN accounts a ON a.userId = u.id '
+                    'WHERE u.phoneIndex = ? ORDER BY a.id LIMIT 1',
+                    (directory.phone_key(phone),)
+                ).fetchone()
+                pii.decrypt('name', row[1], row[0])
+
+        plain_time, _ = timed(lookup_plain)
+        blind_time, _ = timed(lookup_blind)
+        print(f'phone lookup over {users} users: plaintext {plain_time / lookups * 1e6:.1f} us, '
+              f'blind index + decrypt {blind_time / lookups * 1e6:.1f} us')
+
+        # Registration: the insert transaction with and without encryption
+        def register(encrypted, base):
+            for n in range(base, base + 1000):
+                phone = f'7799{n:07d}'
+                if encrypted:
+                    values = (n, *pii.encrypt_user(n, f'New {n}', f'new{n}@example.com', phone), phone_key(phone))
+                else:
+                    values = (n, f'New {n}', f'new{n}@example.com', phone, f'e{n}', f'p{n}')
+                register_connection = sqlite3.connect(db_path)
+                register_connection.execute(
+                    'INSERT INTO users (id, name, email, phone, emailIndex, phoneIndex) VALUES (?, ?, ?, ?, ?, ?)', values
+                )
+                register_connection.commit()
+                register_connection.close()
+
+        base = [users + 1]
+
+        def run(encrypted):
+            register(encrypted, base[0])
+            base[0] += 1000
+
+        plain_time, _ = timed(lambda: run(False))
+        encrypted_time, _ = timed(lambda: run(True))
+        encrypt_time, _ = timed(lambda: [
+            (pii.encrypt_user(n, f'New {n}', f'new{n}@example.com', '77990000000'), phone_key('77990000000'))
+            for n in range(1000)
+        ])
+        # Each run registers 1000 users, so seconds per run are milliseconds per registration
+        print(f'registration: plaintext {plain_time:.3f} ms, encrypted {encrypted_time:.3f} ms; '
+              f'encryption and blind indexes alone {encrypt_time * 1000:.0f} us')
+
+        # Profile reads by the menu flows: decrypt every time vs the bounded cache
+        user_ids = [rng.randint(1, users) for _ in range(lookups)]
+        hot_ids = user_ids[:500]
+
+        def profiles_uncached():
+            for user_id in hot_ids * 10:
+                pii.invalidate_profile(user_id)
+                pii.get_profile(user_id, db_path)
+
+        def profiles_cached():
+            for user_id in hot_ids * 10:
+                pii.get_profile(user_id, db_path)
+
+        uncached_time, _ = timed(profiles_uncached)
+        cached_time, _ = timed(profiles_cached)
+        reads = len(hot_ids) * 10
+        print(f'profile read: decrypt each time {uncached_time / reads * 1e6:.1f} us, cached {cached_time / reads * 1e6:.2f} us')
+        connection.close()
+
+
+def bench_balances(histories=(10000, 100000, 1000000), days=730, queries=200):
+    import statistics
+    import balances
+
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        initialize_database(db_path)
+        connection = sqlite3.connect(db_path)
+        # Balances are moved once per account and day below instead of per row
+        connection.execute('DROP TRIGGER update_balance_after_transaction')
+        connection.executemany(
+            "INSERT INTO accounts (id, userId, accountNumber, accountType, balance) VALUES (?, ?, ?, 'savings', 0)",
+            [(account_id, account_id, f'ACC{account_id}') for account_id in range(1, len(histories) + 1)]
+        )
+        connection.commit()
+
+        # History written day by day, in date order, with the daily checkpoint run after each day
+        # (as in the bot, nothing is stamped at or before a boundary once it has been checkpointed)
+        first_day = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0) \
+            - datetime.timedelta(days=days)
+        checkpoint_time = 0.0
+        for day in range(days):
+            day_start = first_day + datetime.timedelta(days=day)
+            rows = []
+            for account_id, count in enumerate(histories, start=1):
+                for _ in range(count // days):
+                    rows.append((rng.randrange(1, 86400), account_id, round(rng.uniform(-50, 100), 2)))
+            rows.sort()
+            connection.executemany(
+                "INSERT INTO transactions (accountId, transactionDate, amount, transactionType) VALUES (?, ?, ?, 'Deposit')",
+                [(account_id, balances.to_timestamp(day_start + datetime.timedelta(seconds=second)), amount)
+                 for second, account_id, amount in rows]
+            )
+            totals = {}
+            for _, account_id, amount in rows:
+                totals[account_id] = totals.get(account_id, 0.0) + amount
+            connection.executemany('UPDATE accounts SET balance = balance + ? WHERE id = ?',
+                                   [(total, account_id) for account_id, total in totals.items()])
+            connection.commit()
+            started = time.perf_counter()
+            balances.write_checkpoints(day_start + datetime.timedelta(days=1), db_path)
+            checkpoint_time += time.perf_counter() - started
+        print(f'{days} daily checkpoint runs: {checkpoint_time / days * 1000:.2f} ms per run')
+
+        def report(label, latencies):
+            latencies = sorted(latencies)
+            p99 = latencies[int(len(latencies) * 0.99) - 1]
+            return f'{label} median {statistics.median(latencies):.2f} ms, p99 {p99:.2f} ms'
+
+        for account_id, count in enumerate(histories, start=1):
+            moments = [balances.to_timestamp(first_day + datetime.timedelta(seconds=rng.randrange(days * 86400)))
+                       for _ in range(queries)]
+            full, checkpointed = [], []
+            for moment in moments:
+                started = time.perf_counter()
+                expected = connection.execute(
+                    'SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE accountId = ? AND transactionDate <= ?',
+                    (account_id, moment)
+                ).fetchone()[0]
+                full.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                balance = balances.balance_at(account_id, moment, db_path)
+                checkpointed.append((time.perf_counter() - started) * 1000)
+                assert abs(balance - expected) < 1e-6 * max(1.0, abs(expected)), (moment, balance, expected)
+            print(f'{count} transactions: {report("summing the history", full)}; {report("checkpoint + delta", checkpointed)}')
+        connection.close()
+
+
+BENCHMARKS = {
+    'analytics': bench_analytics,
+    'accrual': bench_accrual,
+    'ui': bench_ui,
+    'scoring': bench_scoring,
+    'velocity': bench_velocity,
+    'payouts': bench_payouts,
+    'logging': bench_logging,
+    'audit': bench_audit,
+    'outbox': bench_outbox,
+    'events': bench_events,
+    'broadcast': bench_broadcast,
+    'maintenance': bench_maintenance,
+    'pii': bench_pii,
+    'balances': bench_balances,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'== {name}')
+        BENCHMARKS[name]()
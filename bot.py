@@ -2,24 +2,53 @@ import logging
 import sqlite3
 import re
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
-from aiogram.filters import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram import Router
 import asyncio
+import datetime
 from dotenv import load_dotenv
 import os
+from database import initialize_database
+from directory import phone_key, add_recipient, find_by_phone, find_by_account, warm_directory
+from archive import run_archival_scheduler
+from reporting import run_snapshot_refresher
+from analytics import run_export_scheduler
+from accrual import run_accrual_scheduler, reschedule
+import ui
+import scoring
+import velocity
+import payouts
+import accounts
+import fx
+import audit
+import outbox
+import events
+import profiling
+import broadcast
+import maintenance
+import pii
+import replay
+import balances
+from utils import setup_logging, LoggingMiddleware
 
 load_dotenv()  # Load environment variables from .env
 
-# Initialize the bot and dispatcher
-bot = Bot(token=os.getenv("BOT_TOKEN"))
+# Initialize the bot and dispatcher; TELEGRAM_API_URL points the bot at another Bot API server,
+# e.g. a local mock when testing broadcasts
+api_url = os.getenv("TELEGRAM_API_URL")
+api_session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+bot = Bot(token=os.getenv("BOT_TOKEN"), session=api_session)
 dp = Dispatcher(storage=MemoryStorage())
 
-# Logger configuration
-logging.basicConfig(level=logging.INFO)
+# Logger configuration (handlers are installed by setup_logging() at startup)
+logger = logging.getLogger("bot")
 
 # Connect to SQLite database
 def get_db_connection():
@@ -27,10 +56,15 @@ def get_db_connection():
 
 # Register router
 router = Router()
+router.message.middleware(LoggingMiddleware())
+router.message.middleware(maintenance.ActivityMiddleware())
 
 # limit for loans
 LOAN_LIMIT = 50000
 
+# Telegram ids allowed to use admin commands such as /profile
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
 # state classes
 class Registration(StatesGroup):
     waiting_for_name = State()
@@ -48,6 +82,8 @@ class Transfer(StatesGroup):
     waiting_for_recipient_phone = State()
     waiting_for_transfer_amount = State()
     waiting_for_recipient_account = State()
+    waiting_for_batch_list = State()
+    waiting_for_standing_orders = State()
 
 
 class Loan(StatesGroup):
@@ -62,6 +98,12 @@ class LoanPayment(StatesGroup):
     paying_amount = State()
 
 
+class Accounts(StatesGroup):
+    choosing_account = State()
+    waiting_for_type = State()
+    waiting_for_currency = State()
+
+
 # Input validation functions
 def is_valid_name(name):
     return len(name.strip()) > 0
@@ -78,58 +120,49 @@ def is_valid_phone(phone: str) -> bool:
     """
     return re.match(r'^\+?[0-9]{10,15}$', phone) is not None
 
-def normalize_phone_number(phone: str) -> str:
-    """
-    Normalizes phone numbers to a standard format (without '+' and country code normalized to '7').
-    Examples:
-        '+7702-------' -> '7702-------'
-        '8702-------'  -> '7702-------'
-        '702-------'   -> '7702-------'
-    """
-    phone = re.sub(r'\D', '', phone)  # Remove non-numeric characters
-    if phone.startswith('8'):        # Replace leading '8' with '7' (Kazakhstan standard)
-        phone = '7' + phone[1:]
-    elif phone.startswith('7') and len(phone) == 10:
-        phone = '7' + phone  # Add missing country code
-    return phone
-
-
 def is_positive_amount(amount):
     try:
-        return float(amount) > 0
+        return fx.round_amount(float(amount)) > 0
     except ValueError:
         return False
 
 # Check if a user is already registered
 def is_user_registered(telegram_id):
     connection = get_db_connection()
-    cursor = connection.cursor()
-    cursor.execute('SELECT * FROM users WHERE id = ?', (telegram_id,))
-    user = cursor.fetchone()
-    connection.close()
-    return user
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT * FROM users WHERE id = ?', (telegram_id,))
+        return cursor.fetchone()
+    finally:
+        connection.close()
+
+
+# Messages that must reach the user once a money operation is committed go through the outbox
+def queue_notification(cursor, chat_id, text, on_failure=None):
+    payload = {'chat_id': chat_id, 'text': text}
+    if on_failure:
+        payload['on_failure'] = on_failure
+    return outbox.enqueue(cursor, 'notify', payload)
+
+
+async def send_notification(payload):
+    try:
+        await bot.send_message(payload['chat_id'], payload['text'])
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        # Blocked bot or unknown chat: retrying cannot help
+        raise outbox.PermanentError(str(e))
+
+
+def notification_failed(cursor, payload):
+    if payload.get('on_failure'):
+        outbox.enqueue(cursor, 'notify', payload['on_failure'])
+
+
+outbox.register('notify', send_notification, notification_failed)
 
 
 async def show_main_menu(message: Message):
-    reply_keyboard = [
-        [KeyboardButton(text='ℹ️ My Info')],
-        [KeyboardButton(text='💸 Take a Loan'), KeyboardButton(text='🎁 Donate to Charity')],
-        [KeyboardButton(text='💵 Deposit'), KeyboardButton(text='📤 Transfer')],
-        [KeyboardButton(text='📅 Pay Monthly Loan')]
-    ]
-    markup = ReplyKeyboardMarkup(keyboard=reply_keyboard, resize_keyboard=True)
-    await message.answer("✅ Back to Main state", reply_markup=markup)
-
-# Cancel button on keyboards
-cancel_button = KeyboardButton(text="❌ Cancel")
-
-
-def create_cancel_keyboard():
-    """Utility to create a keyboard with the cancel button."""
-    return ReplyKeyboardMarkup(
-        keyboard=[[cancel_button]],
-        resize_keyboard=True
-    )
+    await message.answer("✅ Back to Main state", reply_markup=ui.MAIN_MENU)
 
 # Utility to handle cancel action and return to main menu
 async def handle_cancel(message: Message, state: FSMContext):
@@ -146,78 +179,44 @@ async def cancel_action_handler(message: Message, state: FSMContext):
 async def initiate_loan(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        # Check if the user has any active loans
-        cursor.execute("SELECT remainingBalance FROM loans WHERE userId = ? AND remainingBalance > 0", (telegram_id,))
-        active_loan = cursor.fetchone()
-
-        if active_loan:
-            await message.answer(
-                "❌ You already have an active loan. Please repay it before requesting a new one."
-            )
-            return
-
-        # No active loan; proceed with the loan request
-        await message.answer(
-            "📊 You are eligible for a loan. Enter the loan amount "
-            f"(up to {LOAN_LIMIT} ₸, with 23% annual interest):",
-            reply_markup=create_cancel_keyboard()
-        )
-        await state.set_state(Loan.waiting_for_amount)
-
+        decision = scoring.decide(telegram_id)
     except sqlite3.Error as e:
         await message.answer(f"❌ Error checking loan eligibility: {e}")
-    finally:
-        connection.close()
-
-
-@router.message(Loan.waiting_for_amount)
-async def process_loan_amount(message: Message, state: FSMContext):
-    telegram_id = message.from_user.id
-
-    try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
+        return
 
-        # Check if the user has any active loans
-        cursor.execute("SELECT remainingBalance FROM loans WHERE userId = ? AND remainingBalance > 0", (telegram_id,))
-        active_loan = cursor.fetchone()
+    if not decision.eligible:
+        await message.answer(f"❌ {decision.reason}")
+        return
 
-        if active_loan:
-            await message.answer(
-                "❌ You already have an active loan. Please repay it before requesting a new one."
-            )
-            await handle_cancel(message, state)
-            return
+    # Keep the personalized offer for the rest of the loan flow
+    await state.update_data(loan_limit=decision.limit, interest_rate=decision.rate)
+    await message.answer(
+        "📊 You are eligible for a loan. Enter the loan amount "
+        f"(up to {decision.limit:.0f} ₸, with {decision.rate * 100:g}% annual interest):",
+        reply_markup=ui.CANCEL_KEYBOARD
+    )
+    await state.set_state(Loan.waiting_for_amount)
 
-    except sqlite3.Error as e:
-        await message.answer(f"❌ Error checking active loans: {e}")
-        return
-    finally:
-        connection.close()
 
+@router.message(Loan.waiting_for_amount)
+async def process_loan_amount(message: Message, state: FSMContext):
     # Validate loan amount
     amount_text = message.text.strip()
     if not is_positive_amount(amount_text):
         await message.answer("❌ Invalid amount. Please enter a positive number.")
         return
 
-    amount = float(amount_text)
-    if amount > LOAN_LIMIT:
-        await message.answer(f"❌ Loan amount exceeds the limit of {LOAN_LIMIT} ₸.")
+    # Loans are issued in the base currency
+    amount = fx.round_amount(float(amount_text))
+    loan_limit = (await state.get_data()).get('loan_limit', LOAN_LIMIT)
+    if amount > loan_limit:
+        await message.answer(f"❌ Loan amount exceeds your limit of {loan_limit:.0f} ₸.")
         return
 
     await state.update_data(loan_amount=amount)
 
     # Offer loan duration options
-    durations_keyboard = [
-        [KeyboardButton(text="3 months"), KeyboardButton(text="6 months")],
-        [KeyboardButton(text="12 months"), cancel_button]
-    ]
-    markup = ReplyKeyboardMarkup(keyboard=durations_keyboard, resize_keyboard=True)
-    await message.answer("Select loan duration or press Cancel:", reply_markup=markup)
+    await message.answer("Select loan duration or press Cancel:", reply_markup=ui.LOAN_DURATION_KEYBOARD)
     await state.set_state(Loan.waiting_for_duration)
 
 
@@ -235,7 +234,7 @@ async def process_loan_duration(message: Message, state: FSMContext):
     duration = durations[message.text]
     loan_data = await state.get_data()
     loan_amount = loan_data['loan_amount']
-    interest_rate = 0.23
+    interest_rate = loan_data.get('interest_rate', scoring.DEFAULT_RULES['base_rate'])
 
     # Calculate repayment details
     total_repayment = loan_amount * (1 + interest_rate * (duration / 12))
@@ -249,19 +248,9 @@ async def process_loan_duration(message: Message, state: FSMContext):
         remaining_months=duration  # Track remaining months
     )
 
-    cancel_keyboard = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="❌ Cancel")]],
-        resize_keyboard=True
-    )
-
     await message.answer(
-        f"📊 Loan Details:\n"
-        f"💰 Loan Amount: {loan_amount:.2f} ₸\n"
-        f"🗓️ Duration: {duration} months\n"
-        f"📅 Monthly Payment: {monthly_payment:.2f} ₸\n"
-        f"🔻 Total Repayment (with interest): {total_repayment:.2f} ₸\n\n"
-        "Confirm loan? (Yes/No)",
-        reply_markup=cancel_keyboard
+        ui.render_loan_details(loan_amount, duration, monthly_payment, total_repayment),
+        reply_markup=ui.CANCEL_KEYBOARD
     )
     await state.set_state(Loan.confirming_loan)
 
@@ -280,46 +269,58 @@ async def confirm_loan(message: Message, state: FSMContext):
     monthly_payment = loan_data['monthly_payment']
     duration = loan_data['loan_duration']
     remaining_months = loan_data['remaining_months']
+    interest_rate = loan_data.get('interest_rate', scoring.DEFAULT_RULES['base_rate'])
     telegram_id = message.from_user.id
 
+    connection = get_db_connection()
     try:
-        connection = get_db_connection()
         cursor = connection.cursor()
+        account = accounts.get_active_account(telegram_id)
+        if account is None:
+            await message.answer("❌ You are not registered. Please register first using /register.")
+            await handle_cancel(message, state)
+            return
 
-        # Check again for any active loans
-        cursor.execute("SELECT remainingBalance FROM loans WHERE userId = ? AND remainingBalance > 0", (telegram_id,))
-        active_loan = cursor.fetchone()
-
-        if active_loan:
+        # Record the loan details, unless another loan became active since the offer was made
+        cursor.execute(
+            '''
+            INSERT INTO loans (userId, loanAmount, durationMonths, monthlyPayment, remainingBalance, remainingMonths,
+                               interestRate, lastAccrualDate, nextDueDate)
+            SELECT ?, ?, ?, ?, ?, ?, ?, date('now'), date('now', '+1 month')
+            WHERE NOT EXISTS (SELECT 1 FROM loans WHERE userId = ? AND remainingBalance > 0)
+            ''',
+            (telegram_id, loan_amount, duration, monthly_payment, loan_amount, remaining_months, interest_rate,
+             telegram_id)
+        )
+        if cursor.rowcount == 0:
             await message.answer(
                 "❌ You already have an active loan. Please repay it before requesting a new one."
             )
             await handle_cancel(message, state)
             return
 
-        # Record the loan details
+        # Credit the user's active account; loans are issued in the base currency
+        credit_amount = fx.convert(loan_amount, fx.BASE_CURRENCY, account.currency)
+        # Record the transaction; the trigger credits the account
         cursor.execute(
-            'INSERT INTO loans (userId, loanAmount, durationMonths, monthlyPayment, remainingBalance, remainingMonths) '
-            'VALUES (?, ?, ?, ?, ?, ?)',
-            (telegram_id, loan_amount, duration, monthly_payment, loan_amount, remaining_months)
+            'INSERT INTO transactions (accountId, amount, transactionType, actor, reason) VALUES (?, ?, ?, ?, ?)',
+            (account.id, credit_amount, 'Loan', f'user:{telegram_id}', 'loan disbursement')
         )
-
-        # Update the user's account balance
-        cursor.execute('UPDATE accounts SET balance = balance + ? WHERE userId = ?', (loan_amount, telegram_id))
-
-        # Record the transaction
-        cursor.execute(
-            'INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, ?)',
-            (telegram_id, loan_amount, 'Loan')
+        step = queue_notification(
+            cursor, telegram_id,
+            f"✅ Loan confirmed. You have received {loan_amount:.2f} ₸.\n"
+            f"📅 Monthly payment: {monthly_payment:.2f} ₸."
         )
 
         connection.commit()
-        await message.answer(
-            f"✅ Loan confirmed. You have received {loan_amount:.2f} ₸.\n"
-            f"📅 Monthly payment: {monthly_payment:.2f} ₸."
+        scoring.invalidate_loan_state(telegram_id)
+        await events.publish(
+            events.LoanIssued(telegram_id, loan_amount, monthly_payment, duration, interest_rate),
+            events.BalanceChanged(telegram_id, account.id, credit_amount, account.currency, 'loan disbursement')
         )
+        await outbox.deliver([step])
 
-    except sqlite3.Error as e:
+    except (sqlite3.Error, fx.UnknownCurrencyError) as e:
         await message.answer(f"❌ Loan confirmation failed: {e}")
     finally:
         connection.close()
@@ -333,18 +334,120 @@ async def start_bot(message: Message):
     greeting_text = "👋 Hello! Welcome to the Banking Bot. Use the buttons below to proceed."
     telegram_id = message.from_user.id
     if is_user_registered(telegram_id):
-        reply_keyboard = [
-            [KeyboardButton(text='ℹ️ My Info')],
-            [KeyboardButton(text='💸 Take a Loan'), KeyboardButton(text='🎁 Donate to Charity')],
-            [KeyboardButton(text='💵 Deposit'), KeyboardButton(text='📤 Transfer')],
-            [KeyboardButton(text='📅 Pay Monthly Loan')]
-        ]
-        markup = ReplyKeyboardMarkup(keyboard=reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
-        await message.answer(greeting_text + "\nYou are already registered.", reply_markup=markup)
+        broadcast.unblock_user(telegram_id)
+        await message.answer(greeting_text + "\nYou are already registered.", reply_markup=ui.MAIN_MENU_ONE_TIME)
+    else:
+        await message.answer(greeting_text + "\nYou are not registered yet.", reply_markup=ui.REGISTER_KEYBOARD)
+
+# /profile command handler (admins only): /profile <rate> | off | dump
+@router.message(Command(commands=['profile']))
+async def profile_command(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    argument = (command.args or '').strip().lower()
+    if argument == 'off':
+        profiling.disable(router.message, bot.session)
+        await message.answer("⏹ Profiling stopped.\n" + profiling.render_summary(profiling.dump()))
+    elif argument == 'dump':
+        summary = profiling.dump()
+        await message.answer(f"📊 Profiles written to {profiling.PROFILE_DIR}/\n" + profiling.render_summary(summary))
+    elif argument:
+        try:
+            rate = float(argument)
+        except ValueError:
+            rate = 0
+        if not 0 < rate <= 1:
+            await message.answer("❌ Usage: /profile <rate between 0 and 1> | off | dump")
+            return
+        profiling.enable(router.message, bot.session, rate)
+        await message.answer(f"⏺ Profiling {rate:.0%} of updates.")
     else:
-        reply_keyboard = [[KeyboardButton(text='📝 Register')]]
-        markup = ReplyKeyboardMarkup(keyboard=reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
-        await message.answer(greeting_text + "\nYou are not registered yet.", reply_markup=markup)
+        status = "on" if profiling.is_enabled() else "off"
+        await message.answer(f"Profiling is {status}.\n" + profiling.render_summary(profiling.dump()))
+
+# /broadcast command handler (admins only): /broadcast <text> | pause | resume | status
+@router.message(Command(commands=['broadcast']))
+async def broadcast_command(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    argument = (command.args or '').strip()
+    latest = broadcast.latest_broadcast()
+    try:
+        if argument.lower() == 'pause':
+            broadcast.pause(latest.id if latest else 0)
+            await message.answer(f"⏸ Broadcast {latest.id} will pause after the current chunk.")
+        elif argument.lower() == 'resume':
+            broadcast.resume(bot, latest.id if latest else 0)
+            await message.answer(f"▶️ Broadcast {latest.id} resumed.")
+        elif argument and argument.lower() != 'status':
+            broadcast_id = broadcast.send_to_all(bot, argument, message.from_user.id)
+            await message.answer(f"📣 Broadcast {broadcast_id} started.")
+        elif latest:
+            await message.answer(
+                f"📣 Broadcast {latest.id}: {latest.status}, {latest.sent} sent, "
+                f"{latest.failed} failed, {latest.blocked} blocked the bot."
+            )
+        else:
+            await message.answer("Usage: /broadcast <text> | pause | resume | status")
+    except broadcast.BroadcastError as e:
+        await message.answer(f"❌ {e}")
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Database error: {e}")
+
+# /balance command handler (admins only): /balance <account number> [YYYY-MM-DD [HH:MM[:SS]]], UTC
+@router.message(Command(commands=['balance']))
+async def balance_command(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    parts = (command.args or '').split(maxsplit=1)
+    if not parts:
+        await message.answer("Usage: /balance <account number> [YYYY-MM-DD [HH:MM[:SS]]]")
+        return
+    recipient = find_by_account(parts[0])
+    if recipient is None:
+        await message.answer("❌ Account not found.")
+        return
+    try:
+        if len(parts) == 1:
+            moment = datetime.datetime.now(datetime.timezone.utc)
+        elif len(parts[1].strip()) == 10:
+            # A date alone means the end of that day
+            moment = datetime.datetime.fromisoformat(parts[1].strip()) + datetime.timedelta(days=1, seconds=-1)
+        else:
+            moment = datetime.datetime.fromisoformat(parts[1].strip())
+    except ValueError:
+        await message.answer("❌ Invalid date. Use YYYY-MM-DD [HH:MM[:SS]] (UTC).")
+        return
+    try:
+        balance = balances.balance_at(recipient[2], moment)
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Database error: {e}")
+        return
+    await message.answer(f"💰 {parts[0]} at {balances.to_timestamp(moment)} UTC: {balance:.2f}")
+
+# /statement command handler: /statement [days] for the active account
+@router.message(Command(commands=['statement']))
+async def statement_command(message: Message, command: CommandObject):
+    account = accounts.get_active_account(message.from_user.id)
+    if account is None:
+        await message.answer("❌ You are not registered. Please register first using /register.")
+        return
+    argument = (command.args or '').strip()
+    days = int(argument) if argument.isdigit() else 30
+    if not 1 <= days <= 366:
+        await message.answer("❌ Usage: /statement [days, 1-366]")
+        return
+
+    end = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        statement = balances.statement(account.id, end - datetime.timedelta(days=days), end)
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Error retrieving the statement: {e}")
+        return
+    await message.answer(ui.render_statement(account.number, days, statement, account.currency))
 
 # /register command handler
 @router.message(Command(commands=['register']))
@@ -394,20 +497,27 @@ async def process_phone(message: Message, state: FSMContext):
     email = user_data['email']
     telegram_id = user_data['telegram_id']
     
+    connection = get_db_connection()
     try:
-        connection = get_db_connection()
         cursor = connection.cursor()
         cursor.execute(
-            'INSERT INTO users (id, name, email, phone) VALUES (?, ?, ?, ?)',
-            (telegram_id, name, email, phone)
+            'INSERT INTO users (id, name, email, phone, emailIndex, phoneIndex) VALUES (?, ?, ?, ?, ?, ?)',
+            (telegram_id, *pii.encrypt_user(telegram_id, name, email, phone), phone_key(phone))
         )
         account_number = f"ACC{telegram_id}"
         initial_balance = 0.0
+        audit.set_context(cursor, f'user:{telegram_id}', 'registration')
         cursor.execute(
-            'INSERT INTO accounts (userId, accountNumber, accountType, balance) VALUES (?, ?, ?, ?)',
-            (telegram_id, account_number, 'savings', initial_balance)
+            'INSERT INTO accounts (userId, accountNumber, accountType, balance, currency) VALUES (?, ?, ?, ?, ?)',
+            (telegram_id, account_number, 'savings', initial_balance, fx.BASE_CURRENCY)
         )
-        connection.commit()
+        account_id = cursor.lastrowid
+        cursor.execute('UPDATE users SET activeAccountId = ? WHERE id = ?', (account_id, telegram_id))
+        audit.commit(connection)
+        add_recipient(telegram_id, name, phone, account_id, account_number)
+        pii.cache_profile(telegram_id, pii.Profile(name, email, phone))
+        accounts.register_account(telegram_id, account_id, account_number, 'savings', fx.BASE_CURRENCY)
+        await events.publish(events.UserRegistered(telegram_id, name, account_id, account_number))
         await message.answer(f"✅ Registration completed for {name}! Your account number is {account_number}.")
     except sqlite3.IntegrityError as e:
         await message.answer(f"❌ Registration failed: {e}")
@@ -420,60 +530,24 @@ async def process_phone(message: Message, state: FSMContext):
     await state.clear()
     
     # Display the keyboard for registered users
-    reply_keyboard = [
-        [KeyboardButton(text='ℹ️ My Info')],
-        [KeyboardButton(text='💸 Take a Loan'), KeyboardButton(text='🎁 Donate to Charity')],
-        [KeyboardButton(text='💵 Deposit'), KeyboardButton(text='📤 Transfer')],
-        [KeyboardButton(text='📅 Pay Monthly Loan')]
-    ]
-    markup = ReplyKeyboardMarkup(keyboard=reply_keyboard, resize_keyboard=True, one_time_keyboard=True)
-    await message.answer("What would you like to do next?", reply_markup=markup)
-
-
-@router.message(Loan.waiting_for_amount)
-async def process_loan_amount(message: Message, state: FSMContext):
-    amount_text = message.text
-    if not is_positive_amount(amount_text):
-        await message.answer("❌ Invalid amount. Please enter a positive number.")
-        return
-
-    amount = float(amount_text)
-    if amount > 45000:
-        await message.answer("❌ Loan amount exceeds the individual limit of 45,000 ₸.")
-        return
+    await message.answer("What would you like to do next?", reply_markup=ui.MAIN_MENU_ONE_TIME)
 
-    # Check the user's total loan balance
-    telegram_id = message.from_user.id
-    connection = get_db_connection()
-    cursor = connection.cursor()
-
-    cursor.execute('SELECT SUM(remainingBalance) FROM loans WHERE userId = ?', (telegram_id,))
-    total_outstanding = cursor.fetchone()[0] or 0
-
-    if total_outstanding + amount > 50000:
-        await message.answer("❌ Total loan balance cannot exceed 50,000 ₸.")
-        connection.close()
-        return
-
-    await state.update_data(loan_amount=amount)
-    await message.answer("Select loan duration (3, 6, or 12 months):")
-    await state.set_state(Loan.waiting_for_duration)
-    connection.close()
 
 @router.message(F.text == 'ℹ️ My Info')
 async def get_user_info(message: Message):
+    telegram_id = message.from_user.id
+    connection = get_db_connection()
     try:
-        telegram_id = message.from_user.id
-        connection = get_db_connection()
         cursor = connection.cursor()
 
-        # Fetch user details
-        cursor.execute('SELECT name, email FROM users WHERE id = ?', (telegram_id,))
-        user_info = cursor.fetchone()
+        # Fetch user details (decrypted once, then served from the profile cache)
+        profile = pii.get_profile(telegram_id)
 
-        # Fetch account details
-        cursor.execute('SELECT accountNumber, balance FROM accounts WHERE userId = ?', (telegram_id,))
-        account_info = cursor.fetchone()
+        # Fetch the active account's balance
+        account = accounts.get_active_account(telegram_id)
+        account_info = None
+        if account:
+            account_info = (account.number, accounts.get_balance(cursor, account.id), account.currency)
 
         # Fetch loan details for unpaid loans only
         cursor.execute(
@@ -487,36 +561,21 @@ async def get_user_info(message: Message):
         loan_info = cursor.fetchone()
         total_loan_amount, months_left = loan_info if loan_info else (0, None)
 
-        if user_info and account_info:
-            name, email = user_info
-            account_number, balance = account_info
-
-            # Build response message
-            info_message = (
-                f"ℹ️ Your Info:\n"
-                f"👤 Name: {name}\n"
-                f"📧 Email: {email}\n"
-                f"💳 Account Number: {account_number}\n"
-                f"💰 Balance: {balance:.2f} ₸\n"
-            )
+        if profile and account_info:
+            name, email = profile.name, profile.email
+            account_number, balance, currency = account_info
 
-            # Include loan details if applicable
-            if total_loan_amount and months_left:
-                info_message += (
-                    f"🔻 Total Loan Amount: {total_loan_amount:.2f} ₸\n"
-                    f"🗓️ Months Left to Pay: {months_left} months\n"
-                )
-            else:
-                info_message += "✔️ You have no outstanding loans.\n"
-
-            # Send the message
+            # Build response message, including loan details if applicable
+            info_message = ui.render_info_card(
+                name, email, account_number, balance, total_loan_amount, months_left, currency
+            )
             await message.answer(info_message)
         else:
             await message.answer("No information found. Please register first.")
-
-        connection.close()
     except sqlite3.Error as e:
         await message.answer(f"Failed to retrieve your info: {e}")
+    finally:
+        connection.close()
 
 # Handler for "Take a Loan" and "Donate to Charity"
 @router.message(F.text.in_(['💸 Take a Loan', '🎁 Donate to Charity']))
@@ -543,28 +602,51 @@ async def process_transaction_amount(message: Message, state: FSMContext):
         await message.answer(f"❌ Loan amount exceeds limit of {LOAN_LIMIT} ₸.")
         return
 
+    connection = get_db_connection()
     try:
-        connection = get_db_connection()
         cursor = connection.cursor()
-        cursor.execute('SELECT id FROM accounts WHERE userId = ?', (telegram_id,))
-        account_id = cursor.fetchone()[0]
-        
+        account = accounts.get_active_account(telegram_id)
+        if account is None:
+            await message.answer("❌ You are not registered. Please register first using /register.")
+            await handle_cancel(message, state)
+            return
+        account_id = account.id
+        symbol = ui.currency_symbol(account.currency)
+        amount = fx.round_amount(amount, account.currency)
+        if amount <= 0:
+            await message.answer("❌ Invalid amount. Please enter a positive number.")
+            return
+        actor = f'user:{telegram_id}'
+        change = amount
         if transaction_type == "loan":
-            cursor.execute('INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, ?)', (account_id, amount, 'Loan'))
-            await message.answer(f"💸 Loan of {amount} ₸ added to your balance.")
+            cursor.execute(
+                'INSERT INTO transactions (accountId, amount, transactionType, actor, reason) VALUES (?, ?, ?, ?, ?)',
+                (account_id, amount, 'Loan', actor, transaction_type)
+            )
+            reply = f"💸 Loan of {amount} {symbol} added to your balance."
         elif transaction_type == "donation":
-            cursor.execute('SELECT balance FROM accounts WHERE id = ?', (account_id,))
-            balance = cursor.fetchone()[0]
+            balance = accounts.get_balance(cursor, account_id) or 0
             if balance < amount:
                 await message.answer("❌ Insufficient balance for this donation.")
                 return
-            cursor.execute('INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, ?)', (account_id, -amount, 'Donation'))
-            await message.answer(f"🎁 {amount} ₸ donated to charity. Thank you!")
+            cursor.execute(
+                'INSERT INTO transactions (accountId, amount, transactionType, actor, reason) VALUES (?, ?, ?, ?, ?)',
+                (account_id, -amount, 'Donation', actor, transaction_type)
+            )
+            change = -amount
+            reply = f"🎁 {amount} {symbol} donated to charity. Thank you!"
         elif transaction_type == "deposit":
-            cursor.execute('INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, ?)', (account_id, amount, 'Deposit'))
-            await message.answer(f"💵 Deposit of {amount} ₸ successful.")
+            cursor.execute(
+                'INSERT INTO transactions (accountId, amount, transactionType, actor, reason) VALUES (?, ?, ?, ?, ?)',
+                (account_id, amount, 'Deposit', actor, transaction_type)
+            )
+            reply = f"💵 Deposit of {amount} {symbol} successful."
 
+        # Only confirm once the money has actually moved
+        step = queue_notification(cursor, telegram_id, reply)
         connection.commit()
+        await events.publish(events.BalanceChanged(telegram_id, account_id, change, account.currency, transaction_type))
+        await outbox.deliver([step])
     except sqlite3.Error as e:
         await message.answer(f"❌ Transaction failed: {e}")
     finally:
@@ -582,11 +664,7 @@ async def initiate_deposit(message: Message, state: FSMContext):
 # Transfer by phone or account number
 @router.message(F.text == '📤 Transfer')
 async def initiate_transfer(message: Message, state: FSMContext):
-    markup = ReplyKeyboardMarkup(
-    keyboard=[[KeyboardButton(text="📱 By Phone"), KeyboardButton(text="🧾 By Account Number")], [cancel_button]],
-    resize_keyboard=True
-)
-    await message.answer("Choose transfer method:", reply_markup=markup)
+    await message.answer("Choose transfer method:", reply_markup=ui.TRANSFER_METHOD_KEYBOARD)
     await state.set_state(Transfer.waiting_for_transaction_type)
 
 
@@ -598,38 +676,119 @@ async def choose_transfer_method(message: Message, state: FSMContext):
 
     if message.text == "📱 By Phone":
         await state.update_data(transfer_method="phone")
-        await message.answer("Enter the recipient's phone number:", reply_markup=create_cancel_keyboard())
+        await message.answer("Enter the recipient's phone number:", reply_markup=ui.CANCEL_KEYBOARD)
         await state.set_state(Transfer.waiting_for_recipient_phone)
     elif message.text == "🧾 By Account Number":
         await state.update_data(transfer_method="account")
-        await message.answer("Enter the recipient's account number:", reply_markup=create_cancel_keyboard())
+        await message.answer("Enter the recipient's account number:", reply_markup=ui.CANCEL_KEYBOARD)
         await state.set_state(Transfer.waiting_for_recipient_account)
+    elif message.text == "📦 Batch Transfer":
+        await message.answer(
+            "Send the payout list, one '<phone or account number> <amount>' per line, "
+            "as a message or a .txt/.csv file:",
+            reply_markup=ui.CANCEL_KEYBOARD
+        )
+        await state.set_state(Transfer.waiting_for_batch_list)
+    elif message.text == "🔁 Standing Order":
+        await message.answer(
+            "Send one '<phone or account number> <amount> <interval in days>' per line, e.g. 'ACC12 5000 30'. "
+            "Payments start today:",
+            reply_markup=ui.CANCEL_KEYBOARD
+        )
+        await state.set_state(Transfer.waiting_for_standing_orders)
     else:
         await message.answer("❌ Invalid option. Please choose a valid method.")
 
 
+# Payout lists can be typed in or uploaded as a small text file
+async def read_payout_list(message: Message):
+    if message.document:
+        if message.document.file_size and message.document.file_size > 1024 * 1024:
+            return None
+        content = await bot.download(message.document)
+        return content.read().decode('utf-8', errors='replace')
+    return message.text
+
+
+@router.message(Transfer.waiting_for_batch_list)
+async def process_batch_list(message: Message, state: FSMContext):
+    if message.text == "❌ Cancel":
+        await handle_cancel(message, state)
+        return
+
+    text = await read_payout_list(message)
+    if not text:
+        await message.answer("❌ Please send the payout list as text or a file under 1 MB.")
+        return
+
+    items, errors = payouts.parse_payout_lines(text)
+    if errors:
+        await message.answer("❌ The list was not executed:\n" + "\n".join(errors[:20]))
+        return
+
+    try:
+        total = payouts.execute_batch(message.from_user.id, items)
+    except payouts.BatchError as e:
+        await message.answer(f"❌ {e}")
+        return
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Batch transfer failed: {e}")
+        return
+
+    # The batch is paid from the active account, in its currency
+    symbol = ui.currency_symbol(accounts.get_active_account(message.from_user.id).currency)
+    await message.answer(f"📦 Batch of {len(items)} transfers ({total:.2f} {symbol}) sent successfully.")
+    await state.clear()
+    await show_main_menu(message)
+
+
+@router.message(Transfer.waiting_for_standing_orders)
+async def process_standing_orders(message: Message, state: FSMContext):
+    if message.text == "❌ Cancel":
+        await handle_cancel(message, state)
+        return
+
+    text = await read_payout_list(message)
+    if not text:
+        await message.answer("❌ Please send the orders as text or a file under 1 MB.")
+        return
+
+    items, errors = payouts.parse_payout_lines(text, with_interval=True)
+    if errors:
+        await message.answer("❌ No orders were created:\n" + "\n".join(errors[:20]))
+        return
+
+    try:
+        created = payouts.create_standing_orders(message.from_user.id, items)
+    except payouts.BatchError as e:
+        await message.answer(f"❌ {e}")
+        return
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Could not create standing orders: {e}")
+        return
+
+    await message.answer(f"🔁 {created} standing order(s) created.")
+    await state.clear()
+    await show_main_menu(message)
+
+
 @router.message(Transfer.waiting_for_recipient_phone)
 async def get_transfer_recipient_phone(message: Message, state: FSMContext):
     if message.text == "❌ Cancel":
         await handle_cancel(message, state)
         return
 
-    # Normalize the phone number
-    recipient_phone = normalize_phone_number(message.text.strip())
-    
-    # Query the database for the recipient
-    connection = get_db_connection()
-    cursor = connection.cursor()
-    cursor.execute('SELECT id, name FROM users WHERE phone = ?', (recipient_phone,))
-    recipient = cursor.fetchone()
-    connection.close()
+    # Resolve the recipient through the directory (the phone is normalized there)
+    recipient = find_by_phone(message.text.strip())
 
     if recipient:
-        recipient_id, recipient_name = recipient
-        await state.update_data(recipient_id=recipient_id, recipient_name=recipient_name)
+        recipient_id, recipient_name, recipient_account_id = recipient
+        await state.update_data(
+            recipient_id=recipient_id, recipient_name=recipient_name, recipient_account_id=recipient_account_id
+        )
         await message.answer(
             f"Recipient: {recipient_name}\nEnter the transfer amount:",
-            reply_markup=create_cancel_keyboard()
+            reply_markup=ui.CANCEL_KEYBOARD
         )
         await state.set_state(Transfer.waiting_for_transfer_amount)
     else:
@@ -644,28 +803,21 @@ async def get_transfer_recipient_account(message: Message, state: FSMContext):
 
     account_number = message.text.strip()
 
-    # Validate account number format (e.g., starts with 'ACC' followed by digits)
-    if not re.match(r'^ACC\d+$', account_number):
+    # Validate account number format (e.g., 'ACC' followed by digits, '-<n>' for additional accounts)
+    if not re.match(r'^ACC\d+(-\d+)?$', account_number):
         await message.answer("❌ Invalid account number. Please enter a valid account number starting with 'ACC' followed by digits.")
         return
 
-    connection = get_db_connection()
-    cursor = connection.cursor()
-    cursor.execute('SELECT userId FROM accounts WHERE accountNumber = ?', (account_number,))
-    recipient = cursor.fetchone()
-    connection.close()
+    recipient = find_by_account(account_number)
 
     if recipient:
-        recipient_id = recipient[0]
-        await state.update_data(recipient_account=account_number, recipient_id=recipient_id)
-
-        # Create cancel keyboard dynamically using the existing cancel_button
-        cancel_keyboard = ReplyKeyboardMarkup(
-            keyboard=[[cancel_button]],
-            resize_keyboard=True
+        recipient_id, recipient_name, recipient_account_id = recipient
+        await state.update_data(
+            recipient_account=account_number, recipient_id=recipient_id, recipient_name=recipient_name,
+            recipient_account_id=recipient_account_id
         )
 
-        await message.answer("Enter the transfer amount:", reply_markup=cancel_keyboard)
+        await message.answer("Enter the transfer amount:", reply_markup=ui.CANCEL_KEYBOARD)
         await state.set_state(Transfer.waiting_for_transfer_amount)
     else:
         await message.answer("❌ No account found with that account number.")
@@ -687,40 +839,96 @@ async def process_transfer_amount(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
     recipient_id = user_data.get("recipient_id")
     recipient_name = user_data.get("recipient_name")  # Access recipient name from state data
+    recipient_account = accounts.get_account(recipient_id, user_data.get("recipient_account_id"))
+    sender_account = accounts.get_active_account(telegram_id)
+    if sender_account is None:
+        await message.answer("❌ You are not registered. Please register first using /register.")
+        await handle_cancel(message, state)
+        return
+    if recipient_account is None:
+        recipient_account = accounts.get_active_account(recipient_id)
+    if recipient_account is None:
+        await message.answer("❌ No account found with that account number.")
+        await handle_cancel(message, state)
+        return
+
+    amount = fx.round_amount(amount, sender_account.currency)
+    if amount <= 0:
+        await message.answer("❌ Invalid amount. Please enter a positive number.")
+        return
+
+    # Velocity limits per sender, recipient and pair, in the base currency
+    try:
+        base_amount = fx.convert(amount, sender_account.currency, fx.BASE_CURRENCY)
+    except fx.UnknownCurrencyError as e:
+        await message.answer(f"❌ Transfer failed: {e}")
+        return
+    verdict = velocity.check_transfer(telegram_id, recipient_id, base_amount)
+    if verdict.action == 'block':
+        logger.warning('Transfer of %s from %s to %s blocked: %s', amount, telegram_id, recipient_id, verdict.reason)
+        await message.answer("❌ Transfer blocked: too many or too large transfers in a short time. Please try later.")
+        return
+    if verdict.action == 'flag':
+        logger.warning('Transfer of %s from %s to %s flagged: %s', amount, telegram_id, recipient_id, verdict.reason)
 
+    connection = get_db_connection()
     try:
-        connection = get_db_connection()
         cursor = connection.cursor()
 
         # Fetch sender's balance
-        cursor.execute('SELECT balance FROM accounts WHERE userId = ?', (telegram_id,))
-        sender_balance = cursor.fetchone()[0]
+        sender_balance = accounts.get_balance(cursor, sender_account.id)
+        if sender_balance is None:
+            # A cached account that no longer exists
+            await message.answer("❌ You are not registered. Please register first using /register.")
+            await handle_cancel(message, state)
+            return
 
         if sender_balance < amount:
             await message.answer("❌ Insufficient balance for this transfer.")
             return
 
-        # Deduct from sender's balance
-        cursor.execute('UPDATE accounts SET balance = balance - ? WHERE userId = ?', (amount, telegram_id))
+        # The amount is in the sender account's currency; the recipient is credited in theirs
+        credit_amount = fx.convert(amount, sender_account.currency, recipient_account.currency)
 
-        # Add to recipient's balance
-        cursor.execute('UPDATE accounts SET balance = balance + ? WHERE userId = ?', (amount, recipient_id))
+        # Record transactions for both parties; the trigger moves both balances
+        actor = f'user:{telegram_id}'
+        cursor.execute(
+            'INSERT INTO transactions (accountId, amount, transactionType, counterpartyId, actor, reason) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (sender_account.id, -amount, 'Transfer Out', recipient_id, actor, 'transfer')
+        )
+        cursor.execute(
+            'INSERT INTO transactions (accountId, amount, transactionType, counterpartyId, actor, reason) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (recipient_account.id, credit_amount, 'Transfer In', telegram_id, actor, 'transfer')
+        )
 
-        # Record transactions for both parties
-        cursor.execute('INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, ?)', (telegram_id, -amount, 'Transfer Out'))
-        cursor.execute('INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, ?)', (recipient_id, amount, 'Transfer In'))
+        # Notify both parties; if the recipient cannot be reached, the sender is told instead
+        steps = [
+            queue_notification(
+                cursor, recipient_id,
+                f"💰 You have received a transfer of {credit_amount:.2f} {ui.currency_symbol(recipient_account.currency)} "
+                f"from {message.from_user.full_name} to {recipient_account.number}.",
+                on_failure={
+                    'chat_id': telegram_id,
+                    'text': f"⚠️ {recipient_name} could not be notified about your transfer."
+                }
+            ),
+            queue_notification(
+                cursor, telegram_id,
+                f"📤 Transfer of {amount:.2f} {ui.currency_symbol(sender_account.currency)} sent to {recipient_name} successfully."
+            ),
+        ]
 
         connection.commit()
-
-        # Notify the recipient
-        await bot.send_message(
-            recipient_id,
-            f"💰 You have received a transfer of {amount:.2f} ₸ from {message.from_user.full_name}."
+        velocity.record_transfer(telegram_id, recipient_id, base_amount)
+        await events.publish(
+            events.BalanceChanged(telegram_id, sender_account.id, -amount, sender_account.currency, 'transfer'),
+            events.BalanceChanged(recipient_id, recipient_account.id, credit_amount, recipient_account.currency, 'transfer')
         )
+        await outbox.deliver(steps)
 
-        await message.answer(f"📤 Transfer of {amount:.2f} ₸ sent to {recipient_name} successfully.")
-
-    except sqlite3.Error as e:
+    except (sqlite3.Error, fx.UnknownCurrencyError) as e:
         await message.answer(f"❌ Transfer failed: {e}")
     finally:
         connection.close()
@@ -738,94 +946,18 @@ async def handle_custom_payment(message: Message, state: FSMContext):
         await message.answer("❌ Invalid amount. Please enter a positive number.")
         return
 
-    custom_amount = float(amount_text)
+    # Loans are kept in the base currency
+    custom_amount = fx.round_amount(float(amount_text))
     
     # Call the process_payment function for custom payment
     await process_payment(message, state, amount_type="custom", amount=custom_amount)
 
 
-async def process_payment(message: Message, state: FSMContext, amount_type=None, amount=None):
-    telegram_id = message.from_user.id
-    try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        # Fetch user's account balance
-        cursor.execute("SELECT balance FROM accounts WHERE userId = ?", (telegram_id,))
-        user_balance = cursor.fetchone()[0] or 0
-
-        # Fetch total loan details
-        cursor.execute("SELECT SUM(remainingBalance), SUM(monthlyPayment) FROM loans WHERE userId = ?", (telegram_id,))
-        total_loan_balance, monthly_payment = cursor.fetchone() or (0, 0)
-
-        # If no loan exists, notify the user
-        if total_loan_balance <= 0:
-            await message.answer("❌ You have no outstanding loans.")
-            return
-
-        # Determine the payment amount based on the type
-        if amount_type == "monthly":
-            payment_amount = monthly_payment
-        elif amount_type == "full":
-            payment_amount = total_loan_balance
-        elif amount_type == "custom":
-            payment_amount = amount
-
-        # Check if the user has enough balance to make the payment
-        if payment_amount > user_balance:
-            await message.answer(f"❌ Insufficient funds. Your account balance is {user_balance:.2f} ₸.")
-            return
-
-        # Deduct payment from the loan balance
-        cursor.execute(
-            """
-            UPDATE loans 
-            SET remainingBalance = remainingBalance - ? 
-            WHERE userId = ? AND remainingBalance > 0
-            """,
-            (payment_amount, telegram_id)
-        )
-
-        # Deduct payment from the user's account balance
-        cursor.execute(
-            "UPDATE accounts SET balance = balance - ? WHERE userId = ?",
-            (payment_amount, telegram_id)
-        )
-
-        # Record the payment in the transactions table
-        cursor.execute(
-            "INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, ?)",
-            (telegram_id, -payment_amount, "Loan Payment")
-        )
-
-        # Commit changes to the database
-        connection.commit()
-
-        # Updated user and loan balances after payment
-        updated_user_balance = user_balance - payment_amount
-        updated_loan_balance = total_loan_balance - payment_amount
-
-        # Notify the user of the successful payment
-        await message.answer(
-            f"✅ Payment of {payment_amount:.2f} ₸ processed successfully.\n"
-            f"💰 Updated Account Balance: {updated_user_balance:.2f} ₸\n"
-            f"🔻 Remaining Loan Balance: {updated_loan_balance:.2f} ₸."
-        )
-    except sqlite3.Error as e:
-        await message.answer(f"❌ Payment failed due to a database error: {e}")
-    finally:
-        connection.close()
-
-    # Clear the state and return to the main menu
-    await state.clear()
-    await show_main_menu(message)
-
-
 @router.message(F.text == '📅 Pay Monthly Loan')
 async def initiate_loan_payment(message: Message, state: FSMContext):
     telegram_id = message.from_user.id
+    connection = get_db_connection()
     try:
-        connection = get_db_connection()
         cursor = connection.cursor()
 
         # Fetch the single active loan with remainingBalance > 0
@@ -846,8 +978,12 @@ async def initiate_loan_payment(message: Message, state: FSMContext):
         loan_id, remaining_balance, monthly_payment, remaining_months = loan
 
         # Fetch user's account balance
-        cursor.execute("SELECT balance FROM accounts WHERE userId = ?", (telegram_id,))
-        user_balance = cursor.fetchone()[0] or 0
+        account = accounts.get_active_account(telegram_id)
+        if account is None:
+            await message.answer("❌ You are not registered. Please register first using /register.")
+            await handle_cancel(message, state)
+            return
+        user_balance = accounts.get_balance(cursor, account.id) or 0
 
         # Save the loan ID in the state
         await state.update_data(selected_loan_id=loan_id)
@@ -858,24 +994,11 @@ async def initiate_loan_payment(message: Message, state: FSMContext):
     finally:
         connection.close()
 
-    # Construct loan summary message
-    loan_summary = (
-        f"📊 Loan Summary:\n"
-        f"🔸 Remaining Balance: {remaining_balance:.2f} ₸\n"
-        f"📅 Monthly Payment: {monthly_payment:.2f} ₸\n"
-        f"🗓️ Remaining Months: {remaining_months}\n"
-        f"💵 Your Account Balance: {user_balance:.2f} ₸\n\n"
-        "Choose an option to proceed:"
+    # Display the loan summary and payment options to the user
+    loan_summary = ui.render_loan_summary(
+        remaining_balance, monthly_payment, remaining_months, user_balance, account.currency
     )
-
-    # Display options to the user
-    options_keyboard = [
-        [KeyboardButton(text="📅 Pay Monthly"), KeyboardButton(text="💵 Pay Full")],
-        [KeyboardButton(text="✏️ Pay Custom Amount"), cancel_button]
-    ]
-    markup = ReplyKeyboardMarkup(keyboard=options_keyboard, resize_keyboard=True)
-
-    await message.answer(loan_summary, reply_markup=markup)
+    await message.answer(loan_summary, reply_markup=ui.PAYMENT_OPTIONS_KEYBOARD)
     await state.set_state(Transaction.waiting_for_transaction_type)
 
 
@@ -910,8 +1033,8 @@ async def choose_payment_option(message: Message, state: FSMContext):
 
 async def process_payment(message: Message, state: FSMContext, amount_type=None, amount=None):
     telegram_id = message.from_user.id
+    connection = get_db_connection()
     try:
-        connection = get_db_connection()
         cursor = connection.cursor()
 
         # Fetch loan details with remaining balance > 0
@@ -922,7 +1045,7 @@ async def process_payment(message: Message, state: FSMContext, amount_type=None,
         loan_details = cursor.fetchone()
 
         # Log the fetched loan details for debugging
-        logging.info(f"Loan details fetched: {loan_details}")
+        logger.debug("Loan details fetched: %s", loan_details)
 
         # If no active loan with remaining balance
         if not loan_details:
@@ -930,14 +1053,19 @@ async def process_payment(message: Message, state: FSMContext, amount_type=None,
             return
 
         total_loan_balance, monthly_payment, duration_months, remaining_months = loan_details
+        installment = monthly_payment
 
         # Fetch user's account balance
-        cursor.execute("SELECT balance FROM accounts WHERE userId = ?", (telegram_id,))
-        user_balance = cursor.fetchone()[0] or 0
+        account = accounts.get_active_account(telegram_id)
+        if account is None:
+            await message.answer("❌ You are not registered. Please register first using /register.")
+            await handle_cancel(message, state)
+            return
+        user_balance = accounts.get_balance(cursor, account.id) or 0
 
         # Determine payment amount based on the type
         if amount_type == "monthly":
-            payment_amount = monthly_payment
+            payment_amount = min(monthly_payment, total_loan_balance)
             remaining_months = max(remaining_months - 1, 0)
         elif amount_type == "full":
             payment_amount = total_loan_balance
@@ -947,63 +1075,68 @@ async def process_payment(message: Message, state: FSMContext, amount_type=None,
                 await message.answer(f"❌ Payment amount ({amount:.2f} ₸) exceeds the remaining loan balance ({total_loan_balance:.2f} ₸).")
                 return
             payment_amount = amount
-            new_remaining_balance = total_loan_balance - payment_amount
-            if new_remaining_balance == 0:
-                remaining_months = 0
-            else:
-                monthly_payment = new_remaining_balance / remaining_months
         else:
             await message.answer("❌ Invalid payment type.")
             return
 
+        # Loans are kept in the base currency; the active account pays in its own currency
+        debit_amount = fx.convert(payment_amount, fx.BASE_CURRENCY, account.currency)
+
         # Ensure sufficient balance for payment
-        if payment_amount > user_balance:
-            await message.answer(f"❌ Insufficient funds. Your account balance is {user_balance:.2f} ₸.")
+        if debit_amount > user_balance:
+            await message.answer(
+                f"❌ Insufficient funds. Your account balance is {user_balance:.2f} {ui.currency_symbol(account.currency)}."
+            )
             return
 
-        # Deduct payment from the loan balance
+        # Deduct payment from the loan balance; a custom payment spreads the rest over the remaining months
         new_remaining_balance = max(total_loan_balance - payment_amount, 0)
+        monthly_payment, remaining_months = reschedule(
+            new_remaining_balance, remaining_months, None if amount_type == "custom" else monthly_payment
+        )
 
         # Deduct payment from the user's account balance
-        new_user_balance = user_balance - payment_amount
+        new_user_balance = user_balance - debit_amount
+
+        # A payment covering at least one installment moves the next due date forward a month
+        covers_installment = payment_amount >= min(installment, total_loan_balance)
 
         # Update loan details
         cursor.execute(
             """
             UPDATE loans
-            SET remainingBalance = ?, remainingMonths = ?, monthlyPayment = ?
+            SET remainingBalance = ?, remainingMonths = ?, monthlyPayment = ?,
+                nextDueDate = CASE WHEN ? THEN date(nextDueDate, '+1 month') ELSE nextDueDate END,
+                overdueDays = CASE WHEN ? THEN 0 ELSE overdueDays END
             WHERE userId = ? AND remainingBalance > 0
             """,
-            (new_remaining_balance, remaining_months, monthly_payment if new_remaining_balance > 0 else 0, telegram_id)
+            (new_remaining_balance, remaining_months, monthly_payment,
+             covers_installment, covers_installment, telegram_id)
         )
 
-        # Update user's account balance
+        # Record the transaction in the account's currency; the trigger debits the account
         cursor.execute(
-            "UPDATE accounts SET balance = ? WHERE userId = ?",
-            (new_user_balance, telegram_id)
+            "INSERT INTO transactions (accountId, amount, transactionType, actor, reason) VALUES (?, ?, ?, ?, ?)",
+            (account.id, -debit_amount, "Loan Payment", f'user:{telegram_id}', 'loan payment')
         )
 
-        # Record the transaction
-        cursor.execute(
-            "INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, ?)",
-            (telegram_id, -payment_amount, "Loan Payment")
+        # Notify the user of the successful payment
+        step = queue_notification(
+            cursor, telegram_id,
+            ui.render_payment_receipt(
+                payment_amount, new_user_balance, new_remaining_balance, remaining_months, account.currency
+            )
         )
 
         connection.commit()
-
-        # Notify the user of the successful payment
-        message_details = (
-            f"✅ Payment of {payment_amount:.2f} ₸ processed successfully.\n"
-            f"💵 Updated Account Balance: {new_user_balance:.2f} ₸\n"
-            f"🔸 Remaining Loan Balance: {new_remaining_balance:.2f} ₸\n"
+        scoring.invalidate_loan_state(telegram_id)
+        await events.publish(
+            events.LoanPaid(telegram_id, payment_amount, new_remaining_balance, remaining_months),
+            events.BalanceChanged(telegram_id, account.id, -debit_amount, account.currency, 'loan payment')
         )
-        if remaining_months > 0:
-            message_details += f"🗓️ Remaining Months: {remaining_months} months."
-        else:
-            message_details += "🎉 Your loan is fully repaid!"
-        await message.answer(message_details)
+        await outbox.deliver([step])
 
-    except sqlite3.Error as e:
+    except (sqlite3.Error, fx.UnknownCurrencyError) as e:
         await message.answer(f"❌ Payment failed due to a database error: {e}")
     finally:
         connection.close()
@@ -1011,8 +1144,135 @@ async def process_payment(message: Message, state: FSMContext, amount_type=None,
     await state.clear()
     await show_main_menu(message)
 
+@router.message(F.text == '💼 My Accounts')
+async def show_accounts(message: Message, state: FSMContext):
+    telegram_id = message.from_user.id
+    user_accounts = accounts.get_accounts(telegram_id)
+    if not user_accounts:
+        await message.answer("❌ You are not registered. Please register first using /register.")
+        return
+
+    connection = get_db_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT id, balance FROM accounts WHERE userId = ?', (telegram_id,))
+        balances = dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Error retrieving accounts: {e}")
+        return
+    finally:
+        connection.close()
+
+    active = accounts.get_active_account(telegram_id)
+    await message.answer(
+        ui.render_accounts(user_accounts, balances, active.id),
+        reply_markup=ui.build_accounts_keyboard([account.number for account in user_accounts])
+    )
+    await state.set_state(Accounts.choosing_account)
+
+
+@router.message(Accounts.choosing_account)
+async def choose_account(message: Message, state: FSMContext):
+    if message.text == "❌ Cancel":
+        await handle_cancel(message, state)
+        return
+
+    telegram_id = message.from_user.id
+    if message.text == ui.OPEN_ACCOUNT_TEXT:
+        await message.answer("Choose the account type:", reply_markup=ui.ACCOUNT_TYPE_KEYBOARD)
+        await state.set_state(Accounts.waiting_for_type)
+        return
+
+    account = accounts.find_account_by_number(telegram_id, message.text.strip())
+    if not account:
+        await message.answer("❌ Please choose one of your accounts.")
+        return
+
+    try:
+        accounts.set_active_account(telegram_id, account.id)
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Could not switch accounts: {e}")
+        return
+
+    await message.answer(f"✅ {account.number} ({account.currency}) is now your active account.")
+    await state.clear()
+    await show_main_menu(message)
+
+
+@router.message(Accounts.waiting_for_type)
+async def choose_account_type(message: Message, state: FSMContext):
+    if message.text == "❌ Cancel":
+        await handle_cancel(message, state)
+        return
+
+    if message.text not in accounts.ACCOUNT_TYPES:
+        await message.answer("❌ Invalid account type. Please choose 'savings' or 'current'.")
+        return
+
+    await state.update_data(account_type=message.text)
+    await message.answer(
+        "Choose the account currency:",
+        reply_markup=ui.build_keyboard((fx.currencies(), (ui.CANCEL_TEXT,)))
+    )
+    await state.set_state(Accounts.waiting_for_currency)
+
+
+@router.message(Accounts.waiting_for_currency)
+async def choose_account_currency(message: Message, state: FSMContext):
+    if message.text == "❌ Cancel":
+        await handle_cancel(message, state)
+        return
+
+    account_type = (await state.get_data()).get('account_type')
+    try:
+        account = accounts.open_account(message.from_user.id, account_type, message.text.strip().upper())
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    except sqlite3.Error as e:
+        await message.answer(f"❌ Could not open the account: {e}")
+        return
+
+    await message.answer(
+        f"✅ Opened {account.type} account {account.number} in {account.currency}.\n"
+        "Switch to it from 💼 My Accounts to use it for payments."
+    )
+    await state.clear()
+    await show_main_menu(message)
+
+# Database and in-memory state the handlers rely on (also used by replay.py)
+def load_state():
+    initialize_database()
+    warm_directory()
+    fx.load_rates()
+    accounts.warm_accounts()
+    scoring.load_rules()
+    scoring.refresh_features()
+    velocity.rebuild()
+
 # Main entry point
 async def main():
+    load_state()
+    record_path = os.getenv("RECORD_UPDATES")
+    if record_path:
+        replay.start_recording(dp, record_path)
+        dp.shutdown.register(replay.stop_recording)
+    profile_rate = float(os.getenv("PROFILE_RATE", "0"))
+    if profile_rate > 0:
+        profiling.enable(router.message, bot.session, profile_rate)
+    asyncio.create_task(run_archival_scheduler())
+    asyncio.create_task(run_snapshot_refresher())
+    asyncio.create_task(run_export_scheduler())
+    asyncio.create_task(run_accrual_scheduler())
+    asyncio.create_task(scoring.run_feature_refresher())
+    asyncio.create_task(velocity.run_velocity_pruner())
+    asyncio.create_task(payouts.run_standing_order_scheduler())
+    asyncio.create_task(fx.run_rates_watcher())
+    asyncio.create_task(audit.run_audit_sealer())
+    asyncio.create_task(outbox.run_outbox_worker())
+    asyncio.create_task(maintenance.run_maintenance_scheduler())
+    asyncio.create_task(balances.run_checkpoint_scheduler())
+    broadcast.resume_interrupted(bot)
     dp.include_router(router)
     await dp.storage.close()
     
@@ -1020,5 +1280,9 @@ async def main():
     await dp.start_polling(bot)
 
 if __name__ == '__main__':
-    logging.info("Starting bot...")
-    asyncio.run(main())
\ No newline at end of file
+    log_listener = setup_logging(level=os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.info("Starting bot...")
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
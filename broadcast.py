@@ -0,0 +1,241 @@
+import sqlite3
+import logging
+import asyncio
+import time
+from collections import namedtuple
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter, TelegramAPIError, TelegramNetworkError
+
+logger = logging.getLogger(__name__)
+
+# Admin broadcasts to every registered user.
+# Recipients are read from the users table in keyset-paginated chunks (id > last id seen),
+# sent concurrently through one shared rate limiter, and the outcome of every chunk is
+# recorded before the next one is read, so memory stays flat for any number of users and a
+# paused or interrupted broadcast continues after the last recorded chunk. A message reaches
+# each user at most once per broadcast apart from the chunk in flight during a crash.
+GLOBAL_RATE = 25        # messages per second; Telegram allows about 30 across all chats
+CONCURRENCY = 25
+CHUNK_SIZE = 100
+MAX_RETRIES = 3
+
+Broadcast = namedtuple('Broadcast', ['id', 'text', 'status', 'lastUserId', 'sent', 'failed', 'blocked'])
+
+
+class BroadcastError(Exception):
+    """Raised when a broadcast cannot be started or changed."""
+
+
+class RateLimiter:
+    """Spaces calls evenly at `rate` per second; pause() holds everyone back after a flood wait."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+_running = {}  # broadcast id -> task
+
+
+def create_broadcast(text, created_by, db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
+    try:
+        cursor = connection.execute(
+            "INSERT INTO broadcasts (text, createdBy) VALUES (?, ?)", (text, created_by)
+        )
+        connection.commit()
+        return cursor.lastrowid
+    finally:
+        connection.close()
+
+
+def get_broadcast(broadcast_id, db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
+    try:
+        row = connection.execute(
+            'SELECT id, text, status, lastUserId, sent, failed, blocked FROM broadcasts WHERE id = ?',
+            (broadcast_id,)
+        ).fetchone()
+    finally:
+        connection.close()
+    return Broadcast(*row) if row else None
+
+
+def latest_broadcast(db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
+    try:
+        row = connection.execute('SELECT MAX(id) FROM broadcasts').fetchone()
+    finally:
+        connection.close()
+    return get_broadcast(row[0], db_path) if row[0] else None
+
+
+def _set_status(broadcast_id, status, db_path):
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute('UPDATE broadcasts SET status = ? WHERE id = ?', (status, broadcast_id))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def unblock_user(user_id, db_path='banking_bot.db'):
+    """Include a user in broadcasts again (they talked to the bot, so they no longer block it)."""
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute('UPDATE users SET blockedBot = 0 WHERE id = ? AND blockedBot = 1', (user_id,))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _next_chunk(after_id, chunk_size, db_path):
+    connection = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in connection.execute(
+            '''
+            SELECT id FROM users
+            WHERE id > ? AND blockedBot = 0
+            ORDER BY id
+            LIMIT ?
+            ''',
+            (after_id, chunk_size)
+        )]
+    finally:
+        connection.close()
+
+
+def _record_chunk(broadcast_id, last_user_id, results, db_path):
+    """Store the (user id, status, error) results of a chunk and move the cursor past it."""
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.executemany(
+            'INSERT OR REPLACE INTO broadcast_deliveries (broadcastId, userId, status, error) VALUES (?, ?, ?, ?)',
+            [(broadcast_id, user_id, status, error) for user_id, status, error in results]
+        )
+        connection.executemany(
+            'UPDATE users SET blockedBot = 1 WHERE id = ?',
+            [(user_id,) for user_id, status, _ in results if status == 'blocked']
+        )
+        counts = {status: sum(1 for _, result, _ in results if result == status) for status in ('sent', 'failed', 'blocked')}
+        connection.execute(
+            '''
+            UPDATE broadcasts
+            SET lastUserId = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+            WHERE id = ?
+            ''',
+            (last_user_id, counts['sent'], counts['failed'], counts['blocked'], broadcast_id)
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+async def _send_one(bot, user_id, text, limiter, semaphore):
+    async with semaphore:
+        for _ in range(MAX_RETRIES):
+            await limiter.wait()
+            try:
+                await bot.send_message(user_id, text)
+                return user_id, 'sent', None
+            except TelegramRetryAfter as e:
+                limiter.pause(e.retry_after)
+            except TelegramForbiddenError as e:
+                return user_id, 'blocked', str(e)
+            except (TelegramAPIError, TelegramNetworkError) as e:
+                return user_id, 'failed', str(e)
+        return user_id, 'failed', 'rate limited'
+
+
+async def run_broadcast(bot, broadcast_id, rate=GLOBAL_RATE, concurrency=CONCURRENCY,
+                        chunk_size=CHUNK_SIZE, db_path='banking_bot.db'):
+    """Send (or continue sending) a broadcast until every user has been tried or it is paused."""
+    broadcast = get_broadcast(broadcast_id, db_path)
+    limiter = RateLimiter(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    after_id = broadcast.lastUserId
+    while True:
+        # Pausing takes effect between chunks
+        broadcast = get_broadcast(broadcast_id, db_path)
+        if broadcast.status != 'running':
+            logger.info('Broadcast %s %s after user %s.', broadcast_id, broadcast.status, after_id)
+            return broadcast
+        user_ids = _next_chunk(after_id, chunk_size, db_path)
+        if not user_ids:
+            break
+        results = await asyncio.gather(*(
+            _send_one(bot, user_id, broadcast.text, limiter, semaphore) for user_id in user_ids
+        ))
+        after_id = user_ids[-1]
+        _record_chunk(broadcast_id, after_id, results, db_path)
+
+    _set_status(broadcast_id, 'done', db_path)
+    broadcast = get_broadcast(broadcast_id, db_path)
+    logger.info(
+        'Broadcast %s done: %s sent, %s failed, %s blocked.',
+        broadcast_id, broadcast.sent, broadcast.failed, broadcast.blocked
+    )
+    return broadcast
+
+
+def _ensure_idle():
+    # One broadcast at a time keeps every chat within Telegram's per-chat limit
+    for task in _running.values():
+        if not task.done():
+            raise BroadcastError('Another broadcast is still running.')
+
+
+def start(bot, broadcast_id, db_path='banking_bot.db'):
+    """Run a broadcast in the background."""
+    _ensure_idle()
+    _set_status(broadcast_id, 'running', db_path)
+    task = asyncio.create_task(run_broadcast(bot, broadcast_id, db_path=db_path))
+    _running[broadcast_id] = task
+    task.add_done_callback(lambda _: _running.pop(broadcast_id, None))
+    return task
+
+
+def send_to_all(bot, text, created_by, db_path='banking_bot.db'):
+    """Create a broadcast and start sending it. Returns its id."""
+    _ensure_idle()
+    broadcast_id = create_broadcast(text, created_by, db_path)
+    start(bot, broadcast_id, db_path)
+    return broadcast_id
+
+
+def pause(broadcast_id, db_path='banking_bot.db'):
+    broadcast = get_broadcast(broadcast_id, db_path)
+    if broadcast is None or broadcast.status != 'running':
+        raise BroadcastError('That broadcast is not running.')
+    _set_status(broadcast_id, 'paused', db_path)
+
+
+def resume(bot, broadcast_id, db_path='banking_bot.db'):
+    broadcast = get_broadcast(broadcast_id, db_path)
+    if broadcast is None or broadcast.status == 'done':
+        raise BroadcastError('That broadcast cannot be resumed.')
+    if broadcast_id in _running:
+        raise BroadcastError('That broadcast is still finishing its current chunk.')
+    return start(bot, broadcast_id, db_path)
+
+
+def resume_interrupted(bot, db_path='banking_bot.db'):
+    """Continue broadcasts that were running when the bot stopped."""
+    connection = sqlite3.connect(db_path)
+    try:
+        row = connection.execute("SELECT MIN(id) FROM broadcasts WHERE status = 'running'").fetchone()
+    finally:
+        connection.close()
+    if row[0]:
+        logger.info('Resuming broadcast %s.', row[0])
+        start(bot, row[0], db_path)
@@ -1,9 +1,18 @@
 import sqlite3
 import logging
+import os
+
+from directory import phone_key
+import audit
+import pii
+import archive
+import fx
+
+logger = logging.getLogger(__name__)
 
 # Initialize the database and create required tables with constraints
-def initialize_database():
-    connection = sqlite3.connect('banking_bot.db')
+def initialize_database(db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
     cursor = connection.cursor()
 
     # Create Users Table with a unique email constraint
@@ -54,19 +63,462 @@ def initialize_database():
         )
     ''')
 
-    # Create Trigger to automatically update account balance after a transaction
+    # The trigger that applies each transaction to its account balance is created with the
+    # audit tables (create_balance_trigger), as it also stamps accounts.lastTransactionId
+
+    # Per-account totals of transactions moved into the archive databases (see archive.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            accountId INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            amount REAL NOT NULL,
+            transactionCount INTEGER NOT NULL,
+            PRIMARY KEY (accountId, period)
+        )
+    ''')
+
+    # Registry of archive database files, one per closed period
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transaction_archives (
+            period TEXT PRIMARY KEY,
+            path TEXT NOT NULL
+        )
+    ''')
+
+    # Daily interest and penalty entries written by the accrual engine (see accrual.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS loan_accruals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            loanId INTEGER NOT NULL,
+            accrualDate TEXT NOT NULL,
+            days INTEGER NOT NULL,
+            interest REAL NOT NULL,
+            penalty REAL NOT NULL,
+            UNIQUE (loanId, accrualDate),
+            FOREIGN KEY (loanId) REFERENCES loans(id)
+        )
+    ''')
+
+    # Recurring transfers executed by the standing order scheduler (see payouts.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS standing_orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            userId INTEGER NOT NULL,
+            recipientId INTEGER NOT NULL,
+            amount REAL NOT NULL CHECK (amount > 0),
+            intervalDays INTEGER NOT NULL CHECK (intervalDays > 0),
+            nextRunDate TEXT NOT NULL,
+            lastRunDate TEXT,
+            active INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (userId) REFERENCES users(id),
+            FOREIGN KEY (recipientId) REFERENCES users(id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_standing_orders_due ON standing_orders(active, nextRunDate)')
+
+    # Follow-up steps of money operations, written in the same transaction (see outbox.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            nextAttemptAt TEXT NOT NULL,
+            lastError TEXT,
+            createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, nextAttemptAt)')
+
+    # Admin broadcasts and the outcome per user (see broadcast.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'created',
+            lastUserId INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            createdBy INTEGER,
+            createdAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcastId INTEGER NOT NULL,
+            userId INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (broadcastId, userId)
+        ) WITHOUT ROWID
+    ''')
+
+    connection.commit()
+
+    migrate_encrypt_pii(connection)
+    migrate_loan_accrual(connection)
+    migrate_transaction_counterparty(connection)
+    migrate_multi_account(connection)
+    migrate_blocked_users(connection)
+    migrate_balance_checkpoints(connection)
+    create_audit_tables(connection)
+    migrate_storage(connection)
+    connection.close()
+
+
+# Automatically update the account balance after a transaction. Stamping the transaction id
+# on the account tells the audit trigger that the change is already recorded in the ledger.
+def create_balance_trigger(cursor):
+    cursor.execute('DROP TRIGGER IF EXISTS update_balance_after_transaction')
     cursor.execute('''
-        CREATE TRIGGER IF NOT EXISTS update_balance_after_transaction
+        CREATE TRIGGER update_balance_after_transaction
         AFTER INSERT ON transactions
         BEGIN
             UPDATE accounts
-            SET balance = balance + NEW.amount
+            SET balance = balance + NEW.amount, lastTransactionId = NEW.id
             WHERE id = NEW.accountId;
         END;
     ''')
 
+
+# Audit trail of balance changes (see audit.py)
+def create_audit_tables(connection):
+    cursor = connection.cursor()
+
+    # Who made each ledger entry; entries without an actor were written by plain SQL
+    cursor.execute('PRAGMA table_info(transactions)')
+    columns = [row[1] for row in cursor.fetchall()]
+    for name in ('actor', 'reason'):
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE transactions ADD COLUMN {name} TEXT')
+    cursor.execute('PRAGMA table_info(accounts)')
+    if 'lastTransactionId' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE accounts ADD COLUMN lastTransactionId INTEGER')
+    create_balance_trigger(cursor)
+
+    # Balance changes made outside the ledger, waiting to be hashed into audit_log.
+    # Rows without an accountId are context markers written by audit.set_context/clear_context;
+    # each change copies actor and reason from the newest marker, found through the partial index.
+    # afterTransactionId places the change between the ledger entries for the sealer.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_pending (
+            id INTEGER PRIMARY KEY,
+            accountId INTEGER,
+            actor TEXT,
+            reason TEXT,
+            balanceBefore REAL,
+            balanceAfter REAL,
+            changedAt TEXT,
+            afterTransactionId INTEGER
+        )
+    ''')
+    cursor.execute('PRAGMA table_info(audit_pending)')
+    if 'afterTransactionId' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE audit_pending ADD COLUMN afterTransactionId INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_pending_markers ON audit_pending(id) WHERE accountId IS NULL')
+
+    # Sealer state: the last ledger entry sealed and the balance each account had at that point
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            lastTransactionId INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_balances (
+            accountId INTEGER PRIMARY KEY,
+            balance REAL
+        )
+    ''')
+    cursor.execute('SELECT 1 FROM audit_state')
+    if cursor.fetchone() is None:
+        audit.rebase(cursor)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY,
+            accountId INTEGER NOT NULL,
+            actor TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            balanceBefore REAL,
+            balanceAfter REAL,
+            changedAt TEXT NOT NULL,
+            hash TEXT NOT NULL
+        )
+    ''')
+
+    # Record every balance write the ledger trigger did not make; writes without a marker are
+    # plain SQL. Recreated on start so older databases get the current form.
+    cursor.execute('DROP TRIGGER IF EXISTS audit_balance_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS audit_balance_update')
+    cursor.execute('''
+        CREATE TRIGGER audit_balance_insert
+        AFTER INSERT ON accounts
+        BEGIN
+            INSERT INTO audit_pending (accountId, actor, reason, balanceBefore, balanceAfter, changedAt, afterTransactionId)
+            VALUES (
+                NEW.id,
+                COALESCE((SELECT actor FROM audit_pending WHERE accountId IS NULL ORDER BY id DESC LIMIT 1), 'sql'),
+                COALESCE((SELECT reason FROM audit_pending WHERE accountId IS NULL ORDER BY id DESC LIMIT 1), 'direct update'),
+                NULL, NEW.balance, strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                (SELECT MAX(id) FROM transactions)
+            );
+        END;
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER audit_balance_update
+        AFTER UPDATE OF balance ON accounts
+        WHEN OLD.balance IS NOT NEW.balance AND NEW.lastTransactionId IS OLD.lastTransactionId
+        BEGIN
+            INSERT INTO audit_pending (accountId, actor, reason, balanceBefore, balanceAfter, changedAt, afterTransactionId)
+            VALUES (
+                NEW.id,
+                COALESCE((SELECT actor FROM audit_pending WHERE accountId IS NULL ORDER BY id DESC LIMIT 1), 'sql'),
+                COALESCE((SELECT reason FROM audit_pending WHERE accountId IS NULL ORDER BY id DESC LIMIT 1), 'direct update'),
+                OLD.balance, NEW.balance, strftime('%Y-%m-%d %H:%M:%f', 'now'),
+                (SELECT MAX(id) FROM transactions)
+            );
+        END;
+    ''')
+
+    # The sealed log is append-only
+    for event in ('UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS audit_log_no_{event.lower()}
+            BEFORE {event} ON audit_log
+            BEGIN
+                SELECT RAISE(ABORT, 'audit_log is append-only');
+            END;
+        ''')
+    connection.commit()
+
+
+# Migration: encrypt name, email and phone (see pii.py) and replace the plaintext lookup
+# columns with blind indexes; v1 ciphertexts are re-encrypted bound to their user id, and the
+# plaintext normalizedPhone column from before encryption is dropped
+def migrate_encrypt_pii(connection):
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA table_info(users)')
+    columns = [row[1] for row in cursor.fetchall()]
+    for name in ('emailIndex', 'phoneIndex'):
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE users ADD COLUMN {name} TEXT')
+
+    cursor.execute('SELECT id, name, email, phone FROM users WHERE emailIndex IS NULL')
+    rows = cursor.fetchall()
+    if rows:
+        cursor.executemany(
+            'UPDATE users SET name = ?, email = ?, phone = ?, emailIndex = ?, phoneIndex = ? WHERE id = ?',
+            [(*pii.encrypt_user(user_id, name, email, phone), phone_key(phone), user_id) for user_id, name, email, phone in rows]
+        )
+        logger.info('Encrypted the personal data of %s users.', len(rows))
+
+    cursor.execute(
+        "SELECT id, name, email, phone FROM users WHERE name LIKE ?1 || '%' OR email LIKE ?1 || '%' OR phone LIKE ?1 || '%'",
+        (pii.LEGACY_PREFIX,)
+    )
+    rows = cursor.fetchall()
+    if rows:
+        cursor.executemany(
+            'UPDATE users SET name = ?, email = ?, phone = ? WHERE id = ?',
+            [
+                (*(
+                    pii.encrypt(field, pii.decrypt_legacy(field, value), user_id) if pii.is_legacy(value) else value
+                    for field, value in zip(pii.Profile._fields, values)
+                ), user_id)
+                for user_id, *values in rows
+            ]
+        )
+        logger.info('Re-encrypted the personal data of %s users with their user id bound.', len(rows))
+
+    if 'normalizedPhone' in columns:
+        cursor.execute('DROP INDEX IF EXISTS idx_users_normalized_phone')
+        cursor.execute('DROP INDEX IF EXISTS idx_users_normalized_phone_dup')
+        cursor.execute('ALTER TABLE users DROP COLUMN normalizedPhone')
+
+    for column in ('emailIndex', 'phoneIndex'):
+        try:
+            cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_users_{column} ON users({column})')
+        except sqlite3.IntegrityError as e:
+            logger.error('Duplicate %s values prevent a unique index: %s', column, e)
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_users_{column}_dup ON users({column})')
+    connection.commit()
+
+
+# Migration: add the interest, due date and penalty tracking columns used by the accrual engine
+def migrate_loan_accrual(connection):
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA table_info(loans)')
+    columns = [row[1] for row in cursor.fetchall()]
+    new_columns = {
+        'interestRate': 'REAL NOT NULL DEFAULT 0.23',
+        'accruedInterest': 'REAL NOT NULL DEFAULT 0',
+        'accruedPenalty': 'REAL NOT NULL DEFAULT 0',
+        'overdueDays': 'INTEGER NOT NULL DEFAULT 0',
+        'worstOverdueDays': 'INTEGER NOT NULL DEFAULT 0',  # kept after the loan is caught up or repaid
+        'nextDueDate': 'TEXT',
+        'lastAccrualDate': 'TEXT',
+    }
+    for name, definition in new_columns.items():
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE loans ADD COLUMN {name} {definition}')
+
+    # Existing loans start accruing from today with their next payment due in a month
+    cursor.execute("UPDATE loans SET lastAccrualDate = date('now') WHERE lastAccrualDate IS NULL")
+    cursor.execute("UPDATE loans SET nextDueDate = date('now', '+1 month') WHERE nextDueDate IS NULL")
+    cursor.execute('UPDATE loans SET worstOverdueDays = overdueDays WHERE worstOverdueDays < overdueDays')
+    connection.commit()
+
+
+# Migration: link both legs of a transfer to the other party's user id
+def migrate_transaction_counterparty(connection):
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA table_info(transactions)')
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'counterpartyId' not in columns:
+        cursor.execute('ALTER TABLE transactions ADD COLUMN counterpartyId INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_type_date ON transactions(transactionType, transactionDate)')
+    connection.commit()
+    # Archived transfers keep their counterparty too
+    archive.upgrade_archives(connection)
+
+
+# Migration: incremental auto-vacuum and WAL journaling, maintained online by maintenance.py.
+# Switching auto_vacuum on an existing database takes one full VACUUM, done once at startup.
+def migrate_storage(connection):
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:  # 2 = INCREMENTAL
+        logger.info('Rebuilding the database for incremental vacuum...')
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+    cursor.execute('PRAGMA journal_mode = WAL')
+
+
+# Migration: remember users who blocked the bot so broadcasts skip them
+def migrate_blocked_users(connection):
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA table_info(users)')
+    if 'blockedBot' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE users ADD COLUMN blockedBot INTEGER NOT NULL DEFAULT 0')
+    connection.commit()
+
+
+# Point the rows of `schema`.transactions that hold a telegram id at the owner's first account.
+# Returns (rows remapped, rows left ambiguous).
+def _remap_telegram_ids(cursor, schema):
+    # Counted first: remapped rows hold account ids that may also be telegram ids
+    cursor.execute(f'''
+        SELECT COUNT(*) FROM {schema}.transactions
+        WHERE transactionType IN ('Transfer In', 'Transfer Out', 'Loan Payment', 'Loan')
+          AND accountId IN (SELECT userId FROM main.accounts) AND accountId IN (SELECT id FROM main.accounts)
+    ''')
+    ambiguous = cursor.fetchone()[0]
+    cursor.execute(f'''
+        UPDATE {schema}.transactions
+        SET accountId = (SELECT MIN(id) FROM main.accounts WHERE accounts.userId = transactions.accountId)
+        WHERE accountId IN (SELECT userId FROM main.accounts) AND accountId NOT IN (SELECT id FROM main.accounts)
+    ''')
+    return cursor.rowcount, ambiguous
+
+
+# Migration: point-in-time balance checkpoints (see balances.py) and the ledger fix they rely on.
+# Transfers, loans and loan payments used to record the telegram id in transactions.accountId
+# and move the balance by hand; every row now names the account and the trigger is the only
+# balance writer. Old rows, archived periods included, are pointed at the user's first account
+# once, when the tables are created.
+def migrate_balance_checkpoints(connection):
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balance_checkpoints'")
+    if cursor.fetchone() is None:
+        remapped, ambiguous = _remap_telegram_ids(cursor, 'main')
+        # Per-period totals of archived rows were summed under the same ids
+        cursor.execute('''
+            INSERT INTO balance_snapshots (accountId, period, amount, transactionCount)
+            SELECT (SELECT MIN(id) FROM accounts WHERE accounts.userId = s.accountId), period, amount, transactionCount
+            FROM balance_snapshots AS s
+            WHERE accountId IN (SELECT userId FROM accounts) AND accountId NOT IN (SELECT id FROM accounts)
+            ON CONFLICT (accountId, period) DO UPDATE SET
+                amount = amount + excluded.amount,
+                transactionCount = transactionCount + excluded.transactionCount
+        ''')
+        cursor.execute('''
+            DELETE FROM balance_snapshots
+            WHERE accountId IN (SELECT userId FROM accounts) AND accountId NOT IN (SELECT id FROM accounts)
+        ''')
+        # ATTACH is not allowed inside a transaction
+        connection.commit()
+        cursor.execute('SELECT period, path FROM transaction_archives ORDER BY period')
+        for period, path in cursor.fetchall():
+            if not os.path.exists(path):
+                logger.error('Archive for period %s is missing: %s', period, path)
+                continue
+            alias = f'archive_{period}'
+            cursor.execute('ATTACH DATABASE ? AS ' + alias, (path,))
+            try:
+                archive.ensure_archive_schema(cursor, alias)
+                archived, archived_ambiguous = _remap_telegram_ids(cursor, alias)
+                connection.commit()
+            finally:
+                cursor.execute('DETACH DATABASE ' + alias)
+            remapped += archived
+            ambiguous += archived_ambiguous
+        if remapped:
+            logger.info('Pointed %s transactions recorded under a telegram id at the account.', remapped)
+        if ambiguous:
+            logger.warning('%s transactions have an accountId that is both a telegram id and an account id; left as is.', ambiguous)
+
+    # Balance of an account after every transaction up to checkpointAt
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_checkpoints (
+            accountId INTEGER NOT NULL,
+            checkpointAt TEXT NOT NULL,
+            balance REAL NOT NULL,
+            PRIMARY KEY (accountId, checkpointAt)
+        ) WITHOUT ROWID
+    ''')
+    # One row per checkpoint run: transactions up to lastTransactionId are covered by checkpoints
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_checkpoint_runs (
+            checkpointAt TEXT PRIMARY KEY,
+            lastTransactionId INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_account_date ON transactions(accountId, transactionDate)')
+    connection.commit()
+
+
+# Migration: per-account currency, the user's active account and standing order accounts
+def migrate_multi_account(connection):
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA table_info(accounts)')
+    if 'currency' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN currency TEXT NOT NULL DEFAULT 'KZT'")
+
+    cursor.execute('PRAGMA table_info(users)')
+    if 'activeAccountId' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE users ADD COLUMN activeAccountId INTEGER REFERENCES accounts(id)')
+    # A user can own several accounts, and handlers look them up by owner far more often than by id
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_accounts_user ON accounts(userId)')
+
+    cursor.execute('PRAGMA table_info(standing_orders)')
+    columns = [row[1] for row in cursor.fetchall()]
+    for name in ('fromAccountId', 'toAccountId'):
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE standing_orders ADD COLUMN {name} INTEGER REFERENCES accounts(id)')
+    # Orders created before multi-account support use each user's first account
+    cursor.execute('''
+        UPDATE standing_orders
+        SET fromAccountId = (SELECT MIN(id) FROM accounts WHERE accounts.userId = standing_orders.userId)
+        WHERE fromAccountId IS NULL
+    ''')
+    cursor.execute('''
+        UPDATE standing_orders
+        SET toAccountId = (SELECT MIN(id) FROM accounts WHERE accounts.userId = standing_orders.recipientId)
+        WHERE toAccountId IS NULL
+    ''')
     connection.commit()
-    connection.close()
 
 
 # CRUD Operations with error handling
@@ -74,13 +526,24 @@ def create_user(name, email, phone):
     connection = sqlite3.connect('banking_bot.db')
     cursor = connection.cursor()
     try:
-        cursor.execute('INSERT INTO users (name, email, phone) VALUES (?, ?, ?)', (name, email, phone))
+        # The ciphertexts bind the user id, which is only known once the row exists; the email
+        # blind index stands in for the unique email until the update below
+        email_index = pii.email_index(email)
+        cursor.execute(
+            "INSERT INTO users (name, email, phone, emailIndex, phoneIndex) VALUES ('', ?, '', ?, ?)",
+            (email_index, email_index, phone_key(phone))
+        )
+        user_id = cursor.lastrowid
+        cursor.execute(
+            'UPDATE users SET name = ?, email = ?, phone = ?, emailIndex = ? WHERE id = ?',
+            (*pii.encrypt_user(user_id, name, email, phone), user_id)
+        )
         connection.commit()
-        logging.info(f'User {name} created successfully.')
+        logger.info('User %s created successfully.', name)
     except sqlite3.IntegrityError as e:
-        logging.error(f'Failed to create user: Integrity error (possibly a duplicate email): {e}')
+        logger.error('Failed to create user: Integrity error (possibly a duplicate email): %s', e)
     except sqlite3.Error as e:
-        logging.error(f'Failed to create user: {e}')
+        logger.error('Failed to create user: %s', e)
     finally:
         connection.close()
 
@@ -92,28 +555,35 @@ def get_account_balance(account_id):
         balance = cursor.fetchone()
         return balance[0] if balance else None
     except sqlite3.Error as e:
-        logging.error(f'Error fetching account balance: {e}')
+        logger.error('Error fetching account balance: %s', e)
         return None
     finally:
         connection.close()
 
-def update_account_balance(account_id, amount):
+def update_account_balance(account_id, amount, actor='system', reason='balance adjustment'):
     connection = sqlite3.connect('banking_bot.db')
     cursor = connection.cursor()
     try:
         # Check if the balance will remain non-negative after the update
-        cursor.execute('SELECT balance FROM accounts WHERE id = ?', (account_id,))
+        cursor.execute('SELECT balance, currency FROM accounts WHERE id = ?', (account_id,))
         balance = cursor.fetchone()
-        if balance and (balance[0] + amount) < 0:
+        if balance is None:
+            raise ValueError("Account not found.")
+        amount = fx.round_amount(amount, balance[1])
+        if (balance[0] + amount) < 0:
             raise ValueError("Insufficient funds for this transaction.")
 
-        cursor.execute('UPDATE accounts SET balance = balance + ? WHERE id = ?', (amount, account_id))
+        # Recorded in the ledger; the trigger moves the balance
+        cursor.execute(
+            'INSERT INTO transactions (accountId, amount, transactionType, actor, reason) VALUES (?, ?, ?, ?, ?)',
+            (account_id, amount, 'Adjustment', actor, reason)
+        )
         connection.commit()
-        logging.info(f'Account {account_id} balance updated successfully.')
+        logger.info('Account %s balance updated successfully.', account_id)
     except ValueError as e:
-        logging.error(f'Balance update failed: {e}')
+        logger.error('Balance update failed: %s', e)
     except sqlite3.Error as e:
-        logging.error(f'Failed to update account balance: {e}')
+        logger.error('Failed to update account balance: %s', e)
     finally:
         connection.close()
 
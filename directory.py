@@ -0,0 +1,133 @@
+import sqlite3
+import re
+import logging
+
+import pii
+
+logger = logging.getLogger(__name__)
+
+# In-memory recipient directory used by the transfer flows.
+# Both maps point to a (user id, name, account id) tuple; a phone number resolves to the
+# user's first account. Phones are keyed by their blind index, so no plaintext number is held.
+_by_phone = {}
+_by_account = {}
+
+
+def normalize_phone_number(phone: str) -> str:
+    """
+    Normalizes phone numbers to a standard format (without '+' and country code normalized to '7').
+    Examples:
+        '+7702-------' -> '7702-------'
+        '8702-------'  -> '7702-------'
+        '702-------'   -> '7702-------'
+    """
+    phone = re.sub(r'\D', '', phone)  # Remove non-numeric characters
+    if phone.startswith('8'):        # Replace leading '8' with '7' (Kazakhstan standard)
+        phone = '7' + phone[1:]
+    elif phone.startswith('7') and len(phone) == 10:
+        phone = '7' + phone  # Add missing country code
+    return phone
+
+
+def phone_key(phone):
+    """Blind index of a phone number in any format the user typed (users.phoneIndex)."""
+    return pii.blind_index('phone', normalize_phone_number(phone))
+
+
+def add_recipient(user_id, name, phone, account_id, account_number):
+    """Register a user in the directory (called after a successful registration)."""
+    entry = (user_id, name, account_id)
+    if phone:
+        _by_phone[phone_key(phone)] = entry
+    if account_number:
+        _by_account[account_number] = entry
+
+
+# Load every user/account pair into memory, replacing the current contents
+def warm_directory(db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('''
+            SELECT u.id, u.name, u.phoneIndex, a.id, a.accountNumber
+            FROM users u
+            JOIN accounts a ON a.userId = u.id
+            ORDER BY a.id
+        ''')
+        rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error('Failed to warm recipient directory: %s', e)
+        return 0
+    finally:
+        connection.close()
+
+    _by_phone.clear()
+    _by_account.clear()
+    names = {}
+    for user_id, name, phone_index, account_id, account_number in rows:
+        if user_id not in names:
+            names[user_id] = pii.decrypt('name', name, user_id)
+        entry = (user_id, names[user_id], account_id)
+        if phone_index:
+            _by_phone.setdefault(phone_index, entry)
+        _by_account[account_number] = entry
+    logger.info('Recipient directory warmed with %s accounts.', len(rows))
+    return len(rows)
+
+
+def _load_one(query, params, db_path):
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error('Recipient lookup failed: %s', e)
+        return None
+    finally:
+        connection.close()
+
+
+def find_by_phone(phone, db_path='banking_bot.db'):
+    """
+    Resolve a phone number (in any format the user typed) to (user id, name, account id).
+    Falls back to the indexed phoneIndex column on a miss, e.g. when the
+    directory has not been warmed yet or the user was added outside the bot.
+    """
+    key = phone_key(phone)
+    entry = _by_phone.get(key)
+    if entry is not None:
+        return entry
+
+    row = _load_one('''
+        SELECT u.id, u.name, a.id
+        FROM users u
+        JOIN accounts a ON a.userId = u.id
+        WHERE u.phoneIndex = ?
+        ORDER BY a.id
+        LIMIT 1
+    ''', (key,), db_path)
+    if not row:
+        return None
+    user_id, name, account_id = row
+    _by_phone[key] = (user_id, pii.decrypt('name', name, user_id), account_id)
+    return _by_phone[key]
+
+
+def find_by_account(account_number, db_path='banking_bot.db'):
+    """Resolve an account number to (user id, name, account id)."""
+    entry = _by_account.get(account_number)
+    if entry is not None:
+        return entry
+
+    row = _load_one('''
+        SELECT u.id, u.name, a.id
+        FROM accounts a
+        JOIN users u ON u.id = a.userId
+        WHERE a.accountNumber = ?
+    ''', (account_number,), db_path)
+    if not row:
+        return None
+    user_id, name, account_id = row
+    add_recipient(user_id, pii.decrypt('name', name, user_id), None, account_id, account_number)
+    return _by_account[account_number]
@@ -0,0 +1,82 @@
+import logging
+import asyncio
+from collections import namedtuple, defaultdict
+
+import fx
+
+logger = logging.getLogger(__name__)
+
+# In-process event bus.
+# Handlers publish what they just committed once, with the values they already hold, and
+# every consumer gets it from memory instead of querying SQLite again. Each subscriber has
+# its own bounded queue drained by its own task: a slow consumer holds up only the
+# publishers once its queue is full (back-pressure), never the other consumers.
+QUEUE_SIZE = 1000
+
+BalanceChanged = namedtuple('BalanceChanged', ['user_id', 'account_id', 'amount', 'currency', 'reason'])
+LoanIssued = namedtuple('LoanIssued', ['user_id', 'amount', 'monthly_payment', 'duration_months', 'interest_rate'])
+LoanPaid = namedtuple('LoanPaid', ['user_id', 'amount', 'remaining_balance', 'remaining_months'])
+UserRegistered = namedtuple('UserRegistered', ['user_id', 'name', 'account_id', 'account_number'])
+
+
+class _Subscriber:
+    def __init__(self, callback, maxsize):
+        self.callback = callback
+        self.maxsize = maxsize
+        self.queue = None
+        self.task = None
+
+    def start(self):
+        """Start the consuming task on the running loop, once per loop."""
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.get_loop() is not loop:
+            self.queue = asyncio.Queue(self.maxsize)
+            self.task = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            event = await self.queue.get()
+            try:
+                await self.callback(event)
+            except Exception:
+                logger.exception('Event subscriber %s failed on %s', self.callback.__name__, type(event).__name__)
+            finally:
+                self.queue.task_done()
+
+
+_subscribers = defaultdict(list)  # event type -> [_Subscriber]
+
+
+def subscribe(event_type, callback, maxsize=QUEUE_SIZE):
+    """Run `await callback(event)` for every published event of `event_type`."""
+    _subscribers[event_type].append(_Subscriber(callback, maxsize))
+
+
+async def publish(*events):
+    """Hand committed events to their subscribers, waiting while a subscriber's queue is full."""
+    for event in events:
+        for subscriber in _subscribers.get(type(event), ()):
+            subscriber.start()
+            await subscriber.queue.put(event)
+
+
+async def drain():
+    """Wait until every published event has been consumed."""
+    for subscribers in list(_subscribers.values()):
+        for subscriber in subscribers:
+            if subscriber.queue is not None:
+                await subscriber.queue.join()
+
+
+# Running totals per (event type, currency), kept from the events alone; loans are in the base currency
+metrics = defaultdict(lambda: {'count': 0, 'amount': 0.0})
+
+
+async def record_metrics(event):
+    totals = metrics[type(event).__name__, getattr(event, 'currency', fx.BASE_CURRENCY)]
+    totals['count'] += 1
+    totals['amount'] += getattr(event, 'amount', 0.0)
+
+
+for _event_type in (BalanceChanged, LoanIssued, LoanPaid, UserRegistered):
+    subscribe(_event_type, record_metrics)
@@ -0,0 +1,81 @@
+import logging
+import asyncio
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+# FX rates held in memory and reloaded when fx_rates.json changes on disk.
+# Rates give the value of one unit of a currency in the base currency.
+RATES_PATH = 'fx_rates.json'
+BASE_CURRENCY = 'KZT'
+RELOAD_CHECK_SECONDS = 30
+MINOR_UNITS = {'JPY': 0, 'KRW': 0}  # decimal places per currency; the rest have 2
+DEFAULT_MINOR_UNITS = 2
+
+_rates = {BASE_CURRENCY: 1.0}
+_loaded_mtime = None
+
+
+class UnknownCurrencyError(ValueError):
+    """Raised when converting from or to a currency without a rate."""
+
+
+def load_rates(path=RATES_PATH):
+    """(Re)load the rate table. The previous table is kept if the file is missing or invalid."""
+    global _rates, _loaded_mtime
+    try:
+        mtime = os.path.getmtime(path)
+        with open(path) as f:
+            data = json.load(f)
+        rates = {currency.upper(): float(rate) for currency, rate in data['rates'].items()}
+        base = data.get('base', BASE_CURRENCY).upper()
+        if base != BASE_CURRENCY:
+            raise ValueError(f'rates are quoted in {base}, expected {BASE_CURRENCY}')
+        if rates.get(BASE_CURRENCY) != 1.0:
+            raise ValueError('the base currency must have a rate of 1')
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.error('Failed to load FX rates from %s: %s', path, e)
+        return False
+    rates.setdefault(BASE_CURRENCY, 1.0)
+    _rates = rates  # swapped in one assignment, readers never see a half-built table
+    _loaded_mtime = mtime
+    logger.info('Loaded FX rates for %s currencies.', len(rates))
+    return True
+
+
+def reload_if_changed(path=RATES_PATH):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return False
+    if mtime != _loaded_mtime:
+        return load_rates(path)
+    return False
+
+
+def currencies():
+    return sorted(_rates)
+
+
+def round_amount(amount, currency=BASE_CURRENCY):
+    """`amount` rounded to the minor unit of `currency`, as stored in the ledger."""
+    return round(amount, MINOR_UNITS.get(currency, DEFAULT_MINOR_UNITS))
+
+
+def convert(amount, from_currency, to_currency):
+    """Convert `amount` between two currencies using the in-memory table, rounded to the minor unit."""
+    if from_currency == to_currency:
+        return round_amount(amount, to_currency)
+    rates = _rates
+    try:
+        return round_amount(amount * rates[from_currency] / rates[to_currency], to_currency)
+    except KeyError as e:
+        raise UnknownCurrencyError(f'No FX rate for {e.args[0]}') from None
+
+
+# Background task: hot-reload the rate file
+async def run_rates_watcher(interval_seconds=RELOAD_CHECK_SECONDS):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        reload_if_changed()
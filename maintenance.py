@@ -0,0 +1,126 @@
+import sqlite3
+import logging
+import asyncio
+import time
+import os
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Online maintenance of banking_bot.db.
+# The scheduler only works while the bot is quiet (no update in flight and none for
+# QUIET_SECONDS) and in small steps run off the event loop: refreshing planner statistics
+# with PRAGMA optimize, returning free pages to the file system with incremental vacuum
+# and checkpointing the WAL without waiting on readers or writers. Each step holds the
+# write lock for at most a few milliseconds, so handlers never queue behind a long job.
+QUIET_SECONDS = 2
+CHECK_INTERVAL_SECONDS = 30
+STEP_BUDGET_SECONDS = 0.2     # total work per quiet period
+VACUUM_PAGES_PER_STEP = 256
+OPTIMIZE_INTERVAL_SECONDS = 6 * 3600
+ANALYSIS_LIMIT = 400          # rows sampled per index by the ANALYZE that optimize may run
+
+_last_update = 0.0
+_in_flight = 0
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Track handler activity so maintenance can wait for quiet periods."""
+
+    async def __call__(self, handler, event, data):
+        global _last_update, _in_flight
+        _in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            _in_flight -= 1
+            _last_update = time.monotonic()
+
+
+def is_quiet(quiet_seconds=QUIET_SECONDS):
+    return _in_flight == 0 and time.monotonic() - _last_update >= quiet_seconds
+
+
+def stats(db_path='banking_bot.db'):
+    """File size, free pages and WAL size of the database."""
+    connection = sqlite3.connect(db_path)
+    try:
+        page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+        page_count = connection.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = connection.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        connection.close()
+    wal_path = db_path + '-wal'
+    return {
+        'file_bytes': page_size * page_count,
+        'free_pages': free_pages,
+        'free_bytes': page_size * free_pages,
+        'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+    }
+
+
+def optimize(db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        connection.execute('PRAGMA optimize')
+    finally:
+        connection.close()
+
+
+def vacuum_step(pages=VACUUM_PAGES_PER_STEP, db_path='banking_bot.db'):
+    """Release up to `pages` free pages. Returns the number of free pages left."""
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        connection.execute(f'PRAGMA incremental_vacuum({pages})').fetchall()
+        return connection.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def checkpoint(db_path='banking_bot.db'):
+    """Copy what it can from the WAL into the database without blocking anyone. Returns (log pages, copied)."""
+    connection = sqlite3.connect(db_path)
+    try:
+        _, log_pages, checkpointed = connection.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        return log_pages, checkpointed
+    finally:
+        connection.close()
+
+
+def run_maintenance(budget_seconds=STEP_BUDGET_SECONDS, run_optimize=False, db_path='banking_bot.db'):
+    """
+    One time-boxed maintenance pass; vacuum steps stop as soon as the bot gets busy.
+    Returns the stats afterwards.
+    """
+    deadline = time.monotonic() + budget_seconds
+    if run_optimize:
+        optimize(db_path)
+    while time.monotonic() < deadline and is_quiet(0):
+        if vacuum_step(db_path=db_path) == 0:
+            break
+    checkpoint(db_path)
+    return stats(db_path)
+
+
+# Background task: maintain the database while the bot is quiet
+async def run_maintenance_scheduler(interval_seconds=CHECK_INTERVAL_SECONDS):
+    last_optimize = 0.0
+    while True:
+        await asyncio.sleep(interval_seconds)
+        if not is_quiet():
+            continue
+        run_optimize = time.monotonic() - last_optimize >= OPTIMIZE_INTERVAL_SECONDS
+        try:
+            result = await asyncio.to_thread(run_maintenance, run_optimize=run_optimize)
+        except sqlite3.Error as e:
+            logger.error('Database maintenance failed: %s', e)
+            continue
+        if run_optimize:
+            last_optimize = time.monotonic()
+        logger.log(
+            logging.INFO if run_optimize else logging.DEBUG,
+            'Database maintenance: %s bytes, %s free pages (%s bytes), WAL %s bytes.',
+            result['file_bytes'], result['free_pages'], result['free_bytes'], result['wal_bytes']
+        )
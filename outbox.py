@@ -0,0 +1,159 @@
+import sqlite3
+import logging
+import asyncio
+import json
+
+logger = logging.getLogger(__name__)
+
+# Durable outbox for the side effects of money operations.
+# A handler writes its follow-up steps (e.g. messages to send) into the outbox in the same
+# transaction as the money change, commits, then runs them right away with deliver(). Steps
+# that did not complete - the process died, Telegram was unreachable - stay pending and are
+# picked up by the worker in batches, with backoff. A step that fails for good is compensated
+# by its kind's compensate hook.
+GRACE_SECONDS = 30          # the worker leaves fresh steps to the handler that wrote them
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+MAX_ATTEMPTS = 8
+BATCH_SIZE = 200
+WORKER_INTERVAL_SECONDS = 15
+KEEP_FINISHED_DAYS = 7
+
+_kinds = {}  # kind -> (async run(payload), compensate(cursor, payload) or None)
+
+
+class PermanentError(Exception):
+    """Raised by a step that can never succeed, so it is compensated instead of retried."""
+
+
+def register(kind, run, compensate=None):
+    """Register how steps of `kind` are run, and optionally how a failed one is compensated."""
+    _kinds[kind] = (run, compensate)
+
+
+def enqueue(cursor, kind, payload):
+    """Add a step inside the caller's transaction. Returns its id."""
+    cursor.execute(
+        "INSERT INTO outbox (kind, payload, nextAttemptAt) VALUES (?, ?, datetime('now', ?))",
+        (kind, json.dumps(payload), f'+{GRACE_SECONDS} seconds')
+    )
+    return cursor.lastrowid
+
+
+async def _run_steps(rows, db_path):
+    """Run (id, kind, payload, attempts) steps and record the outcome of all of them at once."""
+    done = []
+    retries = []
+    failed = []
+    for step_id, kind, payload, attempts in rows:
+        run, _ = _kinds.get(kind, (None, None))
+        if run is None:
+            failed.append((step_id, kind, payload, f'unknown step kind {kind}'))
+            continue
+        try:
+            await run(json.loads(payload))
+        except PermanentError as e:
+            failed.append((step_id, kind, payload, str(e)))
+        except Exception as e:
+            if attempts + 1 >= MAX_ATTEMPTS:
+                failed.append((step_id, kind, payload, str(e)))
+            else:
+                delay = min(RETRY_BASE_SECONDS * 2 ** attempts, RETRY_MAX_SECONDS)
+                retries.append((f'+{delay} seconds', str(e), step_id))
+        else:
+            done.append((step_id,))
+
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.executemany("UPDATE outbox SET status = 'done' WHERE id = ? AND status = 'pending'", done)
+        cursor.executemany(
+            "UPDATE outbox SET attempts = attempts + 1, nextAttemptAt = datetime('now', ?), lastError = ? "
+            "WHERE id = ? AND status = 'pending'",
+            retries
+        )
+        for step_id, kind, payload, error in failed:
+            _, compensate = _kinds.get(kind, (None, None))
+            status = 'failed'
+            if compensate is not None:
+                compensate(cursor, json.loads(payload))
+                status = 'compensated'
+            cursor.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, lastError = ? WHERE id = ?",
+                (status, error, step_id)
+            )
+            logger.warning('Outbox step %s (%s) %s: %s', step_id, kind, status, error)
+        connection.commit()
+    finally:
+        connection.close()
+    return len(done), len(retries), len(failed)
+
+
+async def deliver(step_ids, db_path='banking_bot.db'):
+    """
+    Run freshly committed steps now instead of waiting for the worker. Never raises a database
+    error: the money change is already committed and the worker finishes whatever is left.
+    """
+    if not step_ids:
+        return 0, 0, 0
+    try:
+        connection = sqlite3.connect(db_path)
+        try:
+            placeholders = ', '.join('?' * len(step_ids))
+            rows = connection.execute(
+                f"SELECT id, kind, payload, attempts FROM outbox WHERE id IN ({placeholders}) AND status = 'pending' "
+                "ORDER BY id",
+                list(step_ids)
+            ).fetchall()
+        finally:
+            connection.close()
+        return await _run_steps(rows, db_path)
+    except sqlite3.Error as e:
+        logger.error('Delivering outbox steps %s failed, leaving them to the worker: %s', step_ids, e)
+        return 0, 0, 0
+
+
+async def process_pending(batch_size=BATCH_SIZE, db_path='banking_bot.db'):
+    """Run one batch of due steps. Returns (done, retried, failed)."""
+    connection = sqlite3.connect(db_path)
+    try:
+        rows = connection.execute(
+            "SELECT id, kind, payload, attempts FROM outbox "
+            "WHERE status = 'pending' AND nextAttemptAt <= datetime('now') ORDER BY id LIMIT ?",
+            (batch_size,)
+        ).fetchall()
+    finally:
+        connection.close()
+    if not rows:
+        return 0, 0, 0
+    return await _run_steps(rows, db_path)
+
+
+def purge_finished(days=KEEP_FINISHED_DAYS, db_path='banking_bot.db'):
+    """Delete finished steps older than `days`."""
+    connection = sqlite3.connect(db_path)
+    try:
+        cursor = connection.execute(
+            "DELETE FROM outbox WHERE status != 'pending' AND createdAt < datetime('now', ?)",
+            (f'-{days} days',)
+        )
+        connection.commit()
+        return cursor.rowcount
+    finally:
+        connection.close()
+
+
+# Background task: finish whatever the handlers could not, including after a restart
+async def run_outbox_worker(interval_seconds=WORKER_INTERVAL_SECONDS, batch_size=BATCH_SIZE):
+    while True:
+        try:
+            while True:
+                done, retried, failed = await process_pending(batch_size)
+                if done or retried or failed:
+                    logger.info('Outbox batch: %s done, %s retried, %s failed.', done, retried, failed)
+                if done + retried + failed < batch_size:
+                    break
+            purge_finished()
+        except sqlite3.Error as e:
+            logger.error('Outbox worker failed: %s', e)
+        await asyncio.sleep(interval_seconds)
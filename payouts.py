@@ -0,0 +1,316 @@
+import sqlite3
+import logging
+import asyncio
+import datetime
+
+from directory import find_by_phone, find_by_account
+import accounts
+import fx
+import velocity
+
+logger = logging.getLogger(__name__)
+
+# Batch payouts and recurring standing orders.
+# Both stage their transfers in a temp table and apply them with one bulk ledger insert;
+# the transactions trigger moves every balance, so the ledger always matches the accounts.
+# Every leg counts towards the transfer velocity limits (see velocity.py) like a single transfer.
+MAX_BATCH_ITEMS = 10000
+ORDERS_PER_RUN = 5000
+CHECK_INTERVAL_SECONDS = 3600
+
+
+class BatchError(Exception):
+    """Raised when a payout list cannot be executed as a whole."""
+
+
+def resolve_recipient(target):
+    """Resolve an 'ACC...' account number or a phone number to (user id, name, account id)."""
+    target = target.strip()
+    if target.upper().startswith('ACC'):
+        return find_by_account(target.upper())
+    return find_by_phone(target)
+
+
+def parse_payout_lines(text, with_interval=False):
+    """
+    Parse lines of '<phone or account> <amount>' (plus '<days>' for standing orders).
+    Returns (items, errors) where items are (user id, name, account id, amount[, days]) tuples.
+    """
+    items = []
+    errors = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        parts = line.replace(',', ' ').replace(';', ' ').split()
+        if not parts:
+            continue
+        expected = 3 if with_interval else 2
+        if len(parts) != expected:
+            errors.append(f'line {line_number}: expected {expected} values')
+            continue
+        try:
+            amount = float(parts[1])
+            days = int(parts[2]) if with_interval else None
+        except ValueError:
+            errors.append(f'line {line_number}: invalid number')
+            continue
+        if amount <= 0 or (with_interval and days <= 0):
+            errors.append(f'line {line_number}: values must be positive')
+            continue
+        recipient = resolve_recipient(parts[0])
+        if not recipient:
+            errors.append(f'line {line_number}: unknown recipient {parts[0]}')
+            continue
+        user_id, name, account_id = recipient
+        items.append((user_id, name, account_id, amount, days) if with_interval else (user_id, name, account_id, amount))
+    return items, errors
+
+
+def _credit_amount(sender_id, sender_account_id, recipient_id, recipient_account_id, amount):
+    """Amount in the recipient account's currency for `amount` in the sender account's currency."""
+    sender_account = accounts.get_account(sender_id, sender_account_id)
+    recipient_account = accounts.get_account(recipient_id, recipient_account_id)
+    if sender_account is None or recipient_account is None:
+        return amount
+    return fx.convert(amount, sender_account.currency, recipient_account.currency)
+
+
+def _stage(cursor, rows):
+    """
+    Load (sender id, sender account id, recipient id, recipient account id, amount, order id)
+    rows into temp.pending_transfers, converting the credited amount where currencies differ.
+    """
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS pending_transfers (
+            senderId INTEGER NOT NULL,
+            senderAccountId INTEGER NOT NULL,
+            recipientId INTEGER NOT NULL,
+            recipientAccountId INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            creditAmount REAL NOT NULL,
+            orderId INTEGER
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS temp.idx_pending_sender ON pending_transfers(senderAccountId)')
+    cursor.execute('DELETE FROM temp.pending_transfers')
+    cursor.executemany(
+        'INSERT INTO temp.pending_transfers VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [
+            (sender_id, sender_account_id, recipient_id, recipient_account_id, amount,
+             _credit_amount(sender_id, sender_account_id, recipient_id, recipient_account_id, amount), order_id)
+            for sender_id, sender_account_id, recipient_id, recipient_account_id, amount, order_id in rows
+        ]
+    )
+
+
+def _base_amount(amount, currency):
+    try:
+        return fx.convert(amount, currency, fx.BASE_CURRENCY)
+    except fx.UnknownCurrencyError as e:
+        raise BatchError(str(e)) from None
+
+
+def _apply_staged(cursor, actor, reason, transaction_type_out='Transfer Out', transaction_type_in='Transfer In'):
+    """Write both ledger legs for every staged row; the transactions trigger moves the money."""
+    cursor.execute(
+        '''
+        INSERT INTO transactions (accountId, amount, transactionType, counterpartyId, actor, reason)
+        SELECT senderAccountId, -amount, ?1, recipientId, ?3, ?4 FROM temp.pending_transfers
+        UNION ALL
+        SELECT recipientAccountId, creditAmount, ?2, senderId, ?3, ?4 FROM temp.pending_transfers
+        ''',
+        (transaction_type_out, transaction_type_in, actor, reason)
+    )
+
+
+def execute_batch(sender_id, items, db_path='banking_bot.db'):
+    """
+    Pay every (recipient id, name, account id, amount) item from the sender's active account
+    atomically: either all payouts are made or none is. Returns the total amount paid.
+    """
+    if not items:
+        raise BatchError('The payout list is empty.')
+    if len(items) > MAX_BATCH_ITEMS:
+        raise BatchError(f'A batch can hold at most {MAX_BATCH_ITEMS} payouts.')
+    sender_account = accounts.get_active_account(sender_id, db_path)
+    if sender_account is None:
+        raise BatchError('Sender account not found.')
+    items = [(recipient_id, name, account_id, fx.round_amount(amount, sender_account.currency))
+             for recipient_id, name, account_id, amount in items]
+    total = sum(item[3] for item in items)
+
+    # The whole batch is refused if any payout would break a blocking velocity limit
+    legs = [(sender_id, recipient_id, _base_amount(amount, sender_account.currency))
+            for recipient_id, _, _, amount in items]
+    for verdict in velocity.check_transfers(legs):
+        if verdict.action == 'block':
+            logger.warning('Batch of %s payouts from %s blocked: %s', len(items), sender_id, verdict.reason)
+            raise BatchError('The batch exceeds your transfer limits. Please split it up or try later.')
+        if verdict.action == 'flag':
+            logger.warning('Batch of %s payouts from %s flagged: %s', len(items), sender_id, verdict.reason)
+
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        balance = accounts.get_balance(cursor, sender_account.id)
+        if balance < total:
+            raise BatchError(
+                f'Insufficient balance: the batch needs {total:.2f} {sender_account.currency}, '
+                f'you have {balance:.2f} {sender_account.currency}.'
+            )
+
+        _stage(cursor, [
+            (sender_id, sender_account.id, recipient_id, account_id, amount, None)
+            for recipient_id, _, account_id, amount in items
+        ])
+        _apply_staged(cursor, f'user:{sender_id}', 'batch payout')
+        cursor.execute('COMMIT')
+    except BaseException:
+        if connection.in_transaction:
+            cursor.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+    velocity.record_transfers(legs)
+    logger.info('Batch of %s payouts (%.2f) executed for user %s.', len(items), total, sender_id)
+    return total
+
+
+def _today():
+    # Run dates are compared as UTC days, like the ledger's CURRENT_TIMESTAMP dates
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def create_standing_orders(sender_id, items, start_date=None, db_path='banking_bot.db'):
+    """
+    Create one standing order per (recipient id, name, account id, amount, interval days) item,
+    paid from the sender's active account.
+    """
+    start_date = start_date or _today()
+    sender_account = accounts.get_active_account(sender_id, db_path)
+    if sender_account is None:
+        raise BatchError('Sender account not found.')
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.executemany(
+            'INSERT INTO standing_orders (userId, fromAccountId, recipientId, toAccountId, amount, intervalDays, nextRunDate) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [
+                (sender_id, sender_account.id, recipient_id, account_id,
+                 fx.round_amount(amount, sender_account.currency), days, start_date)
+                for recipient_id, _, account_id, amount, days in items
+            ]
+        )
+        connection.commit()
+    finally:
+        connection.close()
+    return len(items)
+
+
+def run_due_orders(as_of=None, after_id=0, limit=ORDERS_PER_RUN, db_path='banking_bot.db'):
+    """
+    Execute up to `limit` standing orders with id > `after_id` due on or before `as_of`.
+    A sender whose balance cannot cover all of their due orders in the chunk is skipped until
+    the next run, and so is an order that would break a blocking velocity limit. An order that
+    fell behind is paid once and moves to its first run date after `as_of`.
+    Returns (orders executed, orders skipped, last order id looked at).
+    """
+    as_of = as_of or _today()
+    connection = sqlite3.connect(db_path, isolation_level=None)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute(
+            '''
+            SELECT o.userId, o.fromAccountId, o.recipientId, o.toAccountId, o.amount, o.id
+            FROM standing_orders o
+            WHERE o.active = 1 AND o.nextRunDate <= ? AND o.id > ?
+            ORDER BY o.id
+            LIMIT ?
+            ''',
+            (as_of, after_id, limit)
+        )
+        due = cursor.fetchall()
+        if not due:
+            cursor.execute('ROLLBACK')
+            return 0, 0, None
+        _stage(cursor, due)
+
+        # Drop every sending account that cannot fund all of its due orders
+        cursor.execute('''
+            DELETE FROM temp.pending_transfers
+            WHERE senderAccountId IN (
+                SELECT p.senderAccountId
+                FROM temp.pending_transfers p
+                LEFT JOIN accounts a ON a.id = p.senderAccountId
+                GROUP BY p.senderAccountId
+                HAVING COALESCE(MAX(a.balance), 0) < SUM(p.amount)
+            )
+        ''')
+        skipped = cursor.rowcount
+
+        # Then every order whose leg would break a blocking velocity limit
+        cursor.execute('''
+            SELECT p.orderId, p.senderId, p.recipientId, p.amount, a.currency
+            FROM temp.pending_transfers p
+            JOIN accounts a ON a.id = p.senderAccountId
+            ORDER BY p.orderId
+        ''')
+        staged = cursor.fetchall()
+        legs = [(sender_id, recipient_id, _base_amount(amount, currency))
+                for _, sender_id, recipient_id, amount, currency in staged]
+        limited = set()
+        for (order_id, *_), verdict in zip(staged, velocity.check_transfers(legs)):
+            if verdict.action == 'block':
+                logger.warning('Standing order %s blocked: %s', order_id, verdict.reason)
+                limited.add(order_id)
+        cursor.executemany('DELETE FROM temp.pending_transfers WHERE orderId = ?', [(order_id,) for order_id in limited])
+        skipped += len(limited)
+        legs = [leg for (order_id, *_), leg in zip(staged, legs) if order_id not in limited]
+
+        _apply_staged(cursor, 'system:standing_orders', 'standing order')
+        cursor.execute(
+            '''
+            UPDATE standing_orders
+            SET nextRunDate = date(
+                    nextRunDate,
+                    '+' || (intervalDays * (CAST(julianday(?1) - julianday(nextRunDate) AS INTEGER) / intervalDays + 1))
+                        || ' days'
+                ),
+                lastRunDate = ?1
+            WHERE id IN (SELECT orderId FROM temp.pending_transfers)
+            ''',
+            (as_of,)
+        )
+        executed = cursor.rowcount
+        cursor.execute('COMMIT')
+        velocity.record_transfers(legs)
+    except (sqlite3.Error, fx.UnknownCurrencyError, BatchError) as e:
+        if connection.in_transaction:
+            cursor.execute('ROLLBACK')
+        logger.error('Standing order run failed: %s', e)
+        return 0, 0, None
+    finally:
+        connection.close()
+
+    if executed or skipped:
+        logger.info('Standing orders as of %s: %s executed, %s skipped for insufficient funds or limits.', as_of, executed, skipped)
+    return executed, skipped, due[-1][5]
+
+
+def run_all_due_orders(as_of=None, db_path='banking_bot.db'):
+    """Walk every due order in chunks. Returns (orders executed, orders skipped)."""
+    executed = skipped = 0
+    last_id = 0
+    while last_id is not None:
+        chunk_executed, chunk_skipped, last_id = run_due_orders(as_of, last_id, db_path=db_path)
+        executed += chunk_executed
+        skipped += chunk_skipped
+    return executed, skipped
+
+
+# Background task: execute due standing orders
+async def run_standing_order_scheduler(interval_seconds=CHECK_INTERVAL_SECONDS):
+    while True:
+        await asyncio.to_thread(run_all_due_orders)
+        await asyncio.sleep(interval_seconds)
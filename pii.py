@@ -0,0 +1,130 @@
+import sqlite3
+import logging
+import os
+import hmac
+import hashlib
+import base64
+from collections import namedtuple, OrderedDict
+
+from dotenv import load_dotenv
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+logger = logging.getLogger(__name__)
+
+# Field-level encryption of the users' personal data.
+# name, email and phone are stored AES-GCM encrypted with the key from PII_KEY (.env), with
+# the column and the user id bound as associated data, so a ciphertext copied into another
+# column or another user's row fails to decrypt. Exact lookups go through blind index columns
+# (emailIndex, phoneIndex): a keyed HMAC of the normalized value, indexed like any other
+# column, which reveals nothing without the key. Decrypted profiles are kept in a bounded LRU cache.
+CIPHERTEXT_PREFIX = 'v2:'
+LEGACY_PREFIX = 'v1:'  # bound the column only; re-encrypted by database.migrate_encrypt_pii
+NONCE_BYTES = 12
+PROFILE_CACHE_SIZE = 10000
+
+Profile = namedtuple('Profile', ['name', 'email', 'phone'])
+
+_keys = None  # (AESGCM, index key)
+_profiles = OrderedDict()  # user id -> Profile, least recently used first
+
+
+def generate_key():
+    """A new random PII_KEY value."""
+    return base64.b64encode(AESGCM.generate_key(bit_length=256)).decode()
+
+
+def derive_key(label):
+    """A key for one purpose (`label`, bytes), derived from PII_KEY."""
+    load_dotenv()
+    secret = os.getenv('PII_KEY')
+    if not secret:
+        raise RuntimeError('PII_KEY is not set; generate one with `python -c "import pii; print(pii.generate_key())"`.')
+    return hmac.new(base64.b64decode(secret), label, hashlib.sha256).digest()
+
+
+def _load_keys():
+    global _keys
+    if _keys is None:
+        # Separate keys for encryption and indexing, derived from the one secret
+        _keys = (AESGCM(derive_key(b'pii-encryption')), derive_key(b'pii-blind-index'))
+    return _keys
+
+
+def is_encrypted(value):
+    return isinstance(value, str) and value.startswith((CIPHERTEXT_PREFIX, LEGACY_PREFIX))
+
+
+def is_legacy(value):
+    return isinstance(value, str) and value.startswith(LEGACY_PREFIX)
+
+
+def encrypt(field, value, user_id):
+    """Encrypt `value` for column `field` of user `user_id`; both are bound as associated data."""
+    cipher, _ = _load_keys()
+    nonce = os.urandom(NONCE_BYTES)
+    sealed = cipher.encrypt(nonce, value.encode(), f'{field}:{user_id}'.encode())
+    return CIPHERTEXT_PREFIX + base64.urlsafe_b64encode(nonce + sealed).decode()
+
+
+def _open(token, associated_data):
+    cipher, _ = _load_keys()
+    raw = base64.urlsafe_b64decode(token[len(CIPHERTEXT_PREFIX):])
+    return cipher.decrypt(raw[:NONCE_BYTES], raw[NONCE_BYTES:], associated_data.encode()).decode()
+
+
+def decrypt(field, token, user_id):
+    if not token.startswith(CIPHERTEXT_PREFIX):
+        raise ValueError(f'Not a current {field} ciphertext')
+    return _open(token, f'{field}:{user_id}')
+
+
+def decrypt_legacy(field, token):
+    """Decrypt a v1 ciphertext, which bound only the column; for the re-encryption migration."""
+    return _open(token, field)
+
+
+def blind_index(field, normalized_value):
+    _, index_key = _load_keys()
+    return hmac.new(index_key, f'{field}:{normalized_value}'.encode(), hashlib.sha256).hexdigest()
+
+
+def email_index(email):
+    return blind_index('email', email.strip().lower())
+
+
+def encrypt_user(user_id, name, email, phone):
+    """Column values (name, email, phone, emailIndex) for users row `user_id`; phoneIndex comes from directory.phone_key."""
+    return (
+        encrypt('name', name, user_id), encrypt('email', email, user_id), encrypt('phone', phone, user_id),
+        email_index(email)
+    )
+
+
+def cache_profile(user_id, profile):
+    _profiles[user_id] = profile
+    _profiles.move_to_end(user_id)
+    if len(_profiles) > PROFILE_CACHE_SIZE:
+        _profiles.popitem(last=False)
+
+
+def invalidate_profile(user_id):
+    _profiles.pop(user_id, None)
+
+
+def get_profile(user_id, db_path='banking_bot.db'):
+    """The user's decrypted name, email and phone, or None if they are not registered."""
+    profile = _profiles.get(user_id)
+    if profile is not None:
+        _profiles.move_to_end(user_id)
+        return profile
+
+    connection = sqlite3.connect(db_path)
+    try:
+        row = connection.execute('SELECT name, email, phone FROM users WHERE id = ?', (user_id,)).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return None
+    profile = Profile(*(decrypt(field, value, user_id) for field, value in zip(Profile._fields, row)))
+    cache_profile(user_id, profile)
+    return profile
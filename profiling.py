@@ -0,0 +1,229 @@
+import sys
+import os
+import re
+import random
+import asyncio
+import logging
+import linecache
+import threading
+import contextvars
+from collections import Counter, defaultdict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Opt-in wall-clock profiler for message handlers.
+# While enabled, a fraction of the updates is sampled: a background thread looks at the stack
+# of every sampled update every few milliseconds, whether its handler is running or suspended
+# on an await, and counts identical stacks per handler. The counts are written as collapsed
+# stacks ("frame;frame;frame count"), the input format of flamegraph.pl and speedscope.
+# When disabled the middleware is not registered at all, so updates pay nothing.
+PROFILE_DIR = 'profiles'
+SAMPLE_INTERVAL_MS = 5
+CATEGORIES = ('handler', 'sqlite', 'aiogram', 'telegram', 'waiting')
+
+# Time spent suspended inside a Bot API request (tracked by a session middleware) counts as Telegram I/O.
+# A running frame stopped on one of these lines is inside SQLite (the C call has no frame of its own)
+SQLITE_CALL = re.compile(r'\.(execute|executemany|executescript|fetchone|fetchall|fetchmany|commit|rollback)\(|sqlite3\.connect\(')
+TELEGRAM_IO_PATHS = (os.sep + os.path.join('aiogram', 'client', 'session') + os.sep, os.sep + 'aiohttp' + os.sep)
+AIOGRAM_PATH = os.sep + 'aiogram' + os.sep
+
+_stacks = defaultdict(Counter)    # handler -> Counter of collapsed stacks
+_categories = defaultdict(Counter)  # handler -> Counter of samples per category
+_updates = Counter()              # handler -> sampled updates
+_active = {}                      # token -> (handler, middleware frame, task, open Bot API requests)
+_lock = threading.Lock()          # the sampler thread writes the counters the loop reads in dump()
+_requests = contextvars.ContextVar('profiled_requests', default=None)
+
+
+def _label(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f'{module}:{getattr(code, "co_qualname", code.co_name)}'
+
+
+def _is_sqlite_call(frame):
+    return bool(SQLITE_CALL.search(linecache.getline(frame.f_code.co_filename, frame.f_lineno)))
+
+
+def _update_stack(top_frame, task, thread_frame):
+    """Frames of one sampled update below its middleware, oldest first, and whether it is running."""
+    frames = []
+    frame = thread_frame
+    while frame is not None and frame is not top_frame:
+        frames.append(frame)
+        frame = frame.f_back
+    if frame is top_frame:
+        frames.reverse()
+        return frames, True
+    # Suspended: follow the chain of awaited coroutines from the task's own coroutine instead
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+    for index, frame in enumerate(frames):
+        if frame is top_frame:
+            return frames[index + 1:], False
+    return [], False
+
+
+def _categorize(frames, running, in_request):
+    leaf = frames[-1] if frames else None
+    if leaf is not None and running and _is_sqlite_call(leaf):
+        return 'sqlite'
+    if in_request and not running:
+        return 'telegram'
+    for frame in frames:
+        if any(path in frame.f_code.co_filename for path in TELEGRAM_IO_PATHS):
+            return 'telegram'
+    if not running:
+        return 'waiting'
+    if leaf is not None and AIOGRAM_PATH in leaf.f_code.co_filename:
+        return 'aiogram'
+    return 'handler'
+
+
+def _take_sample(loop_thread_id):
+    thread_frame = sys._current_frames().get(loop_thread_id)
+    for handler, top_frame, task, requests in list(_active.values()):
+        frames, running = _update_stack(top_frame, task, thread_frame)
+        category = _categorize(frames, running, requests[0] > 0)
+        labels = [handler] + [_label(frame) for frame in frames]
+        if category == 'sqlite' or not running:
+            labels.append(f'[{category}]')
+        with _lock:
+            _stacks[handler][';'.join(labels)] += 1
+            _categories[handler][category] += 1
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, loop_thread_id, interval):
+        super().__init__(name='profiler', daemon=True)
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if _active:
+                _take_sample(self.loop_thread_id)
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Sample `rate` of the updates it sees."""
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    async def __call__(self, handler, event, data):
+        if random.random() >= self.rate:
+            return await handler(event, data)
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        token = object()
+        requests = [0]
+        _active[token] = (name, sys._getframe(), asyncio.current_task(), requests)
+        _updates[name] += 1
+        context_token = _requests.set(requests)
+        try:
+            return await handler(event, data)
+        finally:
+            _requests.reset(context_token)
+            del _active[token]
+
+
+class RequestTimingMiddleware(BaseRequestMiddleware):
+    """Mark the sampled update as waiting on Telegram while its Bot API requests are in flight."""
+
+    async def __call__(self, make_request, bot, method):
+        requests = _requests.get()
+        if requests is None:
+            return await make_request(bot, method)
+        requests[0] += 1
+        try:
+            return await make_request(bot, method)
+        finally:
+            requests[0] -= 1
+
+
+_middleware = None
+_request_middleware = None
+_sampler = None
+
+
+def is_enabled():
+    return _middleware is not None
+
+
+def enable(observer, session, rate, interval_ms=SAMPLE_INTERVAL_MS):
+    """
+    Start sampling `rate` (0-1] of the updates handled by `observer` (e.g. router.message);
+    `session` is the bot's session, whose requests are timed as Telegram I/O.
+    """
+    global _middleware, _request_middleware, _sampler
+    disable(observer, session)
+    _middleware = ProfilingMiddleware(rate)
+    observer.middleware(_middleware)
+    _request_middleware = RequestTimingMiddleware()
+    session.middleware(_request_middleware)
+    _sampler = _Sampler(threading.get_ident(), interval_ms / 1000)
+    _sampler.start()
+    logger.info('Profiling %s of updates every %s ms.', rate, interval_ms)
+
+
+def disable(observer, session):
+    global _middleware, _request_middleware, _sampler
+    if _middleware is None:
+        return
+    observer.middleware.unregister(_middleware)
+    session.middleware.unregister(_request_middleware)
+    _sampler.stopped.set()
+    _middleware = None
+    _request_middleware = None
+    _sampler = None
+    logger.info('Profiling stopped.')
+
+
+def dump(directory=PROFILE_DIR):
+    """
+    Write one collapsed-stack file per handler with everything sampled so far.
+    Returns {handler: (sampled updates, {category: share of samples})}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _lock:
+        stacks = {handler: counts.copy() for handler, counts in _stacks.items()}
+        categories = {handler: counts.copy() for handler, counts in _categories.items()}
+    summary = {}
+    for handler, counts in stacks.items():
+        with open(os.path.join(directory, f'{handler}.folded'), 'w', encoding='utf-8') as file:
+            for stack, count in counts.most_common():
+                file.write(f'{stack} {count}\n')
+        total = sum(categories[handler].values())
+        summary[handler] = (
+            _updates[handler],
+            {category: categories[handler][category] / total for category in CATEGORIES if categories[handler][category]}
+        )
+    return summary
+
+
+def reset():
+    with _lock:
+        _stacks.clear()
+        _categories.clear()
+    _updates.clear()
+
+
+def render_summary(summary):
+    if not summary:
+        return 'No samples yet.'
+    lines = []
+    for handler, (updates, shares) in sorted(summary.items()):
+        parts = ', '.join(f'{category} {share:.0%}' for category, share in shares.items())
+        lines.append(f'{handler} ({updates} updates): {parts}')
+    return '\n'.join(lines)
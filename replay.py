@@ -0,0 +1,453 @@
+import os
+import re
+import sys
+import json
+import time
+import hmac
+import shutil
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import argparse
+import datetime
+import tempfile
+from collections import defaultdict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Update, Message, Chat, User
+
+import pii
+import archive
+import database
+from directory import phone_key, normalize_phone_number
+
+logger = logging.getLogger(__name__)
+
+# Record and replay of incoming updates for performance regression testing.
+# With RECORD_UPDATES=<path> the bot appends every private text message to a JSON-lines
+# recording: its offset in seconds, a pseudonymous user id and the text with names, emails,
+# phone and account numbers replaced by keyed pseudonyms (derived from PII_KEY, so the same
+# person always maps to the same pseudonym and nothing can be reversed without the key).
+#
+#   python replay.py run recording.jsonl --db banking_bot.db --speed 10 --report new.json
+#   python replay.py compare old.json new.json
+#
+# `run` copies the database (best a backup taken when the recording started) into a temporary
+# directory, rewrites its users the same way the recorder rewrote the messages, and feeds the recording to the Dispatcher against the copy
+# through a fake Bot API session, at the original pace divided by --speed (0 = no pauses).
+# Updates of one user are handled in order. Background schedulers are not started and
+# admin commands do nothing (pseudonymous ids are never admins), so the report covers
+# update handling only: throughput and latency percentiles per handler, as JSON that
+# `compare` sets against a report from another version of the code.
+RECORDING_VERSION = 1
+REPLAY_NAME = 'Replay User'
+NAME_STATE = 'Registration:waiting_for_name'
+CONFIG_FILES = ('fx_rates.json', 'credit_rules.json')  # read from the working directory
+PERCENTILES = (0.5, 0.95, 0.99)
+
+# Tokens that can identify a person; phone candidates are checked for 10-15 digits
+EMAIL = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+PHONE = re.compile(r'(?<![\w.+-])\+?[\d()-]{10,20}(?![\w.-])')
+ACCOUNT = re.compile(r'\bACC(\d+)')
+
+_pseudonym_key = None
+
+
+def _digest(field, value):
+    global _pseudonym_key
+    if _pseudonym_key is None:
+        _pseudonym_key = pii.derive_key(b'replay-pseudonyms')
+    digest = hmac.new(_pseudonym_key, f'{field}:{value}'.encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def pseudo_user(user_id):
+    return _digest('user', user_id) % 2 ** 52 + 1
+
+
+def pseudo_email(email):
+    return f'u{_digest("email", email.strip().lower()) % 2 ** 52}@example.com'
+
+
+def pseudo_phone(phone):
+    return f'+7{_digest("phone", normalize_phone_number(phone)) % 10 ** 10:010d}'
+
+
+def pseudo_account_number(account_number):
+    return ACCOUNT.sub(lambda match: f'ACC{pseudo_user(int(match.group(1)))}', account_number)
+
+
+def _replace_phone(match):
+    digits = sum(character.isdigit() for character in match.group())
+    return pseudo_phone(match.group()) if 10 <= digits <= 15 else match.group()
+
+
+def anonymize_text(text, state=None):
+    """The message text with everything that identifies a person replaced by its pseudonym."""
+    if state == NAME_STATE:
+        return REPLAY_NAME
+    text = EMAIL.sub(lambda match: pseudo_email(match.group()), text)
+    text = pseudo_account_number(text)
+    return PHONE.sub(_replace_phone, text)
+
+
+class RecordingMiddleware(BaseMiddleware):
+    """Append anonymized private text messages to a recording (an outer middleware of dp.update)."""
+
+    def __init__(self, file):
+        self.file = file
+        self.started = time.monotonic()
+
+    async def __call__(self, handler, event, data):
+        message = event.message
+        if message is not None and message.text is not None and message.from_user is not None \
+                and message.chat.type == 'private':
+            record = {
+                't': round(time.monotonic() - self.started, 3),
+                'u': pseudo_user(message.from_user.id),
+                'x': anonymize_text(message.text, data.get('raw_state')),
+            }
+            self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        return await handler(event, data)
+
+
+_recorder = None
+_observer = None
+
+
+def start_recording(dispatcher, path):
+    """
+    Record the updates `dispatcher` receives, appending to `path`. Must be called after the
+    Dispatcher is created so the FSM middleware has run and the user's state is known.
+    """
+    global _recorder, _observer
+    stop_recording()
+    file = open(path, 'a', encoding='utf-8')
+    file.write(json.dumps({
+        'recording': RECORDING_VERSION,
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+    }) + '\n')
+    _recorder = RecordingMiddleware(file)
+    _observer = dispatcher.update
+    _observer.outer_middleware(_recorder)
+    logger.info('Recording updates to %s.', path)
+
+
+def stop_recording():
+    global _recorder, _observer
+    if _recorder is None:
+        return
+    _observer.outer_middleware.unregister(_recorder)
+    _recorder.file.close()
+    _recorder = None
+    _observer = None
+    logger.info('Update recording stopped.')
+
+
+def load_recording(path):
+    """[(offset seconds, user id, text)]; sessions appended to one file are played back to back."""
+    records = []
+    base = 0.0
+    last = 0.0
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'recording' in record:
+                base = last
+                continue
+            last = base + record['t']
+            records.append((last, record['u'], record['x']))
+    return records
+
+
+def _remap_transactions(cursor, schema):
+    # Rows written before the ledger fix may hold the telegram id in transactions.accountId
+    cursor.execute(
+        f'UPDATE {schema}.transactions SET accountId = pseudo_user(accountId) '
+        'WHERE accountId IN (SELECT id FROM main.users)'
+    )
+    cursor.execute(
+        f'UPDATE {schema}.transactions SET counterpartyId = pseudo_user(counterpartyId) '
+        'WHERE counterpartyId IS NOT NULL'
+    )
+
+
+def _plaintext(field, value, user_id):
+    return pii.decrypt(field, value, user_id) if pii.is_encrypted(value) else value
+
+
+def prepare_database(source, directory):
+    """
+    Copy `source` (and its transaction archives) into `directory` as banking_bot.db and
+    rewrite every telegram id, name, email, phone and account number to its pseudonym.
+    """
+    target = os.path.join(directory, 'banking_bot.db')
+    source_connection = sqlite3.connect(source)
+    connection = sqlite3.connect(target, isolation_level=None)
+    try:
+        source_connection.backup(connection)
+    finally:
+        source_connection.close()
+
+    connection.create_function('pseudo_user', 1, pseudo_user, deterministic=True)
+    connection.create_function('pseudo_account_number', 1, pseudo_account_number, deterministic=True)
+    cursor = connection.cursor()
+    try:
+        # A copy of an older database may still hold plaintext or v1 ciphertexts and normalizedPhone
+        database.migrate_encrypt_pii(connection)
+
+        # Archives first: their transactions are matched against the users before those are rewritten
+        cursor.execute('SELECT period, path FROM transaction_archives')
+        for period, path in cursor.fetchall():
+            archive_source = path if os.path.isabs(path) else os.path.join(os.path.dirname(source), path)
+            if not os.path.exists(archive_source):
+                logger.warning('Archive for period %s is missing: %s', period, archive_source)
+                continue
+            archive_name = f'banking_bot_archive_{period}.db'
+            shutil.copyfile(archive_source, os.path.join(directory, archive_name))
+            cursor.execute('UPDATE transaction_archives SET path = ? WHERE period = ?', (archive_name, period))
+            cursor.execute('ATTACH DATABASE ? AS archive', (os.path.join(directory, archive_name),))
+            archive.ensure_archive_schema(cursor, 'archive')
+            cursor.execute('BEGIN')
+            _remap_transactions(cursor, 'archive')
+            cursor.execute('COMMIT')
+            cursor.execute('DETACH DATABASE archive')
+
+        cursor.execute('BEGIN')
+        _remap_transactions(cursor, 'main')
+        cursor.execute('UPDATE accounts SET userId = pseudo_user(userId), accountNumber = pseudo_account_number(accountNumber)')
+        cursor.execute('UPDATE loans SET userId = pseudo_user(userId)')
+        cursor.execute('UPDATE standing_orders SET userId = pseudo_user(userId), recipientId = pseudo_user(recipientId)')
+        # Nothing queued in production may be delivered or resumed by the replay
+        cursor.execute('DELETE FROM outbox')
+        cursor.execute('DELETE FROM broadcast_deliveries')
+        cursor.execute('DELETE FROM broadcasts')
+
+        cursor.execute('SELECT id, email, phone FROM users')
+        rows = []
+        for user_id, email, phone in cursor.fetchall():
+            email = pseudo_email(_plaintext('email', email, user_id))
+            phone = pseudo_phone(_plaintext('phone', phone, user_id))
+            new_id = pseudo_user(user_id)
+            rows.append((new_id, *pii.encrypt_user(new_id, REPLAY_NAME, email, phone), phone_key(phone), user_id))
+        cursor.executemany(
+            'UPDATE users SET id = ?, name = ?, email = ?, phone = ?, emailIndex = ?, phoneIndex = ? WHERE id = ?',
+            rows
+        )
+        cursor.execute('COMMIT')
+    finally:
+        connection.close()
+    return target
+
+
+class ReplaySession(BaseSession):
+    """Answers Bot API requests locally after `latency` seconds, standing in for Telegram."""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            return Message(
+                message_id=self.requests,
+                date=datetime.datetime.now(),
+                chat=Chat(id=method.chat_id, type='private'),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Remember which handler took each replayed message."""
+
+    def __init__(self):
+        self.names = {}  # message id -> handler name
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        self.names[event.message_id] = handler_object.callback.__name__ if handler_object else 'unknown'
+        return await handler(event, data)
+
+
+def _latency(seconds):
+    values = sorted(seconds)
+    if not values:
+        return {}
+    summary = {f'p{int(q * 100)}': round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3) for q in PERCENTILES}
+    summary['max'] = round(values[-1] * 1000, 3)
+    return summary
+
+
+async def replay(records, speed=1.0, api_latency=0.0):
+    """Feed the records to the bot against banking_bot.db in the working directory. Returns the report."""
+    # Imported here: bot (through database) opens banking_bot.db in the working directory
+    import bot as bot_module
+    import events
+
+    bot_module.load_state()
+    bot_module.bot.session = ReplaySession(api_latency)
+    names = HandlerNameMiddleware()
+    bot_module.router.message.middleware(names)
+    bot_module.dp.include_router(bot_module.router)
+
+    # (handler, seconds, lag seconds, failed); lag is the wait past both the due time and the user's previous update
+    results = []
+
+    async def handle(number, user_id, text, previous, due):
+        ready = due
+        if previous is not None:
+            ready = max(ready, await previous)
+        started = time.perf_counter()
+        update = Update(update_id=number, message=Message(
+            message_id=number,
+            date=datetime.datetime.now(),
+            chat=Chat(id=user_id, type='private'),
+            from_user=User(id=user_id, is_bot=False, first_name=REPLAY_NAME),
+            text=text,
+        ))
+        failed = False
+        try:
+            await bot_module.dp.feed_update(bot_module.bot, update)
+        except Exception:
+            logger.exception('Replayed update %s failed', number)
+            failed = True
+        finished = time.perf_counter()
+        results.append((names.names.pop(number, 'unhandled'), finished - started, max(0.0, started - ready), failed))
+        return finished
+
+    origin = time.perf_counter()
+    last_task = {}  # user id -> task of their previous update
+    tasks = []
+    for number, (offset, user_id, text) in enumerate(records, start=1):
+        due = origin + offset / speed if speed else time.perf_counter()
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(handle(number, user_id, text, last_task.get(user_id), due))
+        last_task[user_id] = task
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+    await events.drain()
+    wall = time.perf_counter() - origin
+
+    by_handler = defaultdict(list)
+    for name, elapsed, _, failed in results:
+        by_handler[name].append((elapsed, failed))
+    return {
+        'updates': len(results),
+        'errors': sum(1 for result in results if result[3]),
+        'speed': speed,
+        'api_latency_ms': api_latency * 1000,
+        'wall_seconds': round(wall, 3),
+        'throughput': round(len(results) / wall, 2) if wall else 0.0,
+        'max_lag_ms': round(max((result[2] for result in results), default=0.0) * 1000, 3),
+        'latency_ms': _latency([result[1] for result in results]),
+        'handlers': {
+            name: {
+                'count': len(entries),
+                'errors': sum(1 for _, failed in entries if failed),
+                **_latency([elapsed for elapsed, _ in entries]),
+            }
+            for name, entries in sorted(by_handler.items())
+        },
+    }
+
+
+def render_report(report):
+    latency = report['latency_ms']
+    lines = [
+        f"{report['updates']} updates in {report['wall_seconds']} s: {report['throughput']} updates/s, "
+        f"{report['errors']} errors, max lag {report['max_lag_ms']} ms",
+        'all: ' + ', '.join(f'{key} {value} ms' for key, value in latency.items()),
+    ]
+    for name, stats in report['handlers'].items():
+        parts = ', '.join(f'{key} {stats[key]} ms' for key in ('p50', 'p95', 'p99'))
+        lines.append(f"{name} ({stats['count']}): {parts}")
+    return '\n'.join(lines)
+
+
+def _change(old, new):
+    return f'{old} -> {new} ({(new - old) / old:+.1%})' if old else f'{old} -> {new}'
+
+
+def compare(base, new):
+    """Side by side throughput and latency percentiles of two replay reports."""
+    lines = [
+        f"throughput: {_change(base['throughput'], new['throughput'])} updates/s",
+        f"errors: {base['errors']} -> {new['errors']}",
+    ]
+    for key in base['latency_ms']:
+        lines.append(f"all {key}: {_change(base['latency_ms'][key], new['latency_ms'].get(key, 0))} ms")
+    for name in sorted(set(base['handlers']) | set(new['handlers'])):
+        if name not in base['handlers'] or name not in new['handlers']:
+            lines.append(f'{name}: only in {"new" if name in new["handlers"] else "base"} report')
+            continue
+        old_stats, new_stats = base['handlers'][name], new['handlers'][name]
+        parts = '; '.join(f'{key} {_change(old_stats[key], new_stats[key])}' for key in ('p50', 'p95', 'p99'))
+        lines.append(f"{name} ({new_stats['count']}): {parts} ms")
+    return '\n'.join(lines)
+
+
+def run(recording, db_path, speed, api_latency_ms, report_path):
+    records = load_recording(recording)
+    report_path = os.path.abspath(report_path) if report_path else None
+    origin = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='replay-')
+    try:
+        prepare_database(os.path.abspath(db_path), directory)
+        for name in CONFIG_FILES:
+            if os.path.exists(name):
+                shutil.copyfile(name, os.path.join(directory, name))
+        # The modules open banking_bot.db and their config files relative to the working directory
+        os.chdir(directory)
+        report = asyncio.run(replay(records, speed, api_latency_ms / 1000))
+    finally:
+        os.chdir(origin)
+        shutil.rmtree(directory, ignore_errors=True)
+    report['recording'] = os.path.basename(recording)
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recording of updates against a copy of the database.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('recording')
+    run_parser.add_argument('--db', default='banking_bot.db')
+    run_parser.add_argument('--speed', type=float, default=1.0, help='pace multiplier; 0 replays without pauses')
+    run_parser.add_argument('--api-latency-ms', type=float, default=0.0, help='simulated Bot API round trip')
+    run_parser.add_argument('--report', help='write the report as JSON')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        os.environ.setdefault('BOT_TOKEN', '123456:replay')
+        print(render_report(run(args.recording, args.db, args.speed, args.api_latency_ms, args.report)))
+    else:
+        with open(args.base, encoding='utf-8') as base_file, open(args.new, encoding='utf-8') as new_file:
+            print(compare(json.load(base_file), json.load(new_file)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
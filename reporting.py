@@ -0,0 +1,102 @@
+import sqlite3
+import logging
+import asyncio
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Reporting queries run against a periodically refreshed copy of the live database,
+# so long aggregate reads never compete with the bot's money writes.
+SNAPSHOT_PATH = 'banking_bot_report.db'
+REFRESH_INTERVAL_SECONDS = 300
+BACKUP_PAGES_PER_STEP = 256
+
+
+def refresh_snapshot(db_path='banking_bot.db', snapshot_path=SNAPSHOT_PATH):
+    """
+    Copy the live database into the snapshot file with the sqlite3 backup API.
+    The copy is made in small page steps into a temporary file and then swapped in
+    atomically, so readers always see a complete snapshot.
+    """
+    started = time.perf_counter()
+    tmp_path = snapshot_path + '.tmp'
+    source = sqlite3.connect(db_path)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=0.001)
+    except sqlite3.Error as e:
+        logger.error('Reporting snapshot failed: %s', e)
+        target.close()
+        os.remove(tmp_path)
+        return False
+    finally:
+        source.close()
+    target.close()
+    os.replace(tmp_path, snapshot_path)
+    logger.info('Reporting snapshot refreshed in %.3fs.', time.perf_counter() - started)
+    return True
+
+
+def get_report_connection(snapshot_path=SNAPSHOT_PATH):
+    """Read-only connection to the latest snapshot."""
+    if not os.path.exists(snapshot_path):
+        refresh_snapshot(snapshot_path=snapshot_path)
+    return sqlite3.connect(f'file:{snapshot_path}?mode=ro', uri=True)
+
+
+def _run_report(query, params=(), snapshot_path=SNAPSHOT_PATH):
+    connection = get_report_connection(snapshot_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+def daily_totals(transaction_type, days=30, snapshot_path=SNAPSHOT_PATH):
+    """(day, count, total amount) for one transaction type over the last `days` days."""
+    return _run_report(
+        '''
+        SELECT date(transactionDate) AS day, COUNT(*), SUM(ABS(amount))
+        FROM transactions
+        WHERE transactionType = ? AND transactionDate >= date('now', ?)
+        GROUP BY day
+        ORDER BY day
+        ''',
+        (transaction_type, f'-{days} days'),
+        snapshot_path
+    )
+
+
+def daily_deposits(days=30, snapshot_path=SNAPSHOT_PATH):
+    return daily_totals('Deposit', days, snapshot_path)
+
+
+def daily_donations(days=30, snapshot_path=SNAPSHOT_PATH):
+    return daily_totals('Donation', days, snapshot_path)
+
+
+def outstanding_loan_book(snapshot_path=SNAPSHOT_PATH):
+    """(duration in months, active loans, principal issued, outstanding balance) per duration."""
+    return _run_report(
+        '''
+        SELECT durationMonths, COUNT(*), SUM(loanAmount), SUM(remainingBalance)
+        FROM loans
+        WHERE remainingBalance > 0
+        GROUP BY durationMonths
+        ORDER BY durationMonths
+        ''',
+        snapshot_path=snapshot_path
+    )
+
+
+# Background task that keeps the reporting snapshot fresh
+async def run_snapshot_refresher(interval_seconds=REFRESH_INTERVAL_SECONDS):
+    while True:
+        try:
+            await asyncio.to_thread(refresh_snapshot)
+        except (sqlite3.Error, OSError) as e:
+            logger.error('Reporting snapshot refresh failed: %s', e)
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,228 @@
+import sqlite3
+import logging
+import asyncio
+import json
+import os
+from collections import namedtuple
+
+import fx
+from archive import open_history_connection
+
+logger = logging.getLogger(__name__)
+
+# Credit decisions for the loan flow.
+# Per-user features are folded in from the ledger, archived periods included, incrementally
+# (everything above a high-water-mark id), loan state is cached per user and dropped whenever a
+# loan changes or accrues, and a decision is plain arithmetic over those cached values. The
+# repayment record is the worst overdue streak over all of the user's loans, repaid ones included.
+CONFIG_PATH = 'credit_rules.json'
+REFRESH_INTERVAL_SECONDS = 30
+
+DEFAULT_RULES = {
+    'min_limit': 5000,
+    'max_limit': 50000,
+    'base_rate': 0.23,
+    'min_rate': 0.15,
+    'max_overdue_days': 30,
+    'overdue_limit_cut_per_day': 0.02,
+    'features': {
+        'deposit_total': {'weight': 0.3, 'scale': 100000},
+        'average_balance': {'weight': 0.3, 'scale': 50000},
+        'repaid_loans': {'weight': 0.25, 'scale': 3},
+        'transfer_volume': {'weight': 0.15, 'scale': 100000},
+    },
+}
+
+Decision = namedtuple('Decision', ['eligible', 'limit', 'rate', 'reason'])
+
+_rules = dict(DEFAULT_RULES)
+_features = {}        # user id -> feature dict built from the ledger
+_loan_state = {}      # user id -> (has active loan, worst overdue days, repaid loans)
+_account_owner = {}   # accounts.id -> user id
+_account_currency = {}  # accounts.id -> currency; features are folded in the base currency
+_last_transaction_id = 0
+
+
+def load_rules(path=CONFIG_PATH):
+    """Load scoring rules from `path`, falling back to the defaults for missing keys."""
+    global _rules
+    rules = json.loads(json.dumps(DEFAULT_RULES))
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                overrides = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error('Failed to load credit rules from %s: %s', path, e)
+            overrides = {}
+        features = overrides.pop('features', {})
+        rules.update(overrides)
+        for name, settings in features.items():
+            rules['features'].setdefault(name, {}).update(settings)
+    _rules = rules
+    return rules
+
+
+def _empty_features():
+    return {
+        'deposit_total': 0.0,
+        'deposit_count': 0,
+        'running_balance': 0.0,
+        'balance_sum': 0.0,
+        'balance_samples': 0,
+        'average_balance': 0.0,
+        'transfer_volume': 0.0,
+    }
+
+
+def refresh_features(db_path='banking_bot.db'):
+    """Fold every transaction newer than the last refresh into the feature cache."""
+    global _last_transaction_id
+    # Closed periods live in the archives; without them a restart would rebuild smaller features
+    connection = open_history_connection(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT id, userId, currency FROM accounts')
+        for account_id, user_id, currency in cursor.fetchall():
+            _account_owner[account_id] = user_id
+            _account_currency[account_id] = currency
+        cursor.execute(
+            'SELECT id, accountId, amount, transactionType FROM all_transactions WHERE id > ? ORDER BY id',
+            (_last_transaction_id,)
+        )
+        rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error('Failed to refresh credit features: %s', e)
+        return 0
+    finally:
+        connection.close()
+
+    for transaction_id, account_id, amount, transaction_type in rows:
+        # Rows written before the ledger fix may still hold the telegram id in accountId
+        user_id = _account_owner.get(account_id, account_id)
+        features = _features.get(user_id)
+        if features is None:
+            features = _features[user_id] = _empty_features()
+        currency = _account_currency.get(account_id, fx.BASE_CURRENCY)
+        if currency != fx.BASE_CURRENCY:
+            try:
+                amount = fx.convert(amount, currency, fx.BASE_CURRENCY)
+            except fx.UnknownCurrencyError as e:
+                logger.warning('Scoring transaction %s at face value: %s', transaction_id, e)
+
+        if transaction_type == 'Deposit':
+            features['deposit_total'] += amount
+            features['deposit_count'] += 1
+        elif transaction_type in ('Transfer In', 'Transfer Out'):
+            features['transfer_volume'] += abs(amount)
+
+        features['running_balance'] += amount
+        features['balance_sum'] += features['running_balance']
+        features['balance_samples'] += 1
+        features['average_balance'] = features['balance_sum'] / features['balance_samples']
+
+    if rows:
+        _last_transaction_id = rows[-1][0]
+    return len(rows)
+
+
+def _load_loan_state(user_id, db_path):
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            '''
+            SELECT COALESCE(SUM(remainingBalance > 0), 0),
+                   COALESCE(MAX(worstOverdueDays), 0),
+                   COALESCE(SUM(remainingBalance <= 0), 0)
+            FROM loans
+            WHERE userId = ?
+            ''',
+            (user_id,)
+        )
+        active, overdue_days, repaid = cursor.fetchone()
+    finally:
+        connection.close()
+    state = (bool(active), overdue_days, repaid)
+    _loan_state[user_id] = state
+    return state
+
+
+def invalidate_loan_state(user_id):
+    """Call after a loan of `user_id` is issued or paid."""
+    _loan_state.pop(user_id, None)
+
+
+def clear_loan_state():
+    """Call after loans of many users change at once, e.g. an accrual run."""
+    _loan_state.clear()
+
+
+def score(features, repaid_loans, rules=None):
+    """Weighted score in [0, 1] from the configured features."""
+    rules = rules or _rules
+    values = dict(features or {})
+    values['repaid_loans'] = repaid_loans
+    total = 0.0
+    weights = 0.0
+    for name, settings in rules['features'].items():
+        weight = settings.get('weight', 0)
+        scale = settings.get('scale') or 1
+        total += weight * min(max(values.get(name, 0) / scale, 0.0), 1.0)
+        weights += weight
+    return total / weights if weights else 0.0
+
+
+def decide(user_id, db_path='banking_bot.db'):
+    """Return a Decision with a personalized limit and annual rate for `user_id`."""
+    rules = _rules
+    loan_state = _loan_state.get(user_id)
+    if loan_state is None:
+        loan_state = _load_loan_state(user_id, db_path)
+    has_active_loan, overdue_days, repaid_loans = loan_state
+
+    if has_active_loan:
+        return Decision(False, 0, None, 'You already have an active loan. Please repay it before requesting a new one.')
+    if overdue_days > rules['max_overdue_days']:
+        return Decision(False, 0, None, 'Your repayment record does not allow a new loan right now.')
+
+    user_score = score(_features.get(user_id), repaid_loans, rules)
+    limit = rules['min_limit'] + (rules['max_limit'] - rules['min_limit']) * user_score
+    limit *= max(1 - overdue_days * rules['overdue_limit_cut_per_day'], 0)
+    rate = rules['base_rate'] - (rules['base_rate'] - rules['min_rate']) * user_score
+    return Decision(True, round(limit, -2), round(rate, 4), None)
+
+
+def rescore_all(db_path='banking_bot.db'):
+    """Refresh the caches and return a Decision for every registered user."""
+    refresh_features(db_path)
+    _loan_state.clear()
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT id FROM users')
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            '''
+            SELECT userId,
+                   SUM(remainingBalance > 0),
+                   MAX(worstOverdueDays),
+                   SUM(remainingBalance <= 0)
+            FROM loans
+            GROUP BY userId
+            '''
+        )
+        for user_id, active, overdue_days, repaid in cursor.fetchall():
+            _loan_state[user_id] = (bool(active), overdue_days, repaid)
+    finally:
+        connection.close()
+
+    for user_id in user_ids:
+        _loan_state.setdefault(user_id, (False, 0, 0))
+    return {user_id: decide(user_id, db_path) for user_id in user_ids}
+
+
+# Background task that keeps the feature cache close to the ledger
+async def run_feature_refresher(interval_seconds=REFRESH_INTERVAL_SECONDS):
+    while True:
+        await asyncio.to_thread(refresh_features)
+        await asyncio.sleep(interval_seconds)
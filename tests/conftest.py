@@ -0,0 +1,33 @@
+import os
+import sys
+import base64
+import shutil
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database.py creates banking_bot.db in the working directory on import, so the tests run in
+# a scratch directory with copies of the config files and a fixed PII key
+os.environ.setdefault('PII_KEY', base64.b64encode(b'test-only-pii-key-of-32-bytes!!!').decode())
+WORKDIR = tempfile.mkdtemp(prefix='banking_bot_tests_')
+for name in ('fx_rates.json', 'credit_rules.json'):
+    shutil.copy(os.path.join(ROOT, name), WORKDIR)
+os.chdir(WORKDIR)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A freshly initialized database."""
+    from database import initialize_database
+
+    path = str(tmp_path / 'bank.db')
+    initialize_database(path)
+    return path
+
+
+def pytest_sessionfinish(session, exitstatus):
+    os.chdir(ROOT)
+    shutil.rmtree(WORKDIR, ignore_errors=True)
@@ -0,0 +1,89 @@
+import sqlite3
+import random
+import datetime
+
+import pytest
+
+import accrual
+
+AS_OF = '2024-03-15'
+
+
+def _fetch_loans(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+    loans = {row['id']: dict(row) for row in connection.execute('SELECT * FROM loans')}
+    connection.close()
+    return loans
+
+
+@pytest.fixture
+def loans_db(db_path):
+    """Active loans in various accrual and overdue states, some past their last installment."""
+    rng = random.Random(7)
+    base = datetime.date.fromisoformat(AS_OF)
+    rows = []
+    for _ in range(500):
+        amount = round(rng.uniform(1000, 50000), 2)
+        months = rng.choice([3, 6, 12])
+        rows.append((
+            rng.randint(1, 500), amount, months, amount / months, amount,
+            months if rng.random() > 0.05 else 0,
+            rng.choice([0.18, 0.23, 0.3]),
+            (base - datetime.timedelta(days=rng.choice([0, 1, 1, 1, 3]))).isoformat(),
+            (base + datetime.timedelta(days=rng.randint(-20, 30))).isoformat(),
+        ))
+    connection = sqlite3.connect(db_path)
+    connection.executemany(
+        'INSERT INTO loans (userId, loanAmount, durationMonths, monthlyPayment, remainingBalance, remainingMonths, '
+        'interestRate, lastAccrualDate, nextDueDate) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        rows
+    )
+    connection.commit()
+    connection.close()
+    return db_path
+
+
+def test_accrual_matches_reference(loans_db):
+    before = _fetch_loans(loans_db)
+    # Small batches cover the batch boundaries
+    assert accrual.run_accrual(AS_OF, batch_size=64, db_path=loans_db) > 0
+    after = _fetch_loans(loans_db)
+
+    for loan_id, loan in before.items():
+        expected, _, _ = accrual.accrue_loan_reference(loan, AS_OF)
+        actual = after[loan_id]
+        for column in ('remainingBalance', 'accruedInterest', 'accruedPenalty'):
+            assert actual[column] == pytest.approx(expected[column], abs=0.011), (loan_id, column)
+        for column in ('overdueDays', 'worstOverdueDays', 'lastAccrualDate'):
+            assert actual[column] == expected[column], (loan_id, column)
+
+
+def test_accrual_is_idempotent_per_day(loans_db):
+    accrual.run_accrual(AS_OF, db_path=loans_db)
+    accrued = _fetch_loans(loans_db)
+    assert accrual.run_accrual(AS_OF, db_path=loans_db) == 0
+    assert _fetch_loans(loans_db) == accrued
+
+
+def test_default_day_is_sqlite_utc_date(loans_db):
+    accrual.run_accrual(db_path=loans_db)
+    connection = sqlite3.connect(loans_db)
+    today, = connection.execute("SELECT date('now')").fetchone()
+    dates = {row[0] for row in connection.execute('SELECT lastAccrualDate FROM loans')}
+    connection.close()
+    assert dates == {today}
+
+
+@pytest.mark.parametrize('balance, remaining_months', [(1000.0, 6), (999.99, 3), (250.0, 0), (10.0, 1)])
+def test_reschedule_spreads_balance(balance, remaining_months):
+    installment, months = accrual.reschedule(balance, remaining_months)
+    assert months >= 1
+    assert installment * months == pytest.approx(balance)
+    if remaining_months == 0:
+        # Accrued after the last installment: due as one more installment
+        assert (installment, months) == (balance, 1)
+
+
+def test_reschedule_paid_off():
+    assert accrual.reschedule(0, 3) == (0, 0)
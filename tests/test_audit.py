@@ -0,0 +1,124 @@
+import sqlite3
+
+import audit
+
+
+def _open_account(db_path, account_id, balance=100.0):
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    audit.set_context(cursor, f'user:{account_id}', 'open account')
+    cursor.execute(
+        'INSERT INTO accounts (id, userId, accountNumber, accountType, balance) VALUES (?, ?, ?, ?, ?)',
+        (account_id, account_id, f'ACC{account_id}', 'savings', balance)
+    )
+    audit.commit(connection)
+    connection.close()
+
+
+def _deposit(db_path, account_id, amount, actor):
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "INSERT INTO transactions (accountId, amount, transactionType, actor, reason) VALUES (?, ?, 'Deposit', ?, 'deposit')",
+        (account_id, amount, actor)
+    )
+    connection.commit()
+    connection.close()
+
+
+def _log(db_path):
+    connection = sqlite3.connect(db_path)
+    rows = connection.execute(
+        'SELECT accountId, actor, reason, balanceBefore, balanceAfter FROM audit_log ORDER BY id'
+    ).fetchall()
+    connection.close()
+    return rows
+
+
+def test_ledger_entries_and_raw_sql_are_attributed(db_path):
+    _open_account(db_path, 1)
+    _open_account(db_path, 2)
+    _deposit(db_path, 1, 50.0, 'user:1')
+    # Direct SQL after a handler committed is not the handler's doing
+    connection = sqlite3.connect(db_path)
+    connection.execute('UPDATE accounts SET balance = balance + 5 WHERE id = 2')
+    connection.commit()
+    connection.close()
+    _deposit(db_path, 2, 10.0, None)
+
+    assert audit.seal_all(db_path=db_path) > 0
+    assert _log(db_path) == [
+        (1, 'user:1', 'open account', None, 100.0),
+        (2, 'user:2', 'open account', None, 100.0),
+        (1, 'user:1', 'deposit', 100.0, 150.0),
+        (2, 'sql', 'direct update', 100.0, 105.0),
+        (2, 'sql', 'deposit', 105.0, 115.0),
+    ]
+
+
+def test_context_ends_with_its_transaction(db_path):
+    _open_account(db_path, 1)
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    audit.set_context(cursor, 'user:1', 'abandoned')
+    connection.rollback()
+    cursor.execute('UPDATE accounts SET balance = 0 WHERE id = 1')
+    connection.commit()
+    connection.close()
+
+    audit.seal_all(db_path=db_path)
+    assert _log(db_path)[-1] == (1, 'sql', 'direct update', 100.0, 0.0)
+
+
+def test_sealed_balances_match_accounts(db_path):
+    for account_id in range(1, 4):
+        _open_account(db_path, account_id)
+    connection = sqlite3.connect(db_path)
+    for i in range(30):
+        connection.execute(
+            "INSERT INTO transactions (accountId, amount, transactionType) VALUES (?, ?, 'Deposit')",
+            (i % 3 + 1, i * 0.1)
+        )
+        if i % 7 == 0:
+            connection.execute('UPDATE accounts SET balance = balance * 2 WHERE id = ?', (i % 3 + 1,))
+        connection.commit()
+    connection.close()
+
+    # Small batches make the sealer cut both streams at batch boundaries
+    audit.seal_all(batch_size=4, db_path=db_path)
+    connection = sqlite3.connect(db_path)
+    assert connection.execute(
+        'SELECT COUNT(*) FROM accounts a JOIN audit_balances b ON b.accountId = a.id WHERE a.balance IS NOT b.balance'
+    ).fetchone()[0] == 0
+    connection.close()
+    last = {}
+    for account_id, _, _, _, balance_after in _log(db_path):
+        last[account_id] = balance_after
+    connection = sqlite3.connect(db_path)
+    assert last == dict(connection.execute('SELECT id, balance FROM accounts'))
+    connection.close()
+
+
+def test_verify_chain_detects_tampering_and_truncation(db_path):
+    _open_account(db_path, 1)
+    for amount in range(1, 21):
+        _deposit(db_path, 1, float(amount), 'user:1')
+    audit.seal_all(db_path=db_path)
+    head = audit.chain_head(db_path)
+    assert head[0] == 21
+    assert audit.verify_chain(db_path, expected_head=head) == (21, None)
+
+    connection = sqlite3.connect(db_path)
+    connection.execute('DROP TRIGGER audit_log_no_delete')
+    connection.execute('DELETE FROM audit_log WHERE id > 18')
+    connection.commit()
+    connection.close()
+    # Intact links, but the log no longer reaches the recorded head
+    assert audit.verify_chain(db_path) == (18, None)
+    assert audit.verify_chain(db_path, expected_head=head) == (18, 19)
+
+    connection = sqlite3.connect(db_path)
+    connection.execute('DROP TRIGGER audit_log_no_update')
+    connection.execute("UPDATE audit_log SET actor = 'someone else' WHERE id = 5")
+    connection.commit()
+    connection.close()
+    assert audit.verify_chain(db_path)[1] == 5
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+import fx
+
+
+@pytest.fixture(autouse=True)
+def restore_rates():
+    rates = fx._rates
+    yield
+    fx._rates = rates
+
+
+def _write_rates(tmp_path, data):
+    path = tmp_path / 'fx_rates.json'
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def test_load_rates(tmp_path):
+    path = _write_rates(tmp_path, {'base': 'KZT', 'rates': {'KZT': 1.0, 'USD': 480.0}})
+    assert fx.load_rates(path)
+    assert fx.convert(2, 'USD', 'KZT') == 960.0
+
+
+@pytest.mark.parametrize('data', [
+    # Internally consistent, but quoted against another currency
+    {'base': 'USD', 'rates': {'USD': 1.0, 'KZT': 0.0021}},
+    {'base': 'KZT', 'rates': {'KZT': 2.0, 'USD': 480.0}},
+    {'rates': {'USD': 480.0}},
+])
+def test_load_rates_keeps_table_on_bad_file(tmp_path, data):
+    fx.load_rates(_write_rates(tmp_path, {'base': 'KZT', 'rates': {'KZT': 1.0, 'USD': 480.0}}))
+    assert not fx.load_rates(_write_rates(tmp_path, data))
+    assert fx.convert(1, 'USD', 'KZT') == 480.0
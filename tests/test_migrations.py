@@ -0,0 +1,51 @@
+import sqlite3
+import logging
+
+import archive
+from database import initialize_database
+
+
+def test_telegram_ids_remapped_in_live_and_archived_rows(db_path, caplog):
+    connection = sqlite3.connect(db_path)
+    # Account 2 belongs to telegram user 1, so rows holding 1 cannot be told apart
+    connection.executemany(
+        "INSERT INTO accounts (id, userId, accountNumber, accountType, balance) VALUES (?, ?, ?, 'savings', 0)",
+        [(1, 1001, 'ACC1001'), (2, 1, 'ACC1')]
+    )
+    # Written by the old handlers: confirm_loan, transfers and payments keyed by telegram id
+    connection.executemany(
+        'INSERT INTO transactions (accountId, transactionDate, amount, transactionType) VALUES (?, ?, ?, ?)',
+        [
+            (1001, '2020-05-01 10:00:00', 3000.0, 'Loan'),
+            (1001, '2020-06-01 10:00:00', -100.0, 'Loan Payment'),
+            (1001, '2021-01-10 10:00:00', -50.0, 'Transfer Out'),
+            (1, '2021-01-10 10:00:00', 50.0, 'Transfer In'),
+            (1, '2021-02-01 10:00:00', 500.0, 'Loan'),
+        ]
+    )
+    connection.commit()
+    connection.close()
+    assert archive.archive_transactions(pause=0, db_path=db_path) == 5
+
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "INSERT INTO transactions (accountId, amount, transactionType) VALUES (1001, -200.0, 'Loan Payment')"
+    )
+    # A database from before the migration
+    connection.execute('DROP TABLE balance_checkpoints')
+    connection.execute('DROP TABLE balance_checkpoint_runs')
+    connection.commit()
+    connection.close()
+
+    with caplog.at_level(logging.INFO, logger='database'):
+        initialize_database(db_path)
+    assert 'Pointed 4 transactions' in caplog.text
+    assert '2 transactions have an accountId that is both' in caplog.text
+
+    # The ambiguous rows stay on account 1 as well
+    history = archive.get_transaction_history(1, db_path=db_path)
+    assert sorted(amount for _, amount, _ in history) == [-200.0, -100.0, -50.0, 50.0, 500.0, 3000.0]
+    assert archive.get_statement_totals(1, db_path=db_path)[:2] == [('2020', 2900.0, 2), ('2021', 500.0, 3)]
+    connection = sqlite3.connect(db_path)
+    assert connection.execute('SELECT COUNT(*) FROM balance_snapshots WHERE accountId = 1001').fetchone()[0] == 0
+    connection.close()
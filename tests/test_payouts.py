@@ -0,0 +1,22 @@
+import sqlite3
+
+import payouts
+
+
+def test_standing_orders_use_the_utc_date(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.executemany(
+        "INSERT INTO accounts (id, userId, accountNumber, accountType, balance) VALUES (?, ?, ?, 'savings', 1000)",
+        [(1, 1001, 'ACC1001'), (2, 1002, 'ACC1002')]
+    )
+    connection.commit()
+    today, = connection.execute("SELECT date('now')").fetchone()
+    connection.close()
+
+    assert payouts.create_standing_orders(1001, [(1002, 'Name', 2, 100.0, 30)], db_path=db_path) == 1
+    connection = sqlite3.connect(db_path)
+    assert connection.execute('SELECT nextRunDate FROM standing_orders').fetchone()[0] == today
+    connection.close()
+
+    # Due today in UTC, so the default run pays it
+    assert payouts.run_all_due_orders(db_path=db_path) == (1, 0)
@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+import archive
+import scoring
+
+
+def _reset_features():
+    scoring._features.clear()
+    scoring._account_owner.clear()
+    scoring._account_currency.clear()
+    scoring._last_transaction_id = 0
+
+
+@pytest.fixture
+def ledger(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.execute(
+        "INSERT INTO accounts (id, userId, accountNumber, accountType, balance) VALUES (1, 7, 'ACC7', 'savings', 0)"
+    )
+    connection.executemany(
+        "INSERT INTO transactions (accountId, transactionDate, amount, transactionType) VALUES (1, ?, ?, ?)",
+        [
+            ('2020-03-01 10:00:00', 40000.0, 'Deposit'),
+            ('2020-04-01 10:00:00', -5000.0, 'Transfer Out'),
+            ('2021-02-01 10:00:00', 20000.0, 'Deposit'),
+        ]
+    )
+    connection.execute("INSERT INTO transactions (accountId, amount, transactionType) VALUES (1, 1000.0, 'Deposit')")
+    connection.commit()
+    connection.close()
+    _reset_features()
+    yield db_path
+    _reset_features()
+
+
+def test_features_include_archived_periods(ledger):
+    scoring.refresh_features(ledger)
+    before = dict(scoring._features[7])
+
+    assert archive.archive_transactions(pause=0, db_path=ledger) == 3
+    # A restart rebuilds the cache from scratch
+    _reset_features()
+    assert scoring.refresh_features(ledger) == 4
+    assert scoring._features[7] == before
+    assert before['deposit_total'] == 61000.0
+    assert before['transfer_volume'] == 5000.0
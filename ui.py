@@ -0,0 +1,161 @@
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+
+# Static keyboards and message templates, built once at import time.
+# Handlers never mutate them, so one instance can be shared by every reply.
+
+CANCEL_TEXT = "❌ Cancel"
+
+MAIN_MENU_ROWS = (
+    ('ℹ️ My Info',),
+    ('💸 Take a Loan', '🎁 Donate to Charity'),
+    ('💵 Deposit', '📤 Transfer'),
+    ('📅 Pay Monthly Loan', '💼 My Accounts'),
+)
+REGISTER_ROWS = (('📝 Register',),)
+CANCEL_ROWS = ((CANCEL_TEXT,),)
+LOAN_DURATION_ROWS = (('3 months', '6 months'), ('12 months', CANCEL_TEXT))
+TRANSFER_METHOD_ROWS = (
+    ('📱 By Phone', '🧾 By Account Number'),
+    ('📦 Batch Transfer', '🔁 Standing Order'),
+    (CANCEL_TEXT,),
+)
+PAYMENT_OPTION_ROWS = (('📅 Pay Monthly', '💵 Pay Full'), ('✏️ Pay Custom Amount', CANCEL_TEXT))
+OPEN_ACCOUNT_TEXT = "➕ Open Account"
+ACCOUNT_TYPE_ROWS = (('savings', 'current'), (CANCEL_TEXT,))
+
+
+def build_keyboard(rows, one_time=False):
+    """Build a ReplyKeyboardMarkup from rows of button texts."""
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=text) for text in row] for row in rows],
+        resize_keyboard=True,
+        one_time_keyboard=True if one_time else None
+    )
+
+
+MAIN_MENU = build_keyboard(MAIN_MENU_ROWS)
+MAIN_MENU_ONE_TIME = build_keyboard(MAIN_MENU_ROWS, one_time=True)
+REGISTER_KEYBOARD = build_keyboard(REGISTER_ROWS, one_time=True)
+CANCEL_KEYBOARD = build_keyboard(CANCEL_ROWS)
+LOAN_DURATION_KEYBOARD = build_keyboard(LOAN_DURATION_ROWS)
+TRANSFER_METHOD_KEYBOARD = build_keyboard(TRANSFER_METHOD_ROWS)
+PAYMENT_OPTIONS_KEYBOARD = build_keyboard(PAYMENT_OPTION_ROWS)
+ACCOUNT_TYPE_KEYBOARD = build_keyboard(ACCOUNT_TYPE_ROWS)
+
+CURRENCY_SYMBOLS = {'KZT': '₸', 'USD': '$', 'EUR': '€', 'RUB': '₽'}
+
+
+def currency_symbol(currency):
+    return CURRENCY_SYMBOLS.get(currency, currency)
+
+
+def build_accounts_keyboard(account_numbers):
+    """One button per account number, followed by the open/cancel row."""
+    return build_keyboard(tuple((number,) for number in account_numbers) + ((OPEN_ACCOUNT_TEXT, CANCEL_TEXT),))
+
+
+# Message templates for the dynamic replies
+INFO_CARD = (
+    "ℹ️ Your Info:\n"
+    "👤 Name: {name}\n"
+    "📧 Email: {email}\n"
+    "💳 Account Number: {account_number}\n"
+    "💰 Balance: {balance:.2f} {symbol}\n"
+)
+INFO_CARD_LOAN = (
+    "🔻 Total Loan Amount: {loan_amount:.2f} ₸\n"
+    "🗓️ Months Left to Pay: {months_left} months\n"
+)
+INFO_CARD_NO_LOAN = "✔️ You have no outstanding loans.\n"
+
+LOAN_DETAILS = (
+    "📊 Loan Details:\n"
+    "💰 Loan Amount: {loan_amount:.2f} ₸\n"
+    "🗓️ Duration: {duration} months\n"
+    "📅 Monthly Payment: {monthly_payment:.2f} ₸\n"
+    "🔻 Total Repayment (with interest): {total_repayment:.2f} ₸\n\n"
+    "Confirm loan? (Yes/No)"
+)
+
+LOAN_SUMMARY = (
+    "📊 Loan Summary:\n"
+    "🔸 Remaining Balance: {remaining_balance:.2f} ₸\n"
+    "📅 Monthly Payment: {monthly_payment:.2f} ₸\n"
+    "🗓️ Remaining Months: {remaining_months}\n"
+    "💵 Your Account Balance: {user_balance:.2f} {symbol}\n\n"
+    "Choose an option to proceed:"
+)
+
+PAYMENT_RECEIPT = (
+    "✅ Payment of {payment_amount:.2f} ₸ processed successfully.\n"
+    "💵 Updated Account Balance: {user_balance:.2f} {symbol}\n"
+    "🔸 Remaining Loan Balance: {remaining_balance:.2f} ₸\n"
+)
+PAYMENT_RECEIPT_MONTHS_LEFT = "🗓️ Remaining Months: {remaining_months} months."
+PAYMENT_RECEIPT_REPAID = "🎉 Your loan is fully repaid!"
+
+STATEMENT_HEADER = "📄 Statement for {number}, last {days} days\nOpening balance: {opening:.2f} {symbol}\n"
+STATEMENT_LINE = "{date} · {type} · {amount:+.2f} {symbol}\n"
+STATEMENT_EARLIER = "… {count} earlier transactions\n"
+STATEMENT_FOOTER = "Closing balance: {closing:.2f} {symbol}"
+STATEMENT_MAX_LINES = 30
+
+ACCOUNT_LINE = "{marker} {number} · {type} · {balance:.2f} {symbol}\n"
+ACCOUNTS_FOOTER = "\nTap an account number to make it active, or open a new one."
+
+
+def render_info_card(name, email, account_number, balance, loan_amount=None, months_left=None, currency='KZT'):
+    text = INFO_CARD.format(
+        name=name, email=email, account_number=account_number, balance=balance, symbol=currency_symbol(currency)
+    )
+    if loan_amount and months_left:
+        return text + INFO_CARD_LOAN.format(loan_amount=loan_amount, months_left=months_left)
+    return text + INFO_CARD_NO_LOAN
+
+
+def render_loan_details(loan_amount, duration, monthly_payment, total_repayment):
+    return LOAN_DETAILS.format(
+        loan_amount=loan_amount, duration=duration,
+        monthly_payment=monthly_payment, total_repayment=total_repayment
+    )
+
+
+def render_loan_summary(remaining_balance, monthly_payment, remaining_months, user_balance, currency='KZT'):
+    return LOAN_SUMMARY.format(
+        remaining_balance=remaining_balance, monthly_payment=monthly_payment,
+        remaining_months=remaining_months, user_balance=user_balance, symbol=currency_symbol(currency)
+    )
+
+
+def render_payment_receipt(payment_amount, user_balance, remaining_balance, remaining_months, currency='KZT'):
+    text = PAYMENT_RECEIPT.format(
+        payment_amount=payment_amount, user_balance=user_balance, remaining_balance=remaining_balance,
+        symbol=currency_symbol(currency)
+    )
+    if remaining_months > 0:
+        return text + PAYMENT_RECEIPT_MONTHS_LEFT.format(remaining_months=remaining_months)
+    return text + PAYMENT_RECEIPT_REPAID
+
+
+def render_accounts(accounts, balances, active_id):
+    """List the user's accounts with their balances; the active one is marked."""
+    lines = ["💼 Your Accounts:\n"]
+    for account in accounts:
+        lines.append(ACCOUNT_LINE.format(
+            marker='▶️' if account.id == active_id else '▫️', number=account.number, type=account.type,
+            balance=balances.get(account.id, 0), symbol=currency_symbol(account.currency)
+        ))
+    return ''.join(lines) + ACCOUNTS_FOOTER
+
+
+def render_statement(account_number, days, statement, currency='KZT'):
+    """Opening balance, the latest transactions of the period and the closing balance."""
+    symbol = currency_symbol(currency)
+    lines = [STATEMENT_HEADER.format(number=account_number, days=days, opening=statement.opening, symbol=symbol)]
+    rows = statement.transactions
+    if len(rows) > STATEMENT_MAX_LINES:
+        lines.append(STATEMENT_EARLIER.format(count=len(rows) - STATEMENT_MAX_LINES))
+        rows = rows[-STATEMENT_MAX_LINES:]
+    for date, amount, transaction_type in rows:
+        lines.append(STATEMENT_LINE.format(date=date[:16], type=transaction_type, amount=amount, symbol=symbol))
+    return ''.join(lines) + STATEMENT_FOOTER.format(closing=statement.closing, symbol=symbol)
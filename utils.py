@@ -1,4 +1,158 @@
 import logging
+import logging.handlers
+import contextvars
+import datetime
+import json
+import queue
+import random
+import time
 
-# Set up logging configuration
-logging.basicConfig(level=logging.INFO, filename='banking_bot.log', format='%(asctime)s - %(levelname)s - %(message)s')
\ No newline at end of file
+from aiogram import BaseMiddleware
+
+# Logging setup.
+# Callers only put records on an in-memory queue; a background QueueListener thread formats
+# them as JSON lines and writes them to a size-rotated file, so no file I/O happens on the
+# event loop. Messages use %-style arguments and are only formatted by the listener.
+LOG_PATH = 'banking_bot.log'
+MAX_LOG_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+SLOW_HANDLER_MS = 1000
+
+# Fraction of DEBUG records kept per logger name (a prefix matches its child loggers)
+DEFAULT_SAMPLE_RATES = {
+    'handlers': 0.1,
+}
+
+# aiogram logs every handled update at INFO; LoggingMiddleware already records the same latency
+QUIET_LOGGERS = {
+    'aiogram.event': logging.WARNING,
+}
+
+# Per-update context (user id, handler, FSM state) attached to every record logged while
+# the update is handled
+_context = contextvars.ContextVar('log_context', default=None)
+CONTEXT_FIELDS = ('user_id', 'handler', 'state', 'latency_ms')
+
+handler_logger = logging.getLogger('handlers')
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the current update context onto the record (runs in the caller, before queueing)."""
+
+    def filter(self, record):
+        context = _context.get()
+        if context:
+            for field, value in context.items():
+                if not hasattr(record, field):
+                    setattr(record, field, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the DEBUG records of noisy loggers."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._cache = {}  # logger name -> rate, resolved once per name
+
+    def _rate(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            for prefix, prefix_rate in self.rates.items():
+                if name == prefix or name.startswith(prefix + '.'):
+                    rate = prefix_rate
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record as is. The stock handler formats the message
+    before enqueueing it; the queue never leaves the process, so that work is left to the listener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=logging.INFO, path=LOG_PATH, max_bytes=MAX_LOG_BYTES,
+                  backup_count=LOG_BACKUP_COUNT, sample_rates=None, console=True):
+    """
+    Route every log record through a queue to the file (and console) handlers.
+    Returns the started listener; stop it on shutdown to flush what is still queued.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s'))
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(DEFAULT_SAMPLE_RATES if sample_rates is None else sample_rates))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, logger_level in QUIET_LOGGERS.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class LoggingMiddleware(BaseMiddleware):
+    """Bind the user, handler and FSM state to the log context and record each handler's latency."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        user = getattr(event, 'from_user', None)
+        token = _context.set({
+            'user_id': user.id if user else None,
+            'handler': handler_object.callback.__name__ if handler_object else None,
+            'state': data.get('raw_state'),
+        })
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            level = logging.WARNING if latency_ms >= SLOW_HANDLER_MS else logging.DEBUG
+            handler_logger.log(level, 'Handled update in %s ms', latency_ms, extra={'latency_ms': latency_ms})
+            _context.reset(token)
@@ -0,0 +1,223 @@
+import sqlite3
+import logging
+import asyncio
+import time
+import threading
+from collections import namedtuple
+
+import fx
+
+logger = logging.getLogger(__name__)
+
+# Real-time velocity checks for transfers, batch payouts and standing orders.
+# Counts and amounts are kept per sender, per recipient and per sender/recipient pair over
+# sliding windows. Each key holds one compact ring buffer of its transfers from the last 24h.
+WINDOWS = (60, 3600, 86400)  # seconds, shortest first
+
+# (scope, window, max count, max amount, action); a transfer that would push a counter
+# past its limit triggers the action. 'block' rules win over 'flag' rules.
+RULES = (
+    ('sender', 60, 5, 200000, 'block'),
+    ('sender', 3600, 30, 1000000, 'block'),
+    ('sender', 86400, 100, 3000000, 'block'),
+    ('pair', 60, 3, 150000, 'block'),
+    ('pair', 86400, 20, 1000000, 'flag'),
+    ('recipient', 3600, 50, 2000000, 'flag'),
+    ('sender', 3600, 10, 300000, 'flag'),
+)
+
+Verdict = namedtuple('Verdict', ['action', 'reason'])
+ALLOW = Verdict('allow', None)
+
+_WINDOW_INDEX = {window: i for i, window in enumerate(WINDOWS)}
+
+
+class SlidingCounter:
+    """Count and sum of the events of one key for every window in WINDOWS."""
+
+    __slots__ = ('times', 'amounts', 'cursors', 'counts', 'sums')
+
+    def __init__(self):
+        self.times = []
+        self.amounts = []
+        self.cursors = [0] * len(WINDOWS)  # first event still inside each window
+        self.counts = [0] * len(WINDOWS)
+        self.sums = [0.0] * len(WINDOWS)
+
+    def expire(self, now):
+        times = self.times
+        amounts = self.amounts
+        size = len(times)
+        for i, window in enumerate(WINDOWS):
+            cursor = self.cursors[i]
+            limit = now - window
+            while cursor < size and times[cursor] <= limit:
+                self.counts[i] -= 1
+                self.sums[i] -= amounts[cursor]
+                cursor += 1
+            self.cursors[i] = cursor
+
+        # Events older than the longest window are dead; drop them once they are half the buffer
+        head = self.cursors[-1]
+        if head > 32 and head * 2 > size:
+            del times[:head]
+            del amounts[:head]
+            self.cursors = [cursor - head for cursor in self.cursors]
+
+    def add(self, now, amount):
+        self.times.append(now)
+        self.amounts.append(amount)
+        for i in range(len(WINDOWS)):
+            self.counts[i] += 1
+            self.sums[i] += amount
+
+    def is_empty(self):
+        return self.counts[-1] == 0
+
+
+_counters = {'sender': {}, 'recipient': {}, 'pair': {}}
+_lock = threading.Lock()  # standing orders are checked from the scheduler's worker thread
+
+
+def _keys(sender_id, recipient_id):
+    if recipient_id is None:
+        # Transfers recorded before counterpartyId existed only count towards the sender
+        return {'sender': sender_id}
+    return {'sender': sender_id, 'recipient': recipient_id, 'pair': (sender_id, recipient_id)}
+
+
+def _check(sender_id, recipient_id, amount, now, pending=None):
+    keys = _keys(sender_id, recipient_id)
+    counters = {}
+    for scope, key in keys.items():
+        counter = _counters[scope].get(key)
+        if counter is not None:
+            counter.expire(now)
+            counters[scope] = counter
+
+    verdict = ALLOW
+    for scope, window, max_count, max_amount, action in RULES:
+        counter = counters.get(scope)
+        if counter is None:
+            count, total = 0, 0.0
+        else:
+            i = _WINDOW_INDEX[window]
+            count, total = counter.counts[i], counter.sums[i]
+        if pending and scope in keys:
+            # Earlier transfers of the same batch fall inside every window
+            pending_count, pending_total = pending.get((scope, keys[scope]), (0, 0.0))
+            count += pending_count
+            total += pending_total
+
+        if count + 1 > max_count or total + amount > max_amount:
+            reason = f'{scope} limit of {max_count} transfers / {max_amount} ₸ per {window}s exceeded'
+            if action == 'block':
+                return Verdict('block', reason)
+            verdict = Verdict('flag', reason)
+    return verdict
+
+
+def check_transfer(sender_id, recipient_id, amount, now=None):
+    """Return the Verdict for a transfer of `amount` in the base currency that is about to be committed."""
+    now = time.time() if now is None else now
+    with _lock:
+        return _check(sender_id, recipient_id, amount, now)
+
+
+def check_transfers(transfers, now=None):
+    """
+    Verdicts for (sender id, recipient id, amount) transfers committed together, each one
+    checked as if the ones before it had already been recorded.
+    """
+    now = time.time() if now is None else now
+    pending = {}
+    verdicts = []
+    with _lock:
+        for sender_id, recipient_id, amount in transfers:
+            verdict = _check(sender_id, recipient_id, amount, now, pending)
+            verdicts.append(verdict)
+            if verdict.action == 'block':
+                continue
+            for scope, key in _keys(sender_id, recipient_id).items():
+                count, total = pending.get((scope, key), (0, 0.0))
+                pending[scope, key] = (count + 1, total + amount)
+    return verdicts
+
+
+def _record(sender_id, recipient_id, amount, now):
+    for scope, key in _keys(sender_id, recipient_id).items():
+        counter = _counters[scope].get(key)
+        if counter is None:
+            counter = _counters[scope][key] = SlidingCounter()
+        else:
+            counter.expire(now)
+        counter.add(now, amount)
+
+
+def record_transfer(sender_id, recipient_id, amount, now=None):
+    """Count a committed transfer."""
+    now = time.time() if now is None else now
+    with _lock:
+        _record(sender_id, recipient_id, amount, now)
+
+
+def record_transfers(transfers, now=None):
+    """Count committed (sender id, recipient id, amount) transfers."""
+    now = time.time() if now is None else now
+    with _lock:
+        for sender_id, recipient_id, amount in transfers:
+            _record(sender_id, recipient_id, amount, now)
+
+
+def prune(now=None):
+    """Drop counters with no transfers in the last 24h."""
+    now = time.time() if now is None else now
+    with _lock:
+        for counters in _counters.values():
+            for key in list(counters):
+                counters[key].expire(now)
+                if counters[key].is_empty():
+                    del counters[key]
+
+
+# Rebuild the counters from the last 24 hours of the transactions table
+def rebuild(db_path='banking_bot.db'):
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            f'''
+            SELECT CAST(strftime('%s', t.transactionDate) AS INTEGER), a.userId, t.counterpartyId, -t.amount, a.currency
+            FROM transactions t
+            JOIN accounts a ON a.id = t.accountId
+            WHERE t.transactionType = 'Transfer Out' AND t.transactionDate >= datetime('now', '-{max(WINDOWS)} seconds')
+            ORDER BY t.id
+            '''
+        )
+        rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error('Failed to rebuild velocity counters: %s', e)
+        return 0
+    finally:
+        connection.close()
+
+    # Limits are in the base currency
+    with _lock:
+        for counters in _counters.values():
+            counters.clear()
+        for timestamp, sender_id, recipient_id, amount, currency in rows:
+            if currency != fx.BASE_CURRENCY:
+                try:
+                    amount = fx.convert(amount, currency, fx.BASE_CURRENCY)
+                except fx.UnknownCurrencyError as e:
+                    logger.warning('Counting a transfer at face value: %s', e)
+            _record(sender_id, recipient_id, amount, timestamp)
+    logger.info('Velocity counters rebuilt from %s transfers.', len(rows))
+    return len(rows)
+
+
+# Background task that releases the counters of keys that went quiet
+async def run_velocity_pruner(interval_seconds=3600):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        prune()